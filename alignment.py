@@ -0,0 +1,119 @@
+import numpy as np
+
+# config.json の "alignment" の既定値
+DEFAULT_SEARCH_RADIUS = 16
+DEFAULT_MIN_CONFIDENCE = 0.05
+
+def _next_fast_len(n):
+    """n以上で、素因数が2, 3, 5のみの整数 (FFTが高速に計算できるサイズ) を返す。"""
+    while True:
+        m = n
+        for p in (2, 3, 5):
+            while m % p == 0:
+                m //= p
+        if m == 1:
+            return n
+        n += 1
+
+class RegionAligner:
+    """
+    スキャンごとの数ピクセルのずれを補正するため、各領域の切り抜き位置を画像ごとに合わせ込むクラス。
+
+    基準画像から各領域を search_radius だけ広げた範囲 (参照パッチ) を切り出しておき、
+    対象画像の同じ範囲との位相相関 (FFTによる相互相関) のピークから、領域ごとのずれ量を求めます。
+    全領域のパッチを同じサイズの配列にまとめ、FFT・正規化・ピーク検出を一括で行うため、
+    1枚あたりの処理時間は数ミリ秒程度です。
+
+    相関のピークが min_confidence 未満の領域 (余白のみの領域など) は、
+    信頼できる他の領域のずれ量の中央値 (それも無ければずれ無し) を使用します。
+    """
+    def __init__(self, reference_img, img_regions, search_radius=DEFAULT_SEARCH_RADIUS,
+                 min_confidence=DEFAULT_MIN_CONFIDENCE):
+        self.boxes = np.asarray(img_regions, dtype=np.int64).reshape(-1, 4) # [x1, y1, x2, y2] の配列
+        self.img_regions = [tuple(region) for region in self.boxes.tolist()]
+        self.search_radius = int(search_radius)
+        self.min_confidence = min_confidence
+
+        r = self.search_radius
+        # 参照パッチの範囲 (領域を探索半径だけ広げたもの)
+        self._windows = [(x1 - r, y1 - r, x2 + r, y2 + r) for x1, y1, x2, y2 in self.img_regions]
+        max_height = max((y2 - y1 for _, y1, _, y2 in self._windows), default=1)
+        max_width = max((x2 - x1 for x1, _, x2, _ in self._windows), default=1)
+        # 循環相関の折り返しが探索範囲に入らないよう、探索半径分の余白をとってFFTサイズを決める
+        self._fft_shape = (_next_fast_len(max_height + r), _next_fast_len(max_width + r))
+
+        # パッチ端の不連続が相関に現れないよう、パッチごとにハン窓をかける
+        height, width = self._fft_shape
+        self._tapers = np.zeros((len(self._windows), height, width), dtype=np.float32)
+        for i, (x1, y1, x2, y2) in enumerate(self._windows):
+            self._tapers[i, :y2 - y1, :x2 - x1] = np.outer(np.hanning(y2 - y1), np.hanning(x2 - x1))
+
+        # 探索範囲 (-r〜+r) に対応する相関配列の行・列 (負のずれは末尾に折り返される)
+        self._shift_values = np.r_[0:r + 1, -r:0]
+        self._search_rows = self._shift_values % height
+        self._search_cols = self._shift_values % width
+
+        self._reference_spectra = np.conj(np.fft.rfft2(self._extract_windows(self._to_gray(reference_img))))
+
+    @staticmethod
+    def _to_gray(img):
+        return np.asarray(img.convert("L"), dtype=np.float32)
+
+    def _extract_windows(self, gray):
+        """各領域の範囲を切り出し、平均を引いて窓をかけたパッチの配列 (領域数, 高さ, 幅) を返す。"""
+        gray_height, gray_width = gray.shape
+        batch = np.zeros(self._tapers.shape, dtype=np.float32)
+        for i, (x1, y1, x2, y2) in enumerate(self._windows):
+            # 画像の外にはみ出した部分は0 (= 平均値) のままにする
+            sx1, sy1 = max(x1, 0), max(y1, 0)
+            sx2, sy2 = min(x2, gray_width), min(y2, gray_height)
+            if sx2 <= sx1 or sy2 <= sy1:
+                continue
+            patch = gray[sy1:sy2, sx1:sx2]
+            batch[i, sy1 - y1:sy2 - y1, sx1 - x1:sx2 - x1] = patch - patch.mean()
+        batch *= self._tapers
+        return batch
+
+    def estimate_shifts(self, img):
+        """
+        基準画像に対する各領域のずれ量を推定します。
+
+        Args:
+            img (PIL.Image.Image): 対象画像。
+
+        Returns:
+            tuple: (ずれ量の配列 (領域数, 2) [dx, dy], 相関ピークの配列 (領域数,))
+        """
+        if not self._windows:
+            return np.zeros((0, 2), dtype=int), np.zeros(0)
+        batch = self._extract_windows(self._to_gray(img))
+        cross_power = np.fft.rfft2(batch) * self._reference_spectra
+        cross_power /= np.maximum(np.abs(cross_power), 1e-6)
+        correlation = np.fft.irfft2(cross_power, s=self._fft_shape)
+
+        # 探索範囲だけを取り出して、領域ごとのピーク位置を一括で求める
+        search = correlation[:, self._search_rows[:, None], self._search_cols[None, :]]
+        flat = search.reshape(len(self._windows), -1)
+        peak_index = flat.argmax(axis=1)
+        confidence = flat[np.arange(len(flat)), peak_index]
+        n = len(self._shift_values)
+        shifts = np.stack([self._shift_values[peak_index % n], self._shift_values[peak_index // n]], axis=1)
+
+        # 相関の弱い領域は、信頼できる領域のずれ量の中央値で代用する
+        reliable = confidence >= self.min_confidence
+        fallback = np.round(np.median(shifts[reliable], axis=0)).astype(int) if reliable.any() else np.zeros(2, dtype=int)
+        shifts[~reliable] = fallback
+        return shifts, confidence
+
+    def align_regions(self, img):
+        """
+        ずれを補正した切り抜き範囲のリストを返します。
+
+        Args:
+            img (PIL.Image.Image): 対象画像。
+
+        Returns:
+            list: [left, upper, right, lower] のリスト (領域の順序は初期化時と同じ)。
+        """
+        shifts, _ = self.estimate_shifts(img)
+        return (self.boxes + np.tile(shifts, (1, 2))).tolist()
@@ -0,0 +1,83 @@
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+# 起動時に読み込まれてはいけない重いライブラリ (出力時・エディタを開いたときに読み込む)
+HEAVY_MODULES = ("PIL", "numpy", "openpyxl", "pptx", "lxml")
+
+# 子プロセスで実行する計測コード: main の読み込みと、メインウィンドウが最初に描画されるまでの時間を測る
+_CHILD_CODE = """
+import sys, json, time
+started = time.perf_counter()
+import tkinter as tk
+import main
+imported = time.perf_counter()
+window_seconds = None
+try:
+    root = tk.Tk()
+    app = main.ImageToOfficeApp(root)
+    root.update()
+    window_seconds = time.perf_counter() - started
+    root.destroy()
+except tk.TclError:
+    pass # ディスプレイが無い環境では読み込み時間のみを計測する
+print(json.dumps({
+    "import_seconds": imported - started,
+    "window_seconds": window_seconds,
+    "heavy_modules": [name for name in %r if name in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+def measure_once(app_dir):
+    """新しいPythonプロセスで1回計測する。プロセスの起動時間を含めた全体の時間も返す。"""
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", _CHILD_CODE], cwd=app_dir, capture_output=True, text=True)
+    total_seconds = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip())
+    measurement = json.loads(result.stdout.strip().splitlines()[-1])
+    measurement["process_seconds"] = total_seconds
+    return measurement
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="メインウィンドウの起動時間を計測し、基準を超えた場合は終了コード1を返します。")
+    parser.add_argument("--runs", type=int, default=5, help="計測回数 (中央値で判定する)")
+    parser.add_argument("--max-seconds", type=float, default=0.8,
+                        help="起動時間 (ウィンドウの描画まで。ディスプレイが無い場合は main の読み込みまで) の上限")
+    args = parser.parse_args(argv)
+
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    measure_once(app_dir) # 1回目はバイトコードのコンパイルなどを含むため、計測から除外する
+    measurements = [measure_once(app_dir) for _ in range(args.runs)]
+
+    import_median = statistics.median(m["import_seconds"] for m in measurements)
+    process_median = statistics.median(m["process_seconds"] for m in measurements)
+    window_times = [m["window_seconds"] for m in measurements if m["window_seconds"] is not None]
+    window_median = statistics.median(window_times) if window_times else None
+    heavy_modules = sorted({name for m in measurements for name in m["heavy_modules"]})
+
+    print(f"import main:          {import_median * 1000:7.1f} ms (median of {args.runs})")
+    if window_median is not None:
+        print(f"window drawn:         {window_median * 1000:7.1f} ms")
+    else:
+        print("window drawn:         (no display; not measured)")
+    print(f"whole process:        {process_median * 1000:7.1f} ms (including interpreter startup and exit)")
+
+    failed = False
+    startup_seconds = window_median if window_median is not None else import_median
+    if startup_seconds > args.max_seconds:
+        print(f"FAIL: startup took {startup_seconds:.3f} s (limit {args.max_seconds:.3f} s)")
+        failed = True
+    if heavy_modules:
+        print(f"FAIL: heavy modules imported at startup: {', '.join(heavy_modules)}")
+        failed = True
+    if not failed:
+        print("OK")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
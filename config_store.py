@@ -0,0 +1,272 @@
+import os
+import json
+import tempfile
+
+REGIONS_KEY = "image_regions_and_excel_coords"
+
+DEFAULT_CONFIG = {
+    REGIONS_KEY: [
+        {"img_region": [100, 100, 200, 150], "excel_pos": "B2"}
+    ],
+    "excel_to_pptx_conversion_params": {
+        "col_width_pix": 64, "row_height_pix": 20, "dpi": 96
+    }
+}
+
+class ConfigValidationError(ValueError):
+    """設定ファイルの内容が想定している形式と異なる場合の例外。errorsに問題点の一覧を保持する。"""
+    def __init__(self, errors):
+        super().__init__("\n".join(errors))
+        self.errors = errors
+
+def validate_config(config):
+    """
+    設定の主要な項目の型を確認します (領域の数に比例する軽い検査のみを行う)。
+
+    Returns:
+        list: 問題点のメッセージのリスト。問題が無ければ空のリスト。
+    """
+    if not isinstance(config, dict):
+        return ["設定ファイルの最上位がオブジェクトではありません。"]
+    errors = []
+    _validate_regions(config.get(REGIONS_KEY, []), errors)
+    profiles = config.get("region_profiles")
+    if profiles is not None:
+        if not isinstance(profiles, dict):
+            errors.append("region_profiles がオブジェクトではありません。")
+            profiles = {}
+        for name, profile in profiles.items():
+            if not isinstance(profile, dict):
+                errors.append(f"region_profiles の {name} がオブジェクトではありません。")
+                continue
+            _validate_regions(profile.get(REGIONS_KEY, []), errors, f"region_profiles の {name}: ")
+            match = profile.get("match")
+            if match is None:
+                continue
+            if not isinstance(match, dict) or not set(match) <= {"filename_pattern", "image_size", "reference_image"}:
+                errors.append(f"region_profiles の {name}: match は filename_pattern / image_size / reference_image を持つオブジェクトではありません。")
+            elif not (isinstance(match.get("filename_pattern") or "", str) and isinstance(match.get("reference_image") or "", str)
+                      and (match.get("image_size") is None or _is_image_size(match["image_size"]))):
+                errors.append(f"region_profiles の {name}: match の filename_pattern と reference_image は文字列、image_size は [幅, 高さ] で指定してください。")
+    alignment = config.get("alignment")
+    if alignment is not None:
+        if not isinstance(alignment, dict) or not set(alignment) <= {"enabled", "search_radius", "reference_image", "min_confidence"}:
+            errors.append("alignment は enabled / search_radius / reference_image / min_confidence を持つオブジェクトではありません。")
+        elif not (isinstance(alignment.get("search_radius", 0), int) and alignment.get("search_radius", 0) >= 0
+                  and isinstance(alignment.get("min_confidence", 0), (int, float))
+                  and isinstance(alignment.get("reference_image") or "", str)):
+            errors.append("alignment の search_radius は0以上の整数、min_confidence は数値、reference_image は文字列で指定してください。")
+    templates = config.get("output_templates")
+    if templates is not None:
+        if not isinstance(templates, dict) or not set(templates) <= {"excel", "pptx"}:
+            errors.append("output_templates は excel / pptx を持つオブジェクトではありません。")
+        elif not all(isinstance(templates.get(key) or "", str) for key in ("excel", "pptx")):
+            errors.append("output_templates の excel / pptx はテンプレートファイルのパス (文字列) で指定してください。")
+    conv_params = config.get("excel_to_pptx_conversion_params", {})
+    if not isinstance(conv_params, dict):
+        errors.append("excel_to_pptx_conversion_params がオブジェクトではありません。")
+    compression = config.get("output_compression")
+    if compression is not None:
+        if not isinstance(compression, dict) or not set(compression) <= {"store_media", "compress_level", "threads"}:
+            errors.append("output_compression は store_media / compress_level / threads を持つオブジェクトではありません。")
+        elif compression.get("compress_level", 6) not in range(10) or not isinstance(compression.get("threads", 0), int):
+            errors.append("output_compression の compress_level は0〜9、threads は整数で指定してください。")
+    isolation = config.get("image_isolation")
+    if isolation is not None:
+        if not isinstance(isolation, dict) or not set(isolation) <= {"enabled", "timeout_seconds", "memory_limit_mb"}:
+            errors.append("image_isolation は enabled / timeout_seconds / memory_limit_mb を持つオブジェクトではありません。")
+        elif not all(isinstance(isolation.get(key, 1), (int, float)) and isolation.get(key, 1) > 0
+                     for key in ("timeout_seconds", "memory_limit_mb")):
+            errors.append("image_isolation の timeout_seconds と memory_limit_mb は正の数で指定してください。")
+    contact_sheet = config.get("contact_sheet")
+    if contact_sheet is not None:
+        layout_keys = ("columns", "rows_per_sheet", "rows_per_slide", "spacing")
+        if not isinstance(contact_sheet, dict) or not set(contact_sheet) <= {"enabled"} | set(layout_keys):
+            errors.append("contact_sheet は enabled / columns / rows_per_sheet / rows_per_slide / spacing を持つオブジェクトではありません。")
+        elif not all(isinstance(contact_sheet.get(key, 1), int) and contact_sheet.get(key, 1) >= (0 if key == "spacing" else 1)
+                     for key in layout_keys):
+            errors.append("contact_sheet の columns / rows_per_sheet / rows_per_slide は1以上、spacing は0以上の整数で指定してください。")
+    return errors
+
+
+def _validate_regions(regions, errors, location=""):
+    """領域のリスト (image_regions_and_excel_coords) の形式を確認する。location はメッセージの先頭に付ける場所。"""
+    if not isinstance(regions, list):
+        errors.append(f"{location}{REGIONS_KEY} がリストではありません。")
+        return
+    for i, item in enumerate(regions):
+        if not isinstance(item, dict):
+            errors.append(f"{location}領域 {i + 1} がオブジェクトではありません。")
+            continue
+        img_region = item.get("img_region")
+        if not (isinstance(img_region, list) and len(img_region) == 4
+                and all(isinstance(v, (int, float)) for v in img_region)):
+            errors.append(f"{location}領域 {i + 1} の img_region が [x1, y1, x2, y2] の形式ではありません。")
+        if not isinstance(item.get("excel_pos"), str):
+            errors.append(f"{location}領域 {i + 1} の excel_pos が文字列ではありません。")
+
+def _is_image_size(size):
+    return isinstance(size, list) and len(size) == 2 and all(isinstance(v, int) and v > 0 for v in size)
+
+
+def write_json_atomic(path, data, indent=4):
+    """
+    一時ファイルに書き込んでから置き換えることで、JSONファイルをアトミックに保存します
+    (書き込み中に中断されても、元のファイルか新しいファイルのどちらかが残る)。
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix="." + os.path.splitext(os.path.basename(path))[0] + "-", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=indent, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+class ConfigStore:
+    """
+    config.json の内容をメインウィンドウと各エディタで共有するストア。
+
+    - 設定は data (常に同じdictオブジェクト) としてメモリ上に保持し、各ウィンドウはファイルを読み直さずにこれを参照します。
+    - set() で変更すると subscribe() で登録したコールバックに変更されたキーが通知されます。
+    - ファイルへの書き込みは save_delay_ms だけ遅延させ、その間の変更をまとめて1回で保存します。
+      書き込みは一時ファイルに書いてから置き換えるため、途中で中断されても壊れたファイルが残りません。
+
+    tk_rootを指定しない場合 (コマンドラインからの利用など) は、変更のたびに即座に保存します。
+    """
+    def __init__(self, config_path, tk_root=None, save_delay_ms=500, on_save_error=None):
+        self.config_path = config_path
+        self.tk_root = tk_root
+        self.save_delay_ms = save_delay_ms
+        self.on_save_error = on_save_error # on_save_error(例外) の形式で呼ばれる
+        self.data = {}
+        self._subscribers = []
+        self._save_job = None
+        self._file_signature = None # 最後に読み書きしたときの (更新時刻, サイズ)
+
+    def _current_signature(self):
+        try:
+            stat = os.stat(self.config_path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def load(self, validate=True):
+        """
+        設定ファイルを読み込みます。
+
+        Raises:
+            FileNotFoundError: 設定ファイルが存在しない場合。
+            json.JSONDecodeError: JSONの形式が不正な場合。
+            ConfigValidationError: validate=True で、内容の形式に問題がある場合 (読み込んだ内容は data に反映済み)。
+        """
+        signature = self._current_signature()
+        with open(self.config_path, 'r', encoding='utf-8') as f:
+            loaded = json.load(f)
+        if not isinstance(loaded, dict):
+            raise ConfigValidationError(["設定ファイルの最上位がオブジェクトではありません。"])
+        self.data.clear()
+        self.data.update(loaded)
+        self._file_signature = signature
+        self._notify(None, None)
+        if validate:
+            errors = validate_config(self.data)
+            if errors:
+                raise ConfigValidationError(errors)
+
+    def reload_if_changed(self):
+        """
+        他のプログラムで設定ファイルが書き換えられていれば読み込み直します。
+        更新時刻とサイズが前回の読み書き時と同じであれば、ファイルを開かずに済ませます。
+        未保存の変更がある場合は、メモリ上の内容を優先して読み込みません。
+
+        Returns:
+            bool: 読み込み直した場合はTrue。
+        """
+        if self._save_job is not None:
+            return False
+        signature = self._current_signature()
+        if signature is None or signature == self._file_signature:
+            return False
+        self.load()
+        return True
+
+    def reset(self, config):
+        """設定を丸ごと置き換えて保存します (初期設定の作成など)。"""
+        self.data.clear()
+        self.data.update(json.loads(json.dumps(config))) # 既定値のdictと共有しないよう複製
+        self._notify(None, None)
+        self.schedule_save()
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def set(self, key, value, source=None):
+        """
+        設定の1項目を変更し、購読者に通知して保存を予約します。
+        valueはストアが所有するため、呼び出し側は以後これを書き換えないでください。
+
+        Args:
+            source (object, optional): 変更元 (自分自身の変更の通知を無視したい場合に使用)。
+        """
+        self.data[key] = value
+        self.mark_changed(key, source)
+
+    def mark_changed(self, key, source=None):
+        """data[key] をその場で書き換えた後に呼び出し、購読者への通知と保存の予約を行います。"""
+        self._notify(key, source)
+        self.schedule_save()
+
+    def subscribe(self, callback):
+        """
+        変更の通知を受け取るコールバックを登録します。
+        callback(key, source) の形式で呼ばれます (読み込み・置き換え時の key は None)。
+
+        Returns:
+            callable: 登録を解除する関数。
+        """
+        self._subscribers.append(callback)
+        return lambda: self._subscribers.remove(callback) if callback in self._subscribers else None
+
+    def _notify(self, key, source):
+        for callback in list(self._subscribers):
+            try:
+                callback(key, source)
+            except Exception as e:
+                print(f"設定変更の通知中にエラーが発生しました: {e}")
+
+    def schedule_save(self):
+        if self.tk_root is None:
+            self._save_scheduled()
+            return
+        if self._save_job is not None:
+            self.tk_root.after_cancel(self._save_job)
+        self._save_job = self.tk_root.after(self.save_delay_ms, self._save_scheduled)
+
+    def flush(self):
+        """予約中の保存があれば即座に実行します (アプリケーションの終了時など)。"""
+        if self._save_job is not None:
+            self.tk_root.after_cancel(self._save_job)
+            self._save_scheduled()
+
+    def _save_scheduled(self):
+        self._save_job = None
+        try:
+            self.save_now()
+        except Exception as e:
+            print(f"設定ファイルの保存中にエラーが発生しました:\n{e}")
+            if self.on_save_error is not None:
+                self.on_save_error(e)
+
+    def save_now(self):
+        """一時ファイルに書き込んでから置き換えることで、設定ファイルをアトミックに保存します。"""
+        write_json_atomic(self.config_path, self.data)
+        self._file_signature = self._current_signature()
+        print(f"設定ファイルが保存されました: {self.config_path}")
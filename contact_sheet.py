@@ -0,0 +1,112 @@
+from itertools import accumulate
+from collections import namedtuple
+
+# 一覧表示 (コンタクトシート) の既定値 (config.json の "contact_sheet" で変更できる)
+DEFAULT_COLUMNS = 5
+DEFAULT_ROWS_PER_SHEET = 100 # Excel: 1シートあたりの行数
+DEFAULT_ROWS_PER_SLIDE = 3   # PowerPoint: 1スライドあたりの行数 (スライドに収まるように縮小する)
+DEFAULT_SPACING_PX = 10
+CAPTION_HEIGHT_PX = 20
+
+# 一覧に並べる切り抜き画像1つ分。width / height は切り抜き画像のピクセルサイズ
+ContactSheetItem = namedtuple("ContactSheetItem", ["crop_path", "caption", "width", "height"])
+
+def is_enabled(contact_sheet):
+    return bool(contact_sheet) and contact_sheet.get("enabled", True)
+
+def contact_sheet_items(image_filename, crops):
+    """
+    画像1枚分の切り抜き画像 [(パス, excel_pos, img_region), ...] を、一覧に並べる項目のリストにします。
+    キャプションは画像ファイル名 (領域が複数ある場合は領域番号付き) です。
+    """
+    items = []
+    for region_index, (crop_path, excel_pos, img_region) in enumerate(crops):
+        left, upper, right, lower = img_region
+        caption = image_filename if len(crops) == 1 else f"{image_filename} [{region_index + 1}]"
+        items.append(ContactSheetItem(crop_path, caption, int(round(right - left)), int(round(lower - upper))))
+    return items
+
+def take_pages(items, items_per_page, flush=False):
+    """
+    items の先頭から、items_per_page 個ずつのページを取り出して返す (取り出した項目は items から削除する)。
+    flush=True の場合は、最後の items_per_page 個に満たないページも返す。
+    """
+    pages = []
+    while len(items) >= items_per_page or (flush and items):
+        pages.append(items[:items_per_page])
+        del items[:items_per_page]
+    return pages
+
+
+class GridLayout:
+    """
+    切り抜き画像のサイズから、一覧のグリッド (列 × 行) の配置を計算するクラス。
+
+    項目は左上から行優先で並べ、列の幅はその列の項目の最大の幅、行の高さはその行の項目の最大の高さにします
+    (各行の上にはキャプションの行が入る)。列・行の開始位置は累積和で一度だけ計算するため、
+    項目の位置の取得は O(1) です。座標は全てピクセル単位で、出力側で列幅・行高さやEMUに変換します。
+    """
+    def __init__(self, sizes, columns=DEFAULT_COLUMNS, spacing=DEFAULT_SPACING_PX, caption_height=CAPTION_HEIGHT_PX,
+                 max_item_size=None):
+        """
+        Args:
+            sizes (list): 項目の (幅, 高さ) のリスト。
+            columns (int): 列数。
+            spacing (int): 項目の間隔 (ピクセル)。
+            caption_height (int): キャプションの行の高さ (ピクセル)。
+            max_item_size (tuple, optional): 項目の最大の (幅, 高さ)。超える項目は縦横比を保って縮小する
+                                             (Excelの列幅・行高さの上限に収めるため)。
+        """
+        self.columns = max(1, min(columns, len(sizes) or 1))
+        self.spacing = spacing
+        self.caption_height = caption_height
+        self.item_sizes = [self._fit(width, height, max_item_size) for width, height in sizes]
+
+        rows = (len(sizes) + self.columns - 1) // self.columns
+        self.col_widths = [0] * self.columns
+        self.row_heights = [0] * rows
+        for index, (width, height) in enumerate(self.item_sizes):
+            row, column = divmod(index, self.columns)
+            self.col_widths[column] = max(self.col_widths[column], width)
+            self.row_heights[row] = max(self.row_heights[row], height)
+        # 各列・各行 (キャプションを含む) の開始位置
+        self.col_offsets = [0] + list(accumulate(width + spacing for width in self.col_widths))
+        self.row_offsets = [0] + list(accumulate(caption_height + height + spacing for height in self.row_heights))
+        self.width = self.col_offsets[-1] - spacing if self.col_widths else 0
+        self.height = self.row_offsets[-1] - spacing if self.row_heights else 0
+
+    @staticmethod
+    def _fit(width, height, max_item_size):
+        if max_item_size is None:
+            return width, height
+        scale = min(1.0, max_item_size[0] / max(width, 1), max_item_size[1] / max(height, 1))
+        return max(1, int(width * scale)), max(1, int(height * scale))
+
+    def cell(self, index):
+        """項目の (列, 行) を返す。"""
+        row, column = divmod(index, self.columns)
+        return column, row
+
+    def caption_origin(self, index):
+        """項目のキャプションの左上の (x, y)。"""
+        column, row = self.cell(index)
+        return self.col_offsets[column], self.row_offsets[row]
+
+    def image_origin(self, index):
+        """項目の画像の左上の (x, y)。"""
+        column, row = self.cell(index)
+        return self.col_offsets[column], self.row_offsets[row] + self.caption_height
+
+
+def contact_sheet_settings(contact_sheet):
+    """config.json の "contact_sheet" から (列数, 間隔, 1シートの行数, 1スライドの行数) を返す。"""
+    return (contact_sheet.get("columns", DEFAULT_COLUMNS), contact_sheet.get("spacing", DEFAULT_SPACING_PX),
+            contact_sheet.get("rows_per_sheet", DEFAULT_ROWS_PER_SHEET),
+            contact_sheet.get("rows_per_slide", DEFAULT_ROWS_PER_SLIDE))
+
+def page_title(page_number):
+    return f"一覧 {page_number}"
+
+def caption_text(caption, max_length=60):
+    # キャプションが長い場合はファイル名の末尾 (サブフォルダより重要) を残す
+    return caption if len(caption) <= max_length else "…" + caption[-(max_length - 1):]
\ No newline at end of file
@@ -0,0 +1,187 @@
+import os
+import shutil
+import tempfile
+from image_source import open_image_source
+from image_worker import open_image_worker
+from error_report import ErrorReport
+from export_checkpoint import ExportCheckpoint
+
+def excel_pos_to_inches(excel_pos, params):
+    """
+    Excelのセル座標を、ページ (スライド) 左上からのインチ単位の位置に変換します。
+    列幅・行の高さは一定 (excel_to_pptx_conversion_params の col_width_pix / row_height_pix) として概算します。
+
+    Args:
+        excel_pos (str): Excelのセル座標 (例: "B2")
+        params (dict): 変換に必要なパラメータ (例: {"col_width_pix": 64, "row_height_pix": 20, "dpi": 96})
+
+    Returns:
+        tuple: (x, y) - インチ単位の位置 (float)
+    """
+    col_width_pix = params.get("col_width_pix", 64) # Excelのデフォルト列幅（ピクセル）
+    row_height_pix = params.get("row_height_pix", 20) # Excelのデフォルト行高さ（ピクセル）
+    dpi = params.get("dpi", 96) # スクリーンDPI
+
+    # Excel座標を列と行のインデックスに変換
+    col_str = "".join(filter(str.isalpha, excel_pos)).upper()
+    row_str = "".join(filter(str.isdigit, excel_pos))
+
+    col_idx = 0
+    for char in col_str:
+        col_idx = col_idx * 26 + (ord(char) - ord('A') + 1)
+    row_idx = int(row_str)
+
+    # ピクセル単位での概算位置 (左上セルA1を(0,0)とする)
+    x_pix = (col_idx - 1) * col_width_pix
+    y_pix = (row_idx - 1) * row_height_pix
+    return x_pix / dpi, y_pix / dpi
+
+
+class CropPipeline:
+    """
+    全ての出力形式 (Excel / PowerPoint / PDF / HTML) に共通の、画像の読み込みと切り抜きの段階。
+
+    画像ごとに領域プロファイルの判定・位置合わせ・切り抜きを行い (isolation が有効なら子プロセスで)、
+    切り抜き画像をPNGファイルとして crop_dir に保存して、出力側に (画像ファイル名, 切り抜き画像のリスト) を順番に渡します。
+    チェックポイント (再開)、処理できなかった画像の一覧 (ErrorReport)、進捗の通知もここで行うため、
+    出力形式ごとの処理は、渡された切り抜き画像をファイルに書き込むことだけです。
+
+    出力形式ごとの書き込みは、open() / add(画像ファイル名, 切り抜き画像のリスト, 失敗の理由) / save() / discard() を持つ
+    出力オブジェクト (image_to_excel.ExcelOutput など) が行います。run() に複数の出力を渡すと、画像のデコードと切り抜きは1回だけ行い、
+    同じ切り抜き画像を全ての出力に渡します (出力形式を増やしても、増えるのはその形式の書き込みの時間だけです)。
+
+    使い方:
+        pipeline = CropPipeline(output_path, image_folder_path, regions_and_coords, ...)
+        results = pipeline.run([ExcelOutput(output_path, ...), PdfOutput(pdf_path, ...)])
+    """
+    def __init__(self, output_path, image_folder_path, regions_and_coords, region_profiles=None, alignment=None,
+                 image_files=None, progress_callback=None, isolation=None, checkpoint_settings=None, resume=False):
+        """
+        Args:
+            output_path (str): 出力ファイルのパス (チェックポイントと処理できなかった画像の一覧の保存先に使う)。
+            image_folder_path (str): 画像フォルダ、またはzip/tarファイルのパス。
+            image_files (list, optional): 処理する画像のリスト。省略時は全ての画像。
+            progress_callback (callable, optional): 画像を1枚処理するたびに progress_callback(処理済み枚数, 全枚数) の形式で呼ばれる。
+            isolation (dict, optional): config.json の "image_isolation"。
+            checkpoint_settings (dict, optional): 指定した場合はチェックポイントを作成する。出力結果に影響する設定を渡し、
+                                                  画像フォルダと画像の一覧を加えたものが同じ場合のみ再開できる。
+            resume (bool, optional): 既存のチェックポイントから再開する。
+        """
+        self.image_source = open_image_source(image_folder_path)
+        self.image_files = image_files if image_files is not None else self.image_source.list_images()
+        self.progress_callback = progress_callback
+        # 画像ごとに適用する領域プロファイルの判定と位置合わせ、切り抜き (isolation が有効なら子プロセスで行う)
+        self.image_worker = open_image_worker(self.image_source, regions_and_coords, region_profiles, alignment, isolation)
+        self.error_report = ErrorReport(output_path)
+        self.checkpoint = None
+        if checkpoint_settings is not None:
+            try:
+                self.checkpoint = ExportCheckpoint(output_path, dict(
+                    checkpoint_settings, image_folder=os.path.abspath(image_folder_path), image_files=self.image_files,
+                    regions=regions_and_coords, alignment=alignment, region_profiles=region_profiles), resume)
+            except Exception:
+                # 異なる設定で作成されたチェックポイントなど。子プロセスとアーカイブを残さないように閉じる
+                self.image_worker.close()
+                self.image_source.close()
+                raise
+        # 切り抜き画像の保存先 (チェックポイントを使わない場合は、保存後に削除する一時フォルダ)
+        self.crop_dir = self.checkpoint.crops_dir if self.checkpoint is not None else tempfile.mkdtemp(prefix="image_to_office_")
+
+    def __len__(self):
+        return len(self.image_files)
+
+    def __iter__(self):
+        """
+        (画像ファイル名, [(切り抜き画像のパス, excel_pos, img_region), ...]) を画像の順に返す。
+        処理できなかった画像は、切り抜き画像のリストの代わりに None を返す (理由は一覧に記録済み)。
+        """
+        total = len(self.image_files)
+        for processed, (image_filename, open_image) in enumerate(self.image_worker.iter_images(self.image_source, self.image_files), start=1):
+            try:
+                yield image_filename, self._crop(processed, image_filename, open_image)
+            finally:
+                if self.progress_callback is not None:
+                    self.progress_callback(processed, total)
+
+    def _crop(self, processed, image_filename, open_image):
+        checkpoint = self.checkpoint
+        try:
+            crops = checkpoint.completed_crops(image_filename) if checkpoint is not None else None
+            if crops is not None:
+                return crops
+            if checkpoint is not None and checkpoint.should_skip(image_filename):
+                print(f"Skipping {image_filename}: processing stopped abnormally on this image in previous runs")
+                self.error_report.add(image_filename, "Processing stopped abnormally on this image in previous runs", "skipped")
+                return None
+            if checkpoint is not None:
+                checkpoint.mark_started(image_filename)
+            # 画像領域を切り抜いて crop_dir に保存
+            # (チェックポイントが有効な場合は、再開時にデコード・エンコードをせずにこのファイルを使う)
+            profile_name, crops = self.image_worker.process(image_filename, open_image, self.crop_dir, f"{processed:06d}")
+            if profile_name is not None:
+                print(f"  - Region profile: {profile_name}")
+            if checkpoint is not None:
+                checkpoint.mark_done(image_filename, crops)
+            return crops
+        except Exception as e:
+            self.mark_failed(image_filename, e)
+            return None
+
+    def run(self, outputs):
+        """
+        全ての画像を切り抜き、切り抜き画像を outputs の各出力に渡してから、各出力を保存します。
+        処理できなかった画像は、切り抜き画像の代わりに None と失敗の理由を渡します。
+
+        Returns:
+            list: 出力ごとの、保存できたかどうか (bool)。全て保存できた場合のみチェックポイントを削除します。
+        """
+        try:
+            for output in outputs:
+                output.open()
+            for image_filename, crops in self:
+                reason = None
+                if crops is None:
+                    reasons = [entry["message"] for entry in self.error_report.entries if entry["image"] == image_filename]
+                    reason = reasons[-1] if reasons else ""
+                for output in outputs:
+                    try:
+                        output.add(image_filename, crops, reason)
+                    except Exception as e:
+                        self.mark_failed(image_filename, e)
+            results = [output.save() for output in outputs]
+        except Exception:
+            for output in outputs:
+                output.discard()
+            self.close(saved=False)
+            raise
+        self.close(saved=all(results), report_paths=[output.output_path for output, saved in zip(outputs, results) if saved])
+        return results
+
+    def mark_failed(self, image_filename, error):
+        """画像の処理に失敗したことを記録する (出力側で切り抜き画像の書き込みに失敗した場合にも使う)。"""
+        print(f"Error processing {image_filename}: {error}")
+        self.error_report.add(image_filename, error)
+        if self.checkpoint is not None:
+            self.checkpoint.mark_failed(image_filename, error)
+
+    def close(self, saved, report_paths=None):
+        """
+        出力ファイルの保存後に呼ぶ。保存できた場合は処理できなかった画像の一覧を書き出し、チェックポイントを削除する。
+        保存に失敗した場合は、再開できるようにチェックポイントを残す。
+        report_paths には、処理できなかった画像の一覧を隣に書き出す出力ファイルのパスを指定する (省略時は output_path)。
+        """
+        self.image_worker.close()
+        self.image_source.close()
+        if report_paths is None:
+            report_paths = [self.error_report.output_path] if saved else []
+        for report_path in report_paths:
+            report = ErrorReport(report_path)
+            report.entries = self.error_report.entries
+            report.write(len(self.image_files))
+        if self.checkpoint is not None:
+            if saved:
+                self.checkpoint.finish()
+            else:
+                self.checkpoint.close()
+        else:
+            shutil.rmtree(self.crop_dir, ignore_errors=True)
@@ -0,0 +1,137 @@
+from collections import deque
+
+def _copy_value(value):
+    # 座標はリストで保持されるため、コマンド内ではタプルとして不変に保つ
+    return tuple(value) if isinstance(value, list) else value
+
+def _restore_value(value):
+    return list(value) if isinstance(value, tuple) else value
+
+class SetFieldCommand:
+    """
+    領域の1項目を変更するコマンド (移動・リサイズは "img_region"、セル座標の変更は "excel_pos")。
+    変更前後の値だけを保持するため、領域リスト全体をコピーする必要がありません。
+    """
+    __slots__ = ("index", "key", "old_value", "new_value")
+    structural = False # 領域の追加・削除のようにインデックスがずれる変更かどうか
+
+    def __init__(self, index, key, old_value, new_value):
+        self.index = index
+        self.key = key
+        self.old_value = _copy_value(old_value)
+        self.new_value = _copy_value(new_value)
+
+    def is_noop(self):
+        return self.old_value == self.new_value
+
+    def apply(self, regions):
+        regions[self.index][self.key] = _restore_value(self.new_value)
+
+    def revert(self, regions):
+        regions[self.index][self.key] = _restore_value(self.old_value)
+
+
+class AddRegionCommand:
+    """index の位置に領域を追加するコマンド。"""
+    __slots__ = ("index", "item")
+    structural = True
+
+    def __init__(self, index, item):
+        self.index = index
+        self.item = {key: _copy_value(value) for key, value in item.items()}
+
+    def is_noop(self):
+        return False
+
+    def apply(self, regions):
+        regions.insert(self.index, {key: _restore_value(value) for key, value in self.item.items()})
+
+    def revert(self, regions):
+        del regions[self.index]
+
+
+class DeleteRegionCommand(AddRegionCommand):
+    """index の位置の領域を削除するコマンド (追加の逆操作)。"""
+    __slots__ = ()
+
+    def apply(self, regions):
+        AddRegionCommand.revert(self, regions)
+
+    def revert(self, regions):
+        AddRegionCommand.apply(self, regions)
+
+
+class EditHistory:
+    """
+    領域リストに対する編集履歴 (コマンドパターン)。元に戻す・やり直しと、未保存の変更があるかどうかを管理します。
+
+    履歴の各状態には連番を振り、保存 (または編集開始) 時点の状態番号と比較して未保存の変更を判定します。
+    変更を元に戻して保存時点の状態に戻った場合も、変更なしと判定されます。
+    """
+    def __init__(self, regions, max_length=10000):
+        self.regions = regions # 編集対象の領域リスト (コマンドはこのリストをその場で書き換える)
+        self._undo_stack = deque(maxlen=max_length) # (コマンド, 実行前の状態番号, 実行後の状態番号)
+        self._redo_stack = []
+        self._state = 0
+        self._saved_state = 0
+        self._next_state = 1
+
+    @property
+    def dirty(self):
+        return self._state != self._saved_state
+
+    @property
+    def can_undo(self):
+        return bool(self._undo_stack)
+
+    @property
+    def can_redo(self):
+        return bool(self._redo_stack)
+
+    def execute(self, command):
+        """コマンドを実行して履歴に追加する。変更が無いコマンドは無視する。"""
+        if command.is_noop():
+            return False
+        command.apply(self.regions)
+        return self.record(command)
+
+    def record(self, command):
+        """
+        実行済みのコマンドを履歴に追加する (ドラッグ中に直接書き換えた移動など)。
+
+        Returns:
+            bool: 履歴に追加された場合はTrue。
+        """
+        if command.is_noop():
+            return False
+        new_state = self._next_state
+        self._next_state += 1
+        self._undo_stack.append((command, self._state, new_state))
+        self._redo_stack.clear()
+        self._state = new_state
+        return True
+
+    def undo(self):
+        """直前のコマンドを取り消す。取り消したコマンド (無ければNone) を返す。"""
+        if not self._undo_stack:
+            return None
+        entry = self._undo_stack.pop()
+        command, previous_state, _ = entry
+        command.revert(self.regions)
+        self._redo_stack.append(entry)
+        self._state = previous_state
+        return command
+
+    def redo(self):
+        """取り消したコマンドをやり直す。やり直したコマンド (無ければNone) を返す。"""
+        if not self._redo_stack:
+            return None
+        entry = self._redo_stack.pop()
+        command, _, new_state = entry
+        command.apply(self.regions)
+        self._undo_stack.append(entry)
+        self._state = new_state
+        return command
+
+    def mark_saved(self):
+        self._saved_state = self._state
@@ -0,0 +1,58 @@
+import os
+import csv
+import time
+from config_store import write_json_atomic
+
+ERROR_REPORT_SUFFIX = ".errors"
+CSV_FIELDS = ("image", "kind", "message")
+
+class ErrorReport:
+    """
+    出力できなかった画像と理由の一覧。出力ファイルの隣に "<出力ファイル名>.errors.json" と ".errors.csv" として保存します。
+    失敗した画像が無い場合は、前回の出力で作成された一覧を削除します。
+    """
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.json_path = output_path + ERROR_REPORT_SUFFIX + ".json"
+        self.csv_path = output_path + ERROR_REPORT_SUFFIX + ".csv"
+        self.entries = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, image_filename, error, kind=None):
+        """
+        失敗した画像を記録します。
+
+        Args:
+            image_filename (str): 画像ファイル名。
+            error (Exception or str): 失敗の理由。
+            kind (str, optional): 失敗の種類。省略時は例外の kind 属性 (image_worker.ImageProcessingError)、無ければ "error"。
+        """
+        self.entries.append({"image": image_filename, "kind": kind or getattr(error, "kind", "error"), "message": str(error)})
+
+    def write(self, total_images):
+        """
+        一覧を保存します。
+
+        Returns:
+            str: 保存したJSONファイルのパス。失敗した画像が無い場合は None。
+        """
+        if not self.entries:
+            for path in (self.json_path, self.csv_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            return None
+        write_json_atomic(self.json_path, {
+            "output": os.path.basename(self.output_path),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "total_images": total_images,
+            "failed": self.entries,
+        })
+        # Excelで開いても文字化けしないよう、BOM付きのUTF-8で保存する
+        with open(self.csv_path, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+            writer.writeheader()
+            writer.writerows(self.entries)
+        print(f"{len(self.entries)} image(s) could not be processed; see {self.json_path}")
+        return self.json_path
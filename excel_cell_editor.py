@@ -2,23 +2,28 @@
 
 import tkinter as tk
 from tkinter import messagebox, simpledialog, ttk
-import json
+import os
 import string
+from spatial_index import GridIndex
+from config_store import ConfigStore, REGIONS_KEY
+from edit_history import EditHistory, SetFieldCommand
 
 class ExcelCellEditor:
-    def __init__(self, master, config_path, main_app_callback):
+    def __init__(self, master, config_store):
         self.master = master
-        self.config_path = config_path
-        self.main_app_callback = main_app_callback # main.pyに設定更新を通知するコールバック
+        self.config_store = config_store # メインウィンドウと共有する設定 (保存するとメインウィンドウにも通知される)
 
-        self.current_config = self.load_config()
-        self.original_regions_and_coords = [item.copy() for item in self.current_config.get("image_regions_and_excel_coords", [])]
-        self.regions_data = [item.copy() for item in self.original_regions_and_coords] # 編集用データ
+        self.regions_data = [item.copy() for item in self.config_store.get(REGIONS_KEY, [])] # 編集用データ
+        self.history = EditHistory(self.regions_data) # 編集履歴 (変更の有無もここで判定する)
 
         self.cell_width = 75 # デフォルトのセル幅 (ピクセル)
         self.cell_height = 20 # デフォルトのセル高さ (ピクセル)
         self.header_offset = 30 # ラベル表示用のオフセット
 
+        # 領域のセル範囲 (セル単位の座標) の空間インデックス。セルサイズが変わっても作り直す必要がない
+        self.region_index = GridIndex(cell_size=8)
+        self._rebuild_region_index()
+
         # ウィンドウの初期サイズを設定
         self._set_initial_window_size()
 
@@ -31,14 +36,6 @@ class ExcelCellEditor:
         self.selected_rect_id = None # 現在選択中の矩形ID (canvas item id)
         self.selected_region_idx = None # 現在選択中の領域データインデックス
 
-    def load_config(self):
-        try:
-            with open(self.config_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            messagebox.showwarning("設定読み込み", f"設定ファイル '{self.config_path}' が見つからないか、不正です。")
-            return {}
-
     def _set_initial_window_size(self):
         # 画面の最大サイズを取得
         screen_width = self.master.winfo_screenwidth()
@@ -58,8 +55,14 @@ class ExcelCellEditor:
         
         self.master.geometry(f"{final_width}x{final_height}")
 
+    def _update_title(self):
+        title = "出力セル確認・変更"
+        if self.history.dirty:
+            title = "* " + title # 未保存の変更あり
+        self.master.title(title)
+
     def setup_ui(self):
-        self.master.title("出力セル確認・変更")
+        self._update_title()
 
         self.canvas = tk.Canvas(self.master, bg="white", cursor="cross")
         self.canvas.pack(fill="both", expand=True, side="left")
@@ -85,6 +88,10 @@ class ExcelCellEditor:
         self.canvas.bind("<B1-Motion>", self.on_mouse_drag)
         self.canvas.bind("<ButtonRelease-1>", self.on_button_release)
         self.canvas.bind("<ButtonPress-3>", self.on_right_click) # 右クリック
+        # 元に戻す・やり直し
+        self.master.bind("<Control-z>", lambda event: self.undo())
+        self.master.bind("<Control-y>", lambda event: self.redo())
+        self.master.bind("<Control-Z>", lambda event: self.redo()) # Ctrl + Shift + Z
 
         # ズーム機能 (Ctrl + マウスホイール)はここでは使わないが残す
         # self.canvas.bind("<Control-MouseWheel>", self.on_zoom)
@@ -242,6 +249,27 @@ class ExcelCellEditor:
         y2 = y1 + self.cell_height
         return x1, y1, x2, y2
 
+    def _cell_grid_rect(self, excel_pos):
+        # 例: "B2" -> (1, 1, 2, 2) セル単位の矩形 (A1の左上を原点とする)
+        col_str = "".join(filter(str.isalpha, excel_pos)).upper()
+        row_str = "".join(filter(str.isdigit, excel_pos))
+        col_idx = self._letter_to_col(col_str)
+        row_idx = int(row_str)
+        return (col_idx - 1, row_idx - 1, col_idx, row_idx)
+
+    def _rebuild_region_index(self):
+        self.region_index.rebuild((i, self._cell_grid_rect(item["excel_pos"])) for i, item in enumerate(self.regions_data))
+
+    def _region_at(self, x_coord_canvas, y_coord_canvas):
+        """
+        キャンバス座標の点にある領域のインデックスを空間インデックスで求める。
+        複数の領域が同じセルにある場合は、前面に描画される (インデックスが大きい) 領域を返す。
+        """
+        grid_x = (x_coord_canvas - self.header_offset) / self.cell_width
+        grid_y = (y_coord_canvas - self.header_offset) / self.cell_height
+        hits = self.region_index.query_point(grid_x, grid_y)
+        return max(hits) if hits else None
+
     def _coords_to_cell(self, x_coord_canvas, y_coord_canvas):
         # キャンバス座標をExcelセル座標に変換
         # ヘッダーオフセットを考慮
@@ -261,25 +289,22 @@ class ExcelCellEditor:
         self.selected_rect_id = None
         self.selected_region_idx = None
 
-        # クリックされたアイテムのタグを確認
-        item_ids = self.canvas.find_overlapping(event.x, event.y, event.x, event.y)
-        
-        for item_id in reversed(item_ids): # 最前面のアイテムから順に確認
-            tags = self.canvas.gettags(item_id)
-            if "cell_rect" in tags:
-                for tag in tags:
-                    if tag.startswith("region_"):
-                        self.selected_region_idx = int(tag.split('_')[1])
-                        self.selected_rect_id = item_id
-                        self.canvas.tag_raise(self.selected_rect_id) # 選択された矩形を最前面に
-                        self.canvas.tag_raise(f"region_text_{self.selected_region_idx}") # テキストも最前面に
-                        self.canvas.itemconfig(self.selected_rect_id, outline="green") # 選択色
-                        return # 最初の矩形が見つかったら終了
-        
         # ヘッダー領域内でのクリックはドラッグしない (セルのドラッグとは区別)
         if event.x < self.header_offset or event.y < self.header_offset:
             self.drag_start_x = None # ドラッグを無効化
             self.drag_start_y = None
+            return
+
+        # クリック位置の領域を空間インデックスで判定
+        region_idx = self._region_at(self.drag_start_x, self.drag_start_y)
+        if region_idx is not None:
+            self.selected_region_idx = region_idx
+            self.selected_rect_id = self.canvas.find_withtag(f"region_{region_idx}")[0]
+            self.canvas.tag_raise(self.selected_rect_id) # 選択された矩形を最前面に
+            self.canvas.tag_raise(f"region_text_{self.selected_region_idx}") # テキストも最前面に
+            self.canvas.tag_raise("header_bg") # ヘッダーは常に最前面
+            self.canvas.tag_raise("header_label")
+            self.canvas.itemconfig(self.selected_rect_id, outline="green") # 選択色
 
 
     def on_mouse_drag(self, event):
@@ -309,7 +334,10 @@ class ExcelCellEditor:
             new_excel_pos = self._coords_to_cell(x1_canvas, y1_canvas)
 
             # 内部データを更新
-            self.regions_data[self.selected_region_idx]["excel_pos"] = new_excel_pos
+            self.history.execute(SetFieldCommand(self.selected_region_idx, "excel_pos",
+                                                 self.regions_data[self.selected_region_idx]["excel_pos"], new_excel_pos))
+            self._update_title()
+            self.region_index.update(self.selected_region_idx, self._cell_grid_rect(new_excel_pos))
             messagebox.showinfo("更新", f"領域 {self.selected_region_idx + 1} のExcelセル座標を '{new_excel_pos}' に変更しました。")
             
             # 矩形の色を元に戻す
@@ -324,18 +352,12 @@ class ExcelCellEditor:
         self.drag_start_y = None
 
     def on_right_click(self, event):
-        item_id = self.canvas.find_closest(event.x, event.y)[0]
-        tags = self.canvas.gettags(item_id)
-
-        region_idx = None
-        if "cell_rect" in tags:
-            for tag in tags:
-                if tag.startswith("region_"):
-                    region_idx = int(tag.split('_')[1])
-                    break
+        if event.x < self.header_offset or event.y < self.header_offset:
+            return
+        region_idx = self._region_at(self.canvas.canvasx(event.x), self.canvas.canvasy(event.y))
 
         if region_idx is not None:
-            self.show_context_menu(event.x, event.y, region_idx)
+            self.show_context_menu(event.x_root, event.y_root, region_idx) # メニューはスクリーン座標で表示
 
     def show_context_menu(self, x, y, region_idx):
         menu = tk.Menu(self.master, tearoff=0)
@@ -354,25 +376,40 @@ class ExcelCellEditor:
                 messagebox.showerror("入力エラー", "無効なExcelセル座標です。例: A1, B2")
                 return
 
-            self.regions_data[region_idx]["excel_pos"] = new_pos.upper() # 大文字に変換して保存
+            self.history.execute(SetFieldCommand(region_idx, "excel_pos", current_pos, new_pos.upper())) # 大文字に変換して保存
+            self.region_index.update(region_idx, self._cell_grid_rect(new_pos.upper()))
+            self._update_title()
             messagebox.showinfo("更新", f"領域 {region_idx + 1} のExcelセル座標を '{new_pos}' に変更しました。")
             self.draw_grid_and_regions() # 更新を反映するために再描画
 
+    def undo(self):
+        if self.selected_region_idx is not None:
+            return # ドラッグ中は履歴を操作しない
+        self._refresh_after_history_change(self.history.undo())
+
+    def redo(self):
+        if self.selected_region_idx is not None:
+            return
+        self._refresh_after_history_change(self.history.redo())
+
+    def _refresh_after_history_change(self, command):
+        if command is None:
+            return
+        excel_pos = self.regions_data[command.index]["excel_pos"]
+        self.region_index.update(command.index, self._cell_grid_rect(excel_pos))
+        self.draw_grid_and_regions()
+        self._update_title()
+
     def on_closing(self):
-        if self.regions_data != self.original_regions_and_coords: # 変更があるか確認
+        if self.history.dirty: # 変更があるか確認 (編集履歴の状態で判定し、領域リスト全体は比較しない)
             if messagebox.askyesno("確認", "変更を保存して閉じますか？"):
                 self.save_config()
-                self.main_app_callback() # main.pyに設定更新を通知
         self.master.destroy()
 
     def save_config(self):
-        self.current_config["image_regions_and_excel_coords"] = self.regions_data
-        try:
-            with open(self.config_path, 'w', encoding='utf-8') as f:
-                json.dump(self.current_config, f, indent=4, ensure_ascii=False)
-            messagebox.showinfo("保存", "設定ファイルに保存しました。")
-        except Exception as e:
-            messagebox.showerror("保存エラー", f"設定ファイルの保存中にエラーが発生しました:\n{e}")
+        # 閉じる直前に呼ばれるため、編集中のリストをそのまま共有設定に渡す (ファイルへの書き込みはConfigStoreが行う)
+        self.config_store.set(REGIONS_KEY, self.regions_data, source=self)
+        self.history.mark_saved()
 
 if __name__ == '__main__':
     # 動作確認用のダミー設定と画像フォルダ
@@ -381,10 +418,11 @@ if __name__ == '__main__':
     current_dir = os.path.dirname(os.path.abspath(__file__))
     dummy_config_path = os.path.join(current_dir, "config.json")
 
-    # ダミーのコールバック関数
-    def dummy_callback():
-        print("Main app callback triggered (config reloaded).")
+    # 単体で起動した場合は遅延させずに保存する
+    config_store = ConfigStore(dummy_config_path)
+    config_store.load()
+    config_store.subscribe(lambda key, source: print(f"Config changed: {key}"))
 
-    app = ExcelCellEditor(root, dummy_config_path, dummy_callback)
+    app = ExcelCellEditor(root, config_store)
     root.mainloop()
 
@@ -0,0 +1,123 @@
+import os
+import json
+import shutil
+import hashlib
+
+CHECKPOINT_SUFFIX = ".checkpoint"
+MANIFEST_FILE_NAME = "manifest.json"
+JOURNAL_FILE_NAME = "journal.jsonl"
+CROPS_DIR_NAME = "crops"
+# 処理中に異常終了した (開始の記録だけが残っている) 回数がこれに達した画像は、再開時に読み飛ばす
+MAX_UNFINISHED_ATTEMPTS = 2
+
+def checkpoint_dir_for(output_path):
+    return output_path + CHECKPOINT_SUFFIX
+
+def has_checkpoint(output_path):
+    return os.path.exists(os.path.join(checkpoint_dir_for(output_path), MANIFEST_FILE_NAME))
+
+def settings_fingerprint(settings):
+    """出力設定 (JSONに変換できる値) のハッシュ。設定が変わったチェックポイントからの再開を防ぐために使う。"""
+    return hashlib.sha256(json.dumps(settings, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class ExportCheckpoint:
+    """
+    長時間の出力を途中から再開するためのチェックポイント (出力ファイル名 + ".checkpoint" のフォルダ)。
+
+    画像ごとの切り抜き画像 (PNG) を crops/ (crops_dir) に保存し、処理の開始と完了を journal.jsonl に1行ずつ追記します。
+    再開時は、完了済みの画像は保存済みの切り抜き画像からシート/スライドを作り直すだけで、
+    画像のデコードや切り抜き画像のエンコードはやり直しません。
+    開始の記録だけが残っている画像 (処理中にPillowの異常終了やメモリ不足で止まった画像) は再開時にもう一度処理し、
+    MAX_UNFINISHED_ATTEMPTS 回続けて止まった場合は読み飛ばします。
+    出力ファイルの保存に成功したら finish() でフォルダごと削除します。
+    """
+    def __init__(self, output_path, settings, resume=False):
+        """
+        Args:
+            output_path (str): 出力ファイルのパス。
+            settings (dict): 出力結果に影響する設定 (画像の一覧、領域、テンプレートなど)。
+            resume (bool): Trueの場合は既存のチェックポイントから再開する。Falseの場合は既存のものを破棄して作り直す。
+
+        Raises:
+            ValueError: 再開しようとしたチェックポイントが、異なる設定で作成されたものである場合。
+        """
+        self.checkpoint_dir = checkpoint_dir_for(output_path)
+        self.crops_dir = os.path.join(self.checkpoint_dir, CROPS_DIR_NAME)
+        self.journal_path = os.path.join(self.checkpoint_dir, JOURNAL_FILE_NAME)
+        self.fingerprint = settings_fingerprint(settings)
+        self._completed = {} # 画像ファイル名 -> 切り抜き画像のリスト [(ファイル名, excel_pos, img_region), ...]
+        self._unfinished_attempts = {} # 画像ファイル名 -> 完了せずに終わった処理の回数
+
+        manifest_path = os.path.join(self.checkpoint_dir, MANIFEST_FILE_NAME)
+        if resume and os.path.exists(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get("fingerprint") != self.fingerprint:
+                raise ValueError(f"チェックポイント {self.checkpoint_dir} は異なる設定・画像で作成されたため、再開できません。")
+            self._load_journal()
+            print(f"Resuming from checkpoint: {len(self._completed)} image(s) already done")
+        else:
+            if os.path.exists(self.checkpoint_dir):
+                shutil.rmtree(self.checkpoint_dir)
+            os.makedirs(self.crops_dir)
+            with open(manifest_path, 'w', encoding='utf-8') as f:
+                json.dump({"fingerprint": self.fingerprint, "output": os.path.basename(output_path)}, f)
+        self._journal = open(self.journal_path, 'a', encoding='utf-8')
+
+    def _load_journal(self):
+        started = {}
+        with open(self.journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue # 書き込み途中で中断された最後の行
+                image = entry["image"]
+                if entry["event"] == "started":
+                    started[image] = started.get(image, 0) + 1
+                elif entry["event"] == "done":
+                    started.pop(image, None)
+                    self._completed[image] = [tuple(crop) for crop in entry["crops"]]
+                elif entry["event"] == "failed":
+                    started[image] = started.get(image, 0) - 1 # 例外で失敗した画像は、再開時にもう一度処理する
+        self._unfinished_attempts = {image: count for image, count in started.items() if count > 0}
+
+    def completed_crops(self, image_filename):
+        """
+        完了済みの画像の切り抜き画像のリスト [(パス, excel_pos, img_region), ...] を返す。未完了の場合は None。
+        """
+        crops = self._completed.get(image_filename)
+        if crops is None:
+            return None
+        return [(os.path.join(self.crops_dir, name), excel_pos, img_region) for name, excel_pos, img_region in crops]
+
+    def should_skip(self, image_filename):
+        """前回までの実行で、処理中に繰り返し異常終了した画像かどうか。"""
+        return self._unfinished_attempts.get(image_filename, 0) >= MAX_UNFINISHED_ATTEMPTS
+
+    def mark_started(self, image_filename):
+        self._append({"event": "started", "image": image_filename})
+
+    def mark_done(self, image_filename, crops):
+        """画像の処理の完了を記録する。crops は [(切り抜き画像のパス, excel_pos, img_region), ...]。"""
+        self._append({"event": "done", "image": image_filename,
+                      "crops": [[os.path.basename(path), excel_pos, list(img_region)] for path, excel_pos, img_region in crops]})
+
+    def mark_failed(self, image_filename, error):
+        self._append({"event": "failed", "image": image_filename, "error": str(error)})
+
+    def _append(self, entry):
+        # 異常終了しても記録済みの行が失われないよう、1行ごとにディスクへ書き出す
+        self._journal.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def close(self):
+        if not self._journal.closed:
+            self._journal.close()
+
+    def finish(self):
+        """出力ファイルの保存が完了した後に呼び、チェックポイントを削除する。"""
+        self.close()
+        shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
@@ -0,0 +1,369 @@
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import queue
+import shutil
+import zipfile
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse
+from config_store import ConfigStore, validate_config, write_json_atomic
+from image_source import is_archive
+from office_export import run_exports
+from error_report import ERROR_REPORT_SUFFIX
+
+JOB_FILE_NAME = "job.json"
+PROGRESS_FILE_NAME = "progress.json"
+# 出力形式 -> (出力ファイル名, Content-Type)
+OUTPUT_FORMATS = {
+    "excel": ("output.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "pptx": ("output.pptx", "application/vnd.openxmlformats-officedocument.presentationml.presentation"),
+    "pdf": ("output.pdf", "application/pdf"),
+    # HTMLレポートは、切り抜き画像のフォルダ (_files) と合わせて1つのzipファイル (出力ファイル名 + ".zip") で返す
+    "html": ("output.html", "application/zip"),
+}
+_JOB_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+def _write_progress(job_dir, processed, total):
+    write_json_atomic(os.path.join(job_dir, PROGRESS_FILE_NAME), {"processed": processed, "total": total}, indent=None)
+
+def _zip_html_report(html_path):
+    """HTMLレポートと切り抜き画像のフォルダを、ダウンロード用に1つのzipファイル (HTMLファイル名 + ".zip") にまとめる。"""
+    from image_to_html import html_files_dir_name
+    files_dir_name = html_files_dir_name(html_path)
+    files_dir = os.path.join(os.path.dirname(html_path), files_dir_name)
+    part_path = html_path + ".zip.part"
+    with zipfile.ZipFile(part_path, 'w') as archive:
+        archive.write(html_path, os.path.basename(html_path), compress_type=zipfile.ZIP_DEFLATED)
+        # 切り抜き画像 (PNG/JPEG) は圧縮済みのため、そのまま格納する
+        for name in sorted(os.listdir(files_dir)):
+            archive.write(os.path.join(files_dir, name), f"{files_dir_name}/{name}", compress_type=zipfile.ZIP_STORED)
+    os.replace(part_path, html_path + ".zip")
+
+def run_export_job(job_dir):
+    """
+    ジョブを1件実行する (ワーカープロセスで実行される)。
+    ジョブの内容は job.json から読み込み、進捗は progress.json に書き出します。
+
+    Returns:
+        dict: 出力形式 -> 出力ファイル名
+    """
+    with open(os.path.join(job_dir, JOB_FILE_NAME), 'r', encoding='utf-8') as f:
+        job = json.load(f)
+    # 進捗の書き込みは0.5秒に1回までに間引く (画像が多いジョブでもファイルの書き込みが負担にならないように)
+    last_written = [0.0]
+    def progress_callback(processed, total):
+        now = time.monotonic()
+        if processed == total or now - last_written[0] >= 0.5:
+            last_written[0] = now
+            _write_progress(job_dir, processed, total)
+
+    output_paths = [(output_format, os.path.join(job_dir, OUTPUT_FORMATS[output_format][0])) for output_format in job["formats"]]
+    # 画像のデコードと切り抜きは、全ての出力形式で1回だけ行う
+    # 再起動で再実行されるジョブは、前回のチェックポイントから再開する (初回はチェックポイントが無いので最初から)
+    results = run_exports(output_paths, job["image_folder"], job["config"], job.get("image_files"),
+                          progress_callback, checkpoint=True, resume=True)
+    # 出力処理は保存に失敗しても例外を送出せず、False を返す
+    for output_format, saved in zip(job["formats"], results):
+        if not saved:
+            raise RuntimeError(f"{output_format} の出力ファイルを作成できませんでした。")
+    if "html" in job["formats"]:
+        _zip_html_report(os.path.join(job_dir, OUTPUT_FORMATS["html"][0]))
+    return {output_format: OUTPUT_FORMATS[output_format][0] for output_format in job["formats"]}
+
+
+class JobStore:
+    """
+    ジョブをジョブフォルダ (jobs_dir/<ジョブID>/) 単位でディスクに保存するキュー。
+    job.json にジョブの内容と状態 (queued / running / done / failed) を保存するため、
+    サービスを再起動しても未完了のジョブは失われません。
+    """
+    def __init__(self, jobs_dir):
+        self.jobs_dir = jobs_dir
+        self._lock = threading.Lock()
+        os.makedirs(jobs_dir, exist_ok=True)
+
+    def job_dir(self, job_id):
+        return os.path.join(self.jobs_dir, job_id)
+
+    def create(self, image_folder, formats, config, image_files=None):
+        job_id = uuid.uuid4().hex
+        job = {
+            "id": job_id, "status": "queued", "image_folder": image_folder, "formats": formats,
+            "image_files": image_files, "config": config, "outputs": {}, "error": None,
+            "created": time.time(), "started": None, "finished": None,
+        }
+        os.makedirs(self.job_dir(job_id))
+        self.save(job)
+        return job
+
+    def load(self, job_id):
+        if not _JOB_ID_PATTERN.match(job_id):
+            return None
+        try:
+            with open(os.path.join(self.job_dir(job_id), JOB_FILE_NAME), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def save(self, job):
+        with self._lock:
+            write_json_atomic(os.path.join(self.job_dir(job["id"]), JOB_FILE_NAME), job)
+
+    def update(self, job_id, **fields):
+        """job.json を更新する。ジョブフォルダが削除された場合や job.json が読み込めない場合は、表示して None を返す。"""
+        with self._lock:
+            job = self.load(job_id)
+            if job is None:
+                print(f"Job {job_id} skipped: {JOB_FILE_NAME} is missing or unreadable")
+                return None
+            job.update(fields)
+            write_json_atomic(os.path.join(self.job_dir(job_id), JOB_FILE_NAME), job)
+        return job
+
+    def progress(self, job_id):
+        try:
+            with open(os.path.join(self.job_dir(job_id), PROGRESS_FILE_NAME), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def list_jobs(self):
+        jobs = [self.load(job_id) for job_id in os.listdir(self.jobs_dir)]
+        return sorted((job for job in jobs if job is not None), key=lambda job: job["created"])
+
+
+class ExportService:
+    """
+    出力ジョブを受け付け、プロセスプールで順番に実行するサービス。
+
+    ジョブは受け付けた順に、空いているワーカープロセスへ1件ずつ割り当てます。
+    1つのジョブは1つのプロセスでしか実行されないため、大きなジョブが投入されても
+    他のジョブはワーカーが空き次第実行され、CPUを独占されることはありません。
+    起動時には、前回の終了時に待機中・実行中だったジョブをキューに戻して実行し直します。
+    """
+    def __init__(self, jobs_dir, config_store, max_workers=None):
+        self.store = JobStore(jobs_dir)
+        self.config_store = config_store # ジョブで設定が指定されなかった場合に使用する既定の設定
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 2) // 2)
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        self._free_workers = threading.Semaphore(self.max_workers)
+        self._queue = queue.Queue()
+        for job in self.store.list_jobs():
+            if job["status"] in ("queued", "running"):
+                if job["status"] == "running":
+                    print(f"Re-queuing interrupted job {job['id']}")
+                    self.store.update(job["id"], status="queued", started=None)
+                self._queue.put(job["id"])
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, request):
+        """
+        ジョブを受け付けてキューに追加します。
+
+        Args:
+            request (dict): {"image_folder": 画像フォルダまたはzip/tarファイルのパス,
+                             "formats": ["excel", "pptx"] (省略時は ["excel"]),
+                             "config": 設定 (省略時はサービスの設定ファイル), "image_files": 処理する画像のリスト (省略可)}
+
+        Returns:
+            dict: 作成したジョブ。
+
+        Raises:
+            ValueError: リクエストの内容に問題がある場合。
+        """
+        if not isinstance(request, dict):
+            raise ValueError("リクエストはJSONオブジェクトで指定してください。")
+        image_folder = request.get("image_folder")
+        if not isinstance(image_folder, str) or not (os.path.isdir(image_folder) or is_archive(image_folder)):
+            raise ValueError(f"画像フォルダ (またはzip/tarファイル) が見つかりません: {image_folder}")
+        formats = request.get("formats", ["excel"])
+        if not isinstance(formats, list) or not formats or any(f not in OUTPUT_FORMATS for f in formats):
+            raise ValueError(f"formats には {', '.join(OUTPUT_FORMATS)} のリストを指定してください。")
+        image_files = request.get("image_files")
+        if image_files is not None and not (isinstance(image_files, list) and all(isinstance(f, str) for f in image_files)):
+            raise ValueError("image_files には画像ファイル名のリストを指定してください。")
+        config = request.get("config")
+        if config is None:
+            # 投入時点の設定をジョブに保存し、実行までに設定ファイルが変わっても投入時の内容で出力する
+            self.config_store.reload_if_changed()
+            config = self.config_store.data
+        errors = validate_config(config)
+        if errors:
+            raise ValueError("\n".join(errors))
+
+        job = self.store.create(os.path.abspath(image_folder), list(dict.fromkeys(formats)), config, image_files)
+        self._queue.put(job["id"])
+        print(f"Job {job['id']} queued ({image_folder})")
+        return job
+
+    def status(self, job_id):
+        """ジョブの状態を返す (設定の内容は含めない)。ジョブが無い場合は None。"""
+        job = self.store.load(job_id)
+        if job is None:
+            return None
+        status = {key: job[key] for key in ("id", "status", "image_folder", "formats", "outputs", "error",
+                                            "created", "started", "finished")}
+        status["progress"] = self.store.progress(job_id)
+        status["failed_images"] = self._failed_images(job_id, job["outputs"])
+        return status
+
+    def _failed_images(self, job_id, outputs):
+        """出力形式 -> 処理できなかった画像と理由のリスト (出力ファイルの隣の .errors.json を読み込む)。"""
+        failed_images = {}
+        for output_format, output_name in outputs.items():
+            report_path = os.path.join(self.store.job_dir(job_id), output_name + ERROR_REPORT_SUFFIX + ".json")
+            try:
+                with open(report_path, 'r', encoding='utf-8') as f:
+                    failed_images[output_format] = json.load(f)["failed"]
+            except (OSError, ValueError, KeyError):
+                continue
+        return failed_images
+
+    def result_path(self, job_id, output_format):
+        job = self.store.load(job_id)
+        if job is None or job["status"] != "done" or output_format not in job["outputs"]:
+            return None
+        path = os.path.join(self.store.job_dir(job_id), job["outputs"][output_format])
+        return path + ".zip" if output_format == "html" else path
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _dispatch_loop(self):
+        while True:
+            job_id = self._queue.get()
+            self._free_workers.acquire() # ワーカーが空くまで次のジョブはキューに残す
+            try:
+                if self.store.update(job_id, status="running", started=time.time()) is None:
+                    self._free_workers.release()
+                    continue
+                try:
+                    future = self._executor.submit(run_export_job, self.store.job_dir(job_id))
+                except BrokenProcessPool:
+                    # ワーカープロセスが異常終了するとプール全体が使えなくなるため、作り直す
+                    self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+                    future = self._executor.submit(run_export_job, self.store.job_dir(job_id))
+            except Exception as e:
+                self._free_workers.release()
+                print(f"Error starting job {job_id}: {e}")
+                continue
+            future.add_done_callback(lambda future, job_id=job_id: self._on_job_finished(job_id, future))
+
+    def _on_job_finished(self, job_id, future):
+        try:
+            outputs = future.result()
+        except Exception as e:
+            # ワーカープロセスの異常終了 (BrokenProcessPool) もここで失敗として記録する
+            if self.store.update(job_id, status="failed", error=str(e) or type(e).__name__, finished=time.time()) is not None:
+                print(f"Job {job_id} failed: {e}")
+        else:
+            if self.store.update(job_id, status="done", outputs=outputs, finished=time.time()) is not None:
+                print(f"Job {job_id} finished")
+        finally:
+            self._free_workers.release()
+
+
+class ExportRequestHandler(BaseHTTPRequestHandler):
+    """
+    出力サービスのHTTP API。
+    - POST /jobs                          ジョブの投入 (JSON)。202 とジョブの状態を返す
+    - GET  /jobs                          ジョブの一覧
+    - GET  /jobs/<ID>                     ジョブの状態と進捗 ({"processed": 処理済み枚数, "total": 全枚数})、処理できなかった画像
+    - GET  /jobs/<ID>/result/<excel|pptx|pdf|html> 出力ファイルのダウンロード (html は切り抜き画像と合わせたzipファイル)
+    """
+    service = None # ExportService (サーバーの作成時に設定する)
+    max_request_bytes = 16 * 1024 * 1024
+
+    def do_POST(self):
+        if urlparse(self.path).path.rstrip("/") != "/jobs":
+            return self._send_json(404, {"error": "Not found"})
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            if length > self.max_request_bytes:
+                return self._send_json(413, {"error": "Request too large"})
+            request = json.loads(self.rfile.read(length) or b"{}")
+            job = self.service.submit(request)
+        except (ValueError, json.JSONDecodeError) as e:
+            return self._send_json(400, {"error": str(e)})
+        self._send_json(202, self.service.status(job["id"]))
+
+    def do_GET(self):
+        parts = [part for part in urlparse(self.path).path.split("/") if part]
+        if parts == ["jobs"]:
+            return self._send_json(200, [self.service.status(job["id"]) for job in self.service.store.list_jobs()])
+        if len(parts) == 2 and parts[0] == "jobs":
+            status = self.service.status(parts[1])
+            if status is None:
+                return self._send_json(404, {"error": "Job not found"})
+            return self._send_json(200, status)
+        if len(parts) == 4 and parts[0] == "jobs" and parts[2] == "result" and parts[3] in OUTPUT_FORMATS:
+            path = self.service.result_path(parts[1], parts[3])
+            if path is None:
+                return self._send_json(404, {"error": "Result not available"})
+            return self._send_file(path, OUTPUT_FORMATS[parts[3]][1])
+        self._send_json(404, {"error": "Not found"})
+
+    def _send_json(self, code, data):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_file(self, path, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(os.path.getsize(path)))
+        self.send_header("Content-Disposition", f'attachment; filename="{os.path.basename(path)}"')
+        self.end_headers()
+        with open(path, 'rb') as f:
+            shutil.copyfileobj(f, self.wfile)
+
+    def log_message(self, format, *args):
+        print(f"{self.address_string()} - {format % args}")
+
+
+def main(argv=None):
+    multiprocessing.freeze_support() # exe化した場合にワーカープロセスが正しく起動するように
+    parser = argparse.ArgumentParser(description="画像の切り抜きとExcel/PowerPoint出力を行うローカルHTTPサービス")
+    parser.add_argument("--host", default="127.0.0.1", help="待ち受けるアドレス (既定: 127.0.0.1 = このPCからのみ接続可)")
+    parser.add_argument("--port", type=int, default=8765, help="待ち受けるポート番号")
+    parser.add_argument("--jobs-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "export_jobs"),
+                        help="ジョブと出力ファイルを保存するフォルダ")
+    parser.add_argument("--config", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json"),
+                        help="ジョブで設定が指定されなかった場合に使用する設定ファイル")
+    parser.add_argument("--workers", type=int, default=None, help="同時に実行するジョブの数 (既定: CPUコア数の半分)")
+    args = parser.parse_args(argv)
+
+    config_store = ConfigStore(args.config)
+    try:
+        config_store.load()
+    except Exception as e:
+        print(f"Error loading config file {args.config}: {e}")
+        return 1
+
+    service = ExportService(args.jobs_dir, config_store, args.workers)
+    handler = type("BoundExportRequestHandler", (ExportRequestHandler,), {"service": service})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    print(f"Export service listening on http://{args.host}:{args.port} ({service.max_workers} worker(s))")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,297 @@
+import queue
+import threading
+import tkinter as tk
+from tkinter import ttk
+from collections import OrderedDict
+from PIL import ImageTk
+from image_normalize import orientation_transpose
+
+class FrameLoader:
+    """
+    フォルダ (またはアーカイブ) 内の画像を必要になった分だけバックグラウンドで読み込むローダー。
+    - サムネイルはJPEGのdraftモードで縮小デコードし、LRUキャッシュに保持します。
+    - 表示中の画像の前後の画像を先読みし、長辺が preview_size 以下に縮小した画像 (JPEGはdraftモードでデコード) を
+      バイト数で上限を設けたLRUキャッシュに保持します。元の解像度のデコードは、拡大表示したときにTiledImageViewが行います。
+    1万枚規模のフォルダでも、全画像を読み込むことはありません。
+
+    Tkのオブジェクトは扱わないため、作成したサムネイルは poll_thumbnails() でメインスレッドから受け取ります。
+    """
+    def __init__(self, image_source, image_files, thumbnail_size=96, preview_size=2048, frame_cache_bytes=64 * 1024 * 1024,
+                 thumbnail_cache_size=512, prefetch_radius=1, num_workers=2):
+        self.image_source = image_source # image_source.ImageSource
+        self.image_files = image_files
+        self.thumbnail_size = thumbnail_size
+        self.preview_size = preview_size
+        self.frame_cache_bytes = frame_cache_bytes
+        self.thumbnail_cache_size = thumbnail_cache_size
+        self.prefetch_radius = prefetch_radius
+
+        self._lock = threading.Lock()
+        self._frames = OrderedDict() # index -> (段番号k, 元画像の 1/2**k に縮小した画像, EXIFの向きのtranspose)
+        self._frame_bytes = 0 # キャッシュ中の縮小画像のバイト数の合計
+        self._thumbnails = OrderedDict() # index -> サムネイルのPIL Image
+        self._pending = set() # ("frame" | "thumb", index)
+        self._wanted_thumbnails = frozenset() # サムネイルストリップに表示中のインデックス
+        self._requests = queue.LifoQueue() # 最後に要求されたもの (= 今見ているもの) を優先する
+        self._results = queue.Queue() # (index, サムネイル)
+        self._closed = False
+
+        self._workers = [threading.Thread(target=self._worker_loop, daemon=True) for _ in range(num_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def __len__(self):
+        return len(self.image_files)
+
+    def open_frame(self, index):
+        """
+        画像を返す。先読み済みで縮小の必要が無い (長辺が preview_size 以下の) 画像はデコード済みの画像を、
+        それ以外は遅延読み込みの画像を返す (ピクセルのデコードはTiledImageViewが表示範囲のタイル単位で行う)。
+        EXIFで回転・反転が指定された画像も元の向きのまま返す (画像全体の回転はデコードが必要なため、
+        TiledImageViewがタイルごとに出力と同じ向きにして表示する。向きを反映したサイズは image_normalize.oriented_size)。
+        """
+        with self._lock:
+            entry = self._frames.get(index)
+            if entry is not None:
+                self._frames.move_to_end(index)
+                if entry[0] == 0:
+                    return entry[1]
+        return self.open_lazy_frame(index)
+
+    def preview_levels(self, index):
+        """
+        先読み済みの縮小画像を {段番号k: 画像} の形式で返す (TiledImageViewの多段解像度画像の段として使う)。
+        先読みされていない場合や、縮小していない場合 (open_frame がデコード済みの画像を返す場合) は空。
+        """
+        with self._lock:
+            entry = self._frames.get(index)
+        return {entry[0]: entry[1]} if entry is not None and entry[0] > 0 else {}
+
+    def open_lazy_frame(self, index):
+        """先読みのキャッシュを使わず、遅延読み込みの画像を新しく開く (TiledImageViewが縮小した解像度でデコードするために使う)。"""
+        return self.image_source.open_image(self.image_files[index])
+
+    def prefetch(self, index):
+        """表示中の画像の前後 prefetch_radius 枚を先読みする (近い順に処理されるよう遠い方から積む)。"""
+        for distance in range(self.prefetch_radius, 0, -1):
+            for neighbour in (index + distance, index - distance):
+                if 0 <= neighbour < len(self.image_files):
+                    self._request("frame", neighbour)
+
+    def set_wanted_thumbnails(self, indices):
+        """表示範囲のサムネイルを要求する。範囲外になった未処理の要求はワーカーが読み飛ばす。"""
+        self._wanted_thumbnails = frozenset(indices)
+        for index in indices:
+            with self._lock:
+                thumbnail = self._thumbnails.get(index)
+                if thumbnail is not None:
+                    self._thumbnails.move_to_end(index)
+            if thumbnail is not None:
+                self._results.put((index, thumbnail))
+            else:
+                self._request("thumb", index)
+
+    def poll_thumbnails(self, max_items=16):
+        results = []
+        try:
+            for _ in range(max_items):
+                results.append(self._results.get_nowait())
+        except queue.Empty:
+            pass
+        return results
+
+    def close(self):
+        self._closed = True
+        for _ in self._workers:
+            self._requests.put(None)
+
+    def _request(self, kind, index):
+        key = (kind, index)
+        with self._lock:
+            if key in self._pending or (kind == "frame" and index in self._frames):
+                return
+            self._pending.add(key)
+        self._requests.put(key)
+
+    def _worker_loop(self):
+        while True:
+            key = self._requests.get()
+            if key is None or self._closed:
+                break
+            kind, index = key
+            try:
+                if kind == "thumb":
+                    if index in self._wanted_thumbnails:
+                        thumbnail = self._load_thumbnail(index)
+                        self._results.put((index, thumbnail))
+                else:
+                    self._load_frame(index)
+            except Exception as e:
+                print(f"画像 '{self.image_files[index]}' の読み込み中にエラーが発生しました: {e}")
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+
+    def _load_thumbnail(self, index):
+        with self._lock:
+            entry = self._frames.get(index)
+        if entry is not None:
+            _, preview, method = entry
+            img = preview.copy()
+        else:
+            img = self.image_source.open_image(self.image_files[index])
+            # JPEGは縮小した解像度で直接デコードする (他の形式では何もしない)
+            img.draft("RGB", (self.thumbnail_size * 2, self.thumbnail_size * 2))
+            method = orientation_transpose(img)
+        img.thumbnail((self.thumbnail_size, self.thumbnail_size))
+        if method is not None:
+            img = img.transpose(method) # 縮小してから回転・反転する
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.load()
+
+        with self._lock:
+            self._thumbnails[index] = img
+            while len(self._thumbnails) > self.thumbnail_cache_size:
+                self._thumbnails.popitem(last=False)
+        return img
+
+    def _load_frame(self, index):
+        img = self.image_source.open_image(self.image_files[index])
+        method = orientation_transpose(img)
+        # 長辺が preview_size 以下になる段 (元画像の 1/2**k) まで縮小する
+        width, height = img.size
+        level = 0
+        while max(width, height) / 2 ** level > self.preview_size:
+            level += 1
+        if level > 0:
+            # JPEGは縮小した解像度で直接デコードする (1/8まで。他の形式では何もしない)
+            img.draft(None, (width // 2 ** level, height // 2 ** level))
+        if img.mode not in ("RGB", "RGBA", "L"):
+            img = img.convert("RGB")
+        factor = 2 ** level * img.width // width # draftで縮小できなかった分
+        if factor > 1:
+            img = img.reduce(factor)
+        img.load()
+
+        size = img.width * img.height * len(img.getbands())
+        with self._lock:
+            self._frames[index] = (level, img, method)
+            self._frame_bytes += size
+            while self._frame_bytes > self.frame_cache_bytes and len(self._frames) > 1:
+                _, (_, old_img, _) = self._frames.popitem(last=False)
+                self._frame_bytes -= old_img.width * old_img.height * len(old_img.getbands())
+
+
+class ThumbnailStrip:
+    """
+    画像のサムネイルを横一列に並べるストリップ。表示範囲のスロットだけを作成するため、
+    画像の枚数に関わらずCanvasのアイテム数は一定です。クリックで on_select(index) を呼び出します。
+    """
+    def __init__(self, master, loader, on_select, padding=6):
+        self.loader = loader
+        self.on_select = on_select
+        self.padding = padding
+        self.slot_width = loader.thumbnail_size + padding * 2
+        self.current_index = 0
+        self._slots = {} # index -> {"frame": id, "label": id, "image": id or None, "photo": PhotoImage or None}
+        self._refresh_scheduled = False
+        self._closed = False
+
+        self.frame = tk.Frame(master)
+        strip_height = loader.thumbnail_size + padding * 2 + 16
+        self.canvas = tk.Canvas(self.frame, height=strip_height, bg="gray25", highlightthickness=0)
+        self.scrollbar = ttk.Scrollbar(self.frame, orient="horizontal", command=self.canvas.xview)
+        self.canvas.config(xscrollcommand=self._on_xscroll,
+                           scrollregion=(0, 0, len(loader) * self.slot_width, strip_height))
+        self.scrollbar.pack(side="bottom", fill="x")
+        self.canvas.pack(side="top", fill="x")
+
+        self.canvas.bind("<Configure>", lambda event: self.schedule_refresh())
+        self.canvas.bind("<Button-1>", self._on_click)
+        self._poll_thumbnails()
+
+    def set_current(self, index):
+        previous = self._slots.get(self.current_index)
+        if previous is not None:
+            self.canvas.itemconfig(previous["frame"], outline="gray40")
+        self.current_index = index
+        current = self._slots.get(index)
+        if current is not None:
+            self.canvas.itemconfig(current["frame"], outline="yellow")
+
+        # 選択中のサムネイルが見えるようにスクロール
+        view_width = max(1, self.canvas.winfo_width())
+        left = self.canvas.canvasx(0)
+        slot_left = index * self.slot_width
+        if slot_left < left or slot_left + self.slot_width > left + view_width:
+            total_width = len(self.loader) * self.slot_width
+            self.canvas.xview_moveto(max(0, slot_left - (view_width - self.slot_width) / 2) / total_width)
+        self.schedule_refresh()
+
+    def schedule_refresh(self):
+        if self._closed or self._refresh_scheduled:
+            return
+        self._refresh_scheduled = True
+        self.canvas.after_idle(self.refresh)
+
+    def refresh(self):
+        self._refresh_scheduled = False
+        if self._closed:
+            return
+        left = self.canvas.canvasx(0)
+        first = max(0, int(left // self.slot_width) - 1)
+        last = min(len(self.loader) - 1, int((left + self.canvas.winfo_width()) // self.slot_width) + 1)
+        visible = range(first, last + 1)
+
+        # 表示範囲外になったスロットを破棄
+        for index in [i for i in self._slots if i < first or i > last]:
+            slot = self._slots.pop(index)
+            for key in ("frame", "label", "image"):
+                if slot[key] is not None:
+                    self.canvas.delete(slot[key])
+
+        for index in visible:
+            if index not in self._slots:
+                self._create_slot(index)
+        self.loader.set_wanted_thumbnails(list(visible))
+
+    def close(self):
+        self._closed = True
+        self._slots.clear()
+
+    def _create_slot(self, index):
+        x = index * self.slot_width
+        size = self.loader.thumbnail_size
+        frame_id = self.canvas.create_rectangle(
+            x + self.padding - 2, self.padding - 2, x + self.padding + size + 2, self.padding + size + 2,
+            outline="yellow" if index == self.current_index else "gray40", width=2, fill="gray30"
+        )
+        filename = self.loader.image_files[index]
+        label = filename if len(filename) <= 14 else filename[:6] + "…" + filename[-7:]
+        label_id = self.canvas.create_text(
+            x + self.slot_width / 2, self.padding * 2 + size + 2, text=label, fill="white", font=("Arial", 8)
+        )
+        self._slots[index] = {"frame": frame_id, "label": label_id, "image": None, "photo": None}
+
+    def _poll_thumbnails(self):
+        if self._closed:
+            return
+        for index, thumbnail in self.loader.poll_thumbnails():
+            slot = self._slots.get(index)
+            if slot is None or slot["image"] is not None:
+                continue
+            x = index * self.slot_width + self.padding + self.loader.thumbnail_size / 2
+            y = self.padding + self.loader.thumbnail_size / 2
+            slot["photo"] = ImageTk.PhotoImage(thumbnail)
+            slot["image"] = self.canvas.create_image(x, y, image=slot["photo"], anchor="center")
+        self.canvas.after(30, self._poll_thumbnails)
+
+    def _on_xscroll(self, first, last):
+        self.scrollbar.set(first, last)
+        self.schedule_refresh()
+
+    def _on_click(self, event):
+        index = int(self.canvas.canvasx(event.x) // self.slot_width)
+        if 0 <= index < len(self.loader):
+            self.on_select(index)
@@ -0,0 +1,126 @@
+import io
+import functools
+
+# EXIFの Orientation タグ
+ORIENTATION_TAG = 0x0112
+# 切り抜き・出力に使う画像のモード (8bitのsRGB / グレースケール、透過付きを含む)。これ以外のモードは変換する
+NORMALIZED_MODES = ("RGB", "L", "RGBA", "LA")
+
+def orientation_transpose(img):
+    """
+    EXIFの Orientation から、画像を正しい向きにするための Image.transpose の引数を返します。
+    回転・反転が不要な場合 (Orientation が無い、または 1 の場合) は None を返します。
+    ヘッダーのみを参照するため、ピクセルはデコードしません。
+    """
+    from PIL import Image
+    if img.format == "PNG" and "exif" not in img.info:
+        # PNGの getexif は、画像データの後ろのEXIFを探すために画像全体をデコードするため、画像データの前のEXIFのみを見る
+        return None
+    try:
+        orientation = img.getexif().get(ORIENTATION_TAG, 1)
+    except Exception:
+        return None # EXIFが壊れている画像は、回転せずにそのまま使う
+    return {
+        2: Image.Transpose.FLIP_LEFT_RIGHT,
+        3: Image.Transpose.ROTATE_180,
+        4: Image.Transpose.FLIP_TOP_BOTTOM,
+        5: Image.Transpose.TRANSPOSE,
+        6: Image.Transpose.ROTATE_270,
+        7: Image.Transpose.TRANSVERSE,
+        8: Image.Transpose.ROTATE_90,
+    }.get(orientation)
+
+def oriented_size(img):
+    """EXIFの向きを反映した画像の (幅, 高さ) を返します (デコードせずに求められる)。"""
+    from PIL import Image
+    method = orientation_transpose(img)
+    if method in (Image.Transpose.TRANSPOSE, Image.Transpose.TRANSVERSE,
+                  Image.Transpose.ROTATE_90, Image.Transpose.ROTATE_270):
+        return img.size[1], img.size[0]
+    return img.size
+
+def _transpose(img, method):
+    rotated = img.transpose(method)
+    # 回転済みの画像を再び回転しないよう、Orientation を含むEXIFを引き継がない
+    rotated.info.pop("exif", None)
+    return rotated
+
+def orient_image(img):
+    """
+    EXIFの向きを反映した画像を返します。回転・反転が不要な画像は、デコードせずにそのまま返します。
+    領域の座標は、この向きの画像に対する座標です (画像領域の設定画面と出力で同じ向きになるように)。
+    """
+    method = orientation_transpose(img)
+    return img if method is None else _transpose(img, method)
+
+@functools.lru_cache(maxsize=16)
+def _srgb_transform(icc_profile, mode):
+    """
+    埋め込みICCプロファイルから sRGB への変換を作成する (プロファイルと画像のモードごとに1回だけ)。
+    sRGBのプロファイルの場合や、変換を作成できない場合は None を返す。
+    """
+    try:
+        from PIL import ImageCms
+        source = ImageCms.ImageCmsProfile(io.BytesIO(icc_profile))
+        if mode != "CMYK" and "srgb" in ImageCms.getProfileDescription(source).lower():
+            return None # 既にsRGBの画像は変換しない
+        output_mode = "RGBA" if mode == "RGBA" else "RGB"
+        return ImageCms.buildTransform(source, ImageCms.createProfile("sRGB"), mode, output_mode)
+    except Exception as e:
+        # littleCMSを含まないPillowや、壊れたプロファイルの場合は、色変換をせずにモードの変換のみを行う
+        print(f"ICC profile ignored: {e}")
+        return None
+
+def _to_8bit_gray(img):
+    # 16bitのグレースケール (I;16 や、16bit PNGの I) は上位8bitを使う (Pillowの convert("L") は255で頭打ちになる)
+    import numpy as np
+    from PIL import Image
+    pixels = np.asarray(img)
+    return Image.fromarray(np.clip(pixels.astype(np.int64) >> 8, 0, 255).astype(np.uint8), "L")
+
+def _convert_mode(img):
+    icc_profile = img.info.get("icc_profile")
+    if icc_profile and img.mode in ("RGB", "RGBA", "CMYK"):
+        transform = _srgb_transform(bytes(icc_profile), img.mode)
+        if transform is not None:
+            from PIL import ImageCms
+            img = ImageCms.applyTransform(img, transform)
+            img.info.pop("icc_profile", None) # 変換後はsRGBのため、元のプロファイルを切り抜き画像に埋め込まない
+            return img
+    if img.mode in NORMALIZED_MODES:
+        return img
+    if img.mode.startswith("I;16") or img.mode == "I":
+        return _to_8bit_gray(img)
+    if img.mode == "P":
+        return img.convert("RGBA" if "transparency" in img.info else "RGB")
+    if img.mode in ("PA", "RGBa"):
+        return img.convert("RGBA")
+    if img.mode == "La":
+        return img.convert("LA")
+    if img.mode in ("1", "F"):
+        return img.convert("L")
+    return img.convert("RGB") # CMYK (プロファイル無し) / YCbCr / LAB / HSV / RGBX など
+
+def normalize_image(img):
+    """
+    切り抜き前の画像を、EXIFの向きを反映した 8bit の sRGB (またはグレースケール) 画像にします。
+
+    - EXIFの Orientation に従って回転・反転します。領域の座標は回転後の画像に適用します。
+    - 埋め込みICCプロファイルがある場合は、sRGBに変換します (変換はプロファイルごとにキャッシュする)。
+    - CMYK・16bit・パレット (GIFなど) の画像は、8bitのRGB / グレースケールに変換します
+      (切り抜き画像ごとの変換や、PNGの保存サイズの増加を避けるため、画像ごとに1回だけ変換する)。
+
+    向きが正しく、色の変換も不要な RGB / L などの画像は、何もせずに (デコードもせずに) そのまま返します。
+
+    Args:
+        img (PIL.Image.Image): Image.open で開いた画像。
+
+    Returns:
+        PIL.Image.Image: 変換後の画像 (変換が不要な場合は img そのもの)。
+    """
+    method = orientation_transpose(img)
+    if method is None and img.mode in NORMALIZED_MODES and not img.info.get("icc_profile"):
+        return img
+    img = _convert_mode(img)
+    # 回転は変換後 (8bit) の画像に行う
+    return img if method is None else _transpose(img, method)
@@ -0,0 +1,363 @@
+import io
+import os
+import abc
+import time
+import tarfile
+import zipfile
+import threading
+import functools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# 処理対象の画像の拡張子
+SUPPORTED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff')
+# 画像フォルダの代わりに指定できるアーカイブの拡張子
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+def is_supported_image(filename):
+    return filename.lower().endswith(SUPPORTED_EXTENSIONS)
+
+def is_archive(path):
+    return os.path.isfile(path) and path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+def open_image_source(path):
+    """
+    画像フォルダまたはアーカイブ (zip/tar) のパスから、画像の読み込み元を作成します。
+
+    Args:
+        path (str): 画像フォルダ、またはzip/tarファイルのパス。
+
+    Returns:
+        ImageSource: FolderImageSource / ZipImageSource / TarImageSource のいずれか。
+    """
+    if is_archive(path):
+        if path.lower().endswith('.zip'):
+            return ZipImageSource(path)
+        return TarImageSource(path)
+    return FolderImageSource(path)
+
+def list_image_files(image_folder_path, recursive=False):
+    """
+    画像フォルダ内の画像ファイルを、フォルダからの相対パスのソート済みリストで返します。
+
+    Args:
+        image_folder_path (str): 画像フォルダのパス。
+        recursive (bool): Trueの場合はサブフォルダ内の画像も含めます (隠しフォルダは除く)。
+    """
+    if not recursive:
+        return sorted(f for f in os.listdir(image_folder_path) if is_supported_image(f))
+
+    image_files = []
+    for dirpath, dirnames, filenames in os.walk(image_folder_path):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith(".")) # キャッシュ用の隠しフォルダなどは除外
+        relative_dir = os.path.relpath(dirpath, image_folder_path)
+        for filename in filenames:
+            if is_supported_image(filename):
+                image_files.append(filename if relative_dir == "." else os.path.join(relative_dir, filename))
+    return sorted(image_files)
+
+
+def _open_pil_image(fp):
+    # Pillowは画像を開くときに初めて読み込む (画像の一覧だけを使うGUIの起動時などに読み込まないように)
+    from PIL import Image
+    return Image.open(fp)
+
+def _is_hidden_member(name):
+    # 隠しファイル・フォルダや、macOSが作成する __MACOSX フォルダ内のファイルは対象外
+    return any(part.startswith(".") or part == "__MACOSX" for part in name.split("/"))
+
+
+class ImageSource(abc.ABC):
+    """
+    画像の読み込み元 (画像フォルダ、またはアーカイブ) の共通インターフェース。
+    画像は、読み込み元からの相対パス (アーカイブではメンバー名) で指定します。
+    """
+    path = None
+
+    @abc.abstractmethod
+    def list_images(self, recursive=False):
+        """画像の相対パス (アーカイブではメンバー名) のソート済みリストを返す。"""
+
+    @abc.abstractmethod
+    def open_file(self, name):
+        """画像ファイルの内容を読み込むバイナリのファイルオブジェクトを返す。"""
+
+    def read(self, name):
+        """画像ファイルの内容をバイト列で返す。"""
+        with self.open_file(name) as f:
+            return f.read()
+
+    def open_image(self, name):
+        """画像を開く (Image.openと同様、ピクセルのデコードは必要になるまで行わない)。"""
+        return _open_pil_image(self.open_file(name))
+
+    @abc.abstractmethod
+    def signature(self, name):
+        """画像が変更されたかどうかの判定に使う [名前, サイズ, 更新時刻など] のリスト。"""
+
+    @abc.abstractmethod
+    def cache_dir(self, dir_name):
+        """解析結果などのキャッシュを保存するフォルダのパス。"""
+
+    def iter_images(self, names):
+        """
+        画像を順番に開くための (名前, opener) を返すイテレーター。opener() を呼ぶと画像を開きます
+        (読み込みに失敗した場合は opener() が例外を送出するため、画像ごとのエラー処理の中で呼んでください)。
+        """
+        for name in names:
+            yield name, functools.partial(self.open_image, name)
+
+    def iter_files(self, names):
+        """
+        画像ファイルの内容を順番に読み込むための (名前, reader) を返すイテレーター。reader() は内容のバイト列を返します
+        (画像を別のプロセスで開く場合に使う。読み込みに失敗した場合は reader() が例外を送出する)。
+        """
+        for name in names:
+            yield name, functools.partial(self.read, name)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class FolderImageSource(ImageSource):
+    """画像フォルダから画像を読み込む。"""
+    def __init__(self, path):
+        self.path = path
+
+    def list_images(self, recursive=False):
+        return list_image_files(self.path, recursive)
+
+    def open_file(self, name):
+        return open(os.path.join(self.path, name), 'rb')
+
+    def open_image(self, name):
+        return _open_pil_image(os.path.join(self.path, name))
+
+    def signature(self, name):
+        stat = os.stat(os.path.join(self.path, name))
+        return [name, stat.st_size, stat.st_mtime_ns]
+
+    def cache_dir(self, dir_name):
+        return os.path.join(self.path, dir_name)
+
+
+class _ArchiveImageSource(ImageSource):
+    """アーカイブ内の画像を、展開せずに直接読み込む読み込み元の共通部分。"""
+    def __init__(self, path):
+        self.path = path
+        self._members = {} # メンバー名 -> ZipInfo / TarInfo
+
+    def list_images(self, recursive=False):
+        # アーカイブは全体で1つの画像セットとして扱うため、サブフォルダ内の画像も常に含める
+        return sorted(self._members)
+
+    def open_file(self, name):
+        return io.BytesIO(self.read(name))
+
+    @abc.abstractmethod
+    def read(self, name):
+        """メンバーの内容をバイト列で返す。"""
+
+    def cache_dir(self, dir_name):
+        # アーカイブ内には書き込めないため、アーカイブと同じフォルダにアーカイブごとのキャッシュを置く
+        return os.path.join(os.path.dirname(os.path.abspath(self.path)), dir_name, os.path.basename(self.path))
+
+
+class ZipImageSource(_ArchiveImageSource):
+    """
+    zipファイル内の画像を、展開せずに直接読み込む。
+
+    zipはメンバーごとに独立して読み込めるため、スレッドごとにファイルを開き、
+    iter_images() では後続の画像の読み込み (ディスクの読み込みと伸張) を複数のスレッドで先行して行います。
+    """
+    def __init__(self, path, num_workers=4, prefetch=8):
+        super().__init__(path)
+        self.num_workers = num_workers
+        self.prefetch = prefetch
+        self._local = threading.local()
+        self._handles = []
+        self._handles_lock = threading.Lock()
+        for info in self._zip().infolist():
+            if not info.is_dir() and is_supported_image(info.filename) and not _is_hidden_member(info.filename):
+                self._members[info.filename] = info
+
+    def _zip(self):
+        # ZipFileのファイルオブジェクトは読み込み位置を共有するため、スレッドごとに別のハンドルを使う
+        handle = getattr(self._local, "zip", None)
+        if handle is None:
+            handle = zipfile.ZipFile(self.path)
+            self._local.zip = handle
+            with self._handles_lock:
+                self._handles.append(handle)
+        return handle
+
+    def read(self, name):
+        return self._zip().read(self._members[name])
+
+    def signature(self, name):
+        info = self._members[name]
+        return [name, info.file_size, info.CRC]
+
+    def iter_images(self, names):
+        for name, reader in self.iter_files(names):
+            yield name, functools.partial(_open_prefetched, reader)
+
+    def iter_files(self, names):
+        names = list(names)
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            futures = deque()
+            next_index = 0
+            for name in names:
+                # 常に prefetch 枚先までの読み込みを投入しておく (メモリ使用量を抑えるため、それ以上は先読みしない)
+                while next_index < len(names) and len(futures) < self.prefetch:
+                    futures.append(executor.submit(self.read, names[next_index]))
+                    next_index += 1
+                yield name, futures.popleft().result
+
+    def close(self):
+        with self._handles_lock:
+            for handle in self._handles:
+                handle.close()
+            self._handles = []
+        self._local = threading.local()
+
+
+def _open_prefetched(reader):
+    return open_image_data(reader())
+
+def open_image_data(data):
+    """読み込み済みの画像ファイルの内容 (バイト列) から画像を開く。"""
+    return _open_pil_image(io.BytesIO(data))
+
+
+class TarImageSource(_ArchiveImageSource):
+    """
+    tarファイル (gzip/bzip2/xz圧縮を含む) 内の画像を、展開せずに直接読み込む。
+
+    tarはメンバーを先頭から順にしか探せないため、開くときに一度だけ全体を走査してメンバーの一覧を作成します。
+    圧縮されたtarでは前方に戻る読み込みのたびに先頭から伸張し直すため、読み込みは1つのハンドルで順番に行います
+    (名前順に格納されたアーカイブであれば、名前順の処理は1回の伸張で済みます)。
+    """
+    def __init__(self, path):
+        super().__init__(path)
+        self._lock = threading.Lock()
+        self._tar = tarfile.open(path, 'r:*')
+        for info in self._tar.getmembers():
+            if info.isfile() and is_supported_image(info.name) and not _is_hidden_member(info.name):
+                self._members[info.name] = info
+
+    def read(self, name):
+        with self._lock:
+            with self._tar.extractfile(self._members[name]) as f:
+                return f.read()
+
+    def signature(self, name):
+        info = self._members[name]
+        return [name, info.size, info.mtime]
+
+    def close(self):
+        self._tar.close()
+
+
+class FolderScanner:
+    """
+    フォルダを定期的に走査して新しい画像ファイルを見つけるスキャナー。
+
+    フォルダごとに更新時刻と一覧をキャッシュし、更新時刻が変わったフォルダだけを読み直します
+    (ファイルの追加・削除でフォルダの更新時刻が変わるため)。既に見つけたファイルは再びstatしないので、
+    1回の走査でのファイルシステムへのアクセスはファイル数ではなくフォルダ数に比例し、10万ファイル規模でも軽量です。
+
+    新しいファイルは、サイズと更新時刻が settle_seconds の間変化せず、読み込みのために開けるようになってから
+    (= スキャナーなどによる書き込みが完了してから) 「準備完了」として返します。
+    """
+    # 更新時刻の分解能が粗いファイルシステムでは、一覧の取得直後に追加されたファイルで更新時刻が変わらないことがある。
+    # 更新からこの秒数以内のフォルダはキャッシュを信用せず、次回も読み直す
+    DIR_MTIME_GRACE_SECONDS = 2.0
+
+    def __init__(self, root, recursive=True, settle_seconds=2.0, clock=None):
+        self.root = root
+        self.recursive = recursive
+        self.settle_seconds = settle_seconds
+        self._clock = clock or time.monotonic
+        self._dirs = {} # 相対パス -> (更新時刻, サブフォルダのリスト, 画像ファイルのセット)
+        self._known = set() # 準備完了として返したファイル
+        self._pending = {} # 書き込み待ちのファイル -> (サイズ, 更新時刻, 変化が無くなった時刻)
+
+    def mark_known(self, image_files):
+        """既に処理済みのファイルを登録する (再開時など)。これらは準備完了として返されない。"""
+        self._known.update(image_files)
+
+    def scan(self):
+        """
+        フォルダを走査し、新たに書き込みが完了したファイルを返します。
+
+        Returns:
+            list: 画像ファイルの相対パスのソート済みリスト。
+        """
+        for relative_path in self._scan_dir(""):
+            if relative_path not in self._known and relative_path not in self._pending:
+                self._pending[relative_path] = None
+        return self._collect_ready()
+
+    def _scan_dir(self, relative_dir):
+        full_dir = os.path.join(self.root, relative_dir) if relative_dir else self.root
+        try:
+            mtime = os.stat(full_dir).st_mtime_ns
+        except OSError:
+            self._dirs.pop(relative_dir, None)
+            return
+        cached = self._dirs.get(relative_dir)
+        if cached is None or cached[0] != mtime:
+            subdirs, files = [], set()
+            try:
+                with os.scandir(full_dir) as entries:
+                    for entry in entries:
+                        if entry.name.startswith("."):
+                            continue
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.name)
+                        elif is_supported_image(entry.name):
+                            files.add(os.path.join(relative_dir, entry.name) if relative_dir else entry.name)
+            except OSError:
+                return
+            recently_modified = time.time() - mtime / 1e9 < self.DIR_MTIME_GRACE_SECONDS
+            cached = (None if recently_modified else mtime, subdirs, files)
+            self._dirs[relative_dir] = cached
+        _, subdirs, files = cached
+        yield from files
+        if self.recursive:
+            for subdir in subdirs:
+                yield from self._scan_dir(os.path.join(relative_dir, subdir) if relative_dir else subdir)
+
+    def _collect_ready(self):
+        now = self._clock()
+        ready = []
+        for relative_path, previous in list(self._pending.items()):
+            full_path = os.path.join(self.root, relative_path)
+            try:
+                stat = os.stat(full_path)
+            except OSError:
+                del self._pending[relative_path] # 書き込み途中で削除・移動された
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if previous is None or previous[:2] != signature:
+                self._pending[relative_path] = signature + (now,) # 変化があれば待ち時間をやり直す
+                continue
+            if stat.st_size == 0 or now - previous[2] < self.settle_seconds:
+                continue
+            try:
+                # 書き込み中のファイルを排他的に開いているアプリケーションもあるため、開けることを確認する
+                with open(full_path, 'rb') as f:
+                    f.read(1)
+            except OSError:
+                continue
+            del self._pending[relative_path]
+            self._known.add(relative_path)
+            ready.append(relative_path)
+        return sorted(ready)
@@ -1,82 +1,208 @@
 
 import os
+import re
 import json
-import tempfile
-from PIL import Image
-from openpyxl import Workbook
+from crop_pipeline import CropPipeline
+from office_package import save_workbook
+import contact_sheet as contact_layout
+from openpyxl import Workbook, load_workbook
 from openpyxl.drawing.image import Image as ExcelImage
+from openpyxl.utils import get_column_letter
 
-def insert_images_to_excel(excel_filepath: str, image_folder_path: str, regions_and_coords: list):
+# テンプレート内でファイル名に置き換えられるプレースホルダー
+FILENAME_PLACEHOLDER = "{filename}"
+
+# 一覧シートの項目の最大サイズ (ピクセル)。Excelの行の高さは409ポイント (約545ピクセル) まで
+CONTACT_SHEET_MAX_ITEM_SIZE = (1700, 520)
+
+# シート名に使用できない文字
+_INVALID_SHEET_TITLE_CHARS = re.compile(r'[\\/\[\]:*?]')
+
+def _sheet_title(image_filename):
+    """画像ファイル名 (サブフォルダを含む相対パス) からシート名を作成する。シート名は31文字まで。"""
+    return _INVALID_SHEET_TITLE_CHARS.sub("_", os.path.splitext(image_filename)[0])[:31]
+
+def _find_placeholder_cells(template_ws):
+    """
+    テンプレートシート内でファイル名プレースホルダーを含むセルを一度だけ走査して返します。
+
+    Returns:
+        list: (セル座標, 元の文字列) のリスト。
+    """
+    placeholder_cells = []
+    for row in template_ws.iter_rows():
+        for cell in row:
+            if isinstance(cell.value, str) and FILENAME_PLACEHOLDER in cell.value:
+                placeholder_cells.append((cell.coordinate, cell.value))
+    return placeholder_cells
+
+def _add_image_sheet(wb, image_filename, template_ws=None, placeholder_cells=()):
+    """画像1枚分のシートを追加する (テンプレートがあればテンプレートシートを複製し、ファイル名のみ差し込む)。"""
+    sheet_name = _sheet_title(image_filename) # シート名は31文字まで
+    if template_ws is not None:
+        ws = wb.copy_worksheet(template_ws)
+        ws.title = sheet_name
+        for coordinate, template_value in placeholder_cells:
+            ws[coordinate].value = template_value.replace(FILENAME_PLACEHOLDER, image_filename)
+    else:
+        ws = wb.create_sheet(title=sheet_name)
+    print(f"Processing image: {image_filename} on sheet: {sheet_name}")
+    return ws
+
+def _add_contact_sheet(wb, page_number, items, columns, spacing):
+    """
+    複数の画像の切り抜き画像を、キャプション (ファイル名) 付きのグリッドに並べた一覧シートを追加します。
+    グリッドの列 = シートの列、グリッドの行 = キャプションの行 + 画像の行 とし、
+    列幅・行の高さを項目のサイズから事前に計算して設定するため、各画像はセルの左上に置くだけで揃います。
+    """
+    layout = contact_layout.GridLayout([(item.width, item.height) for item in items], columns, spacing,
+                                       max_item_size=CONTACT_SHEET_MAX_ITEM_SIZE)
+    ws = wb.create_sheet(title=contact_layout.page_title(page_number))
+    for column, width in enumerate(layout.col_widths, start=1):
+        # 列幅の単位は文字数 (既定のフォントで 1文字 ≒ 7ピクセル + 余白5ピクセル)
+        ws.column_dimensions[get_column_letter(column)].width = max(width + spacing - 5, 0) / 7
+    for row, height in enumerate(layout.row_heights):
+        ws.row_dimensions[row * 2 + 1].height = layout.caption_height * 0.75 # ピクセル -> ポイント
+        ws.row_dimensions[row * 2 + 2].height = (height + spacing) * 0.75
+    for index, item in enumerate(items):
+        column, row = layout.cell(index)
+        column_letter = get_column_letter(column + 1)
+        ws[f"{column_letter}{row * 2 + 1}"] = contact_layout.caption_text(item.caption)
+        img = ExcelImage(item.crop_path)
+        img.width, img.height = layout.item_sizes[index]
+        ws.add_image(img, f"{column_letter}{row * 2 + 2}")
+    print(f"  - Added contact sheet {ws.title} with {len(items)} cropped region(s)")
+
+class ExcelOutput:
+    """
+    切り抜き画像をExcelブックに書き込む出力 (CropPipeline.run に渡す)。
+    画像ごとにシートを作成し (template_path を指定した場合はテンプレートの先頭シートを複製し)、
+    contact_sheet が有効な場合は複数の画像の切り抜き画像を一覧シートに並べます。
+    """
+    def __init__(self, excel_filepath, template_path=None, compression=None, contact_sheet=None):
+        self.output_path = excel_filepath
+        self.compression = compression
+        # 出力結果に影響する設定が同じ場合のみ再開できる
+        self.checkpoint_settings = {"format": "excel", "template": template_path, "contact_sheet": contact_sheet}
+        self.template_ws = None
+        self.placeholder_cells = []
+        if template_path:
+            # テンプレートを読み込み、先頭シートを複製元とする
+            # (openpyxlの制約により、テンプレート内の画像・グラフは引き継がれません)
+            self.wb = load_workbook(template_path)
+            self.template_ws = self.wb.worksheets[0]
+            self.placeholder_cells = _find_placeholder_cells(self.template_ws)
+        else:
+            # 既存のファイルがあっても上書きで新規作成
+            self.wb = Workbook()
+
+            # デフォルトで作成されるシートを削除（または名前を変更して利用）
+            if "Sheet" in self.wb.sheetnames:
+                del self.wb["Sheet"]
+
+        self.contact_items = None # 一覧表示の場合の、まだシートに並べていない項目
+        if contact_layout.is_enabled(contact_sheet):
+            self.contact_items = []
+            self.columns, self.spacing, self.rows_per_sheet, _ = contact_layout.contact_sheet_settings(contact_sheet)
+            self.contact_pages = 0
+
+    def open(self):
+        """画像の切り抜きを始める前に CropPipeline.run から呼ばれる (ブックは保存するまでファイルに書き込まないため、何もしない)。"""
+
+    def add(self, image_filename, crops, reason=None):
+        if self.contact_items is None:
+            # 画像ごとに新しいシートを作成 (処理できなかった画像も、空のシートを作成する)
+            ws = _add_image_sheet(self.wb, image_filename, self.template_ws, self.placeholder_cells)
+        else:
+            print(f"Processing image: {image_filename}")
+        if crops is None:
+            return
+
+        if self.contact_items is not None:
+            # 一覧表示: 1シート分の項目がそろったらシートを作成する
+            self.contact_items.extend(contact_layout.contact_sheet_items(image_filename, crops))
+            self._add_contact_sheets(flush=False)
+            return
+
+        for crop_path, excel_pos, img_region in crops:
+            # ExcelImageオブジェクトを作成し、シートにアンカーして貼り付け
+            img = ExcelImage(crop_path)
+            ws.add_image(img, excel_pos)
+            print(f"  - Cropped region {img_region} from {image_filename} and inserted at {excel_pos}")
+
+    def _add_contact_sheets(self, flush):
+        for page in contact_layout.take_pages(self.contact_items, self.columns * self.rows_per_sheet, flush=flush):
+            self.contact_pages += 1
+            _add_contact_sheet(self.wb, self.contact_pages, page, self.columns, self.spacing)
+
+    def save(self):
+        """ワークブックを保存する。保存できた場合は True。"""
+        if self.contact_items:
+            self._add_contact_sheets(flush=True)
+
+        # 複製元のテンプレートシートは出力に含めない
+        if self.template_ws is not None and len(self.wb.worksheets) > 1:
+            self.wb.remove(self.template_ws)
+
+        # (切り抜き画像はExcelファイルの保存時に読み込まれるため、一時ファイルの削除とチェックポイントの削除は保存後に行う)
+        try:
+            save_workbook(self.wb, self.output_path, self.compression)
+            print(f"Excel file saved successfully to {self.output_path}")
+            return True
+        except Exception as e:
+            print(f"Error saving Excel file: {e}")
+            return False
+
+    def discard(self):
+        """保存せずに中断した場合の後片付け (ブックは保存するまでファイルに書き込まないため、何もしない)。"""
+
+
+def insert_images_to_excel(excel_filepath: str, image_folder_path: str, regions_and_coords: list, template_path: str = None, alignment: dict = None, region_profiles: dict = None, image_files: list = None, progress_callback=None, compression: dict = None, checkpoint_enabled: bool = False, resume: bool = False, isolation: dict = None, contact_sheet: dict = None):
     """
     指定された画像フォルダ内の画像を読み込み、その領域をExcelシートの指定セルに貼り付けます。
     画像ごとに新しいシートを作成します。
 
+    template_pathを指定した場合は、テンプレートブックの先頭シートを画像ごとに複製し、
+    切り抜き画像とファイル名（"{filename}" を含むセル）だけを差し込みます。
+    テンプレートシート自体は出力から削除されます。
+
     Args:
         excel_filepath (str): 出力するExcelファイルのパス。
-        image_folder_path (str): 画像が保存されているフォルダのパス。
+        image_folder_path (str): 画像が保存されているフォルダ、またはzip/tarファイルのパス。
+                                 アーカイブの場合は展開せずに直接読み込みます。
         regions_and_coords (list): 領域とセル座標のペアのリスト。
                                    例: [{"img_region": [x1, y1, x2, y2], "excel_pos": "B2"}, ...]
                                    img_region: [left, upper, right, lower] (Pillowのcrop形式)
+        template_path (str, optional): 書式設定済みのテンプレートxlsxファイルのパス。
+        alignment (dict, optional): 画像ごとの位置合わせの設定 (config.json の "alignment")。
+                                    有効な場合、基準画像との位相相関で各領域のずれを補正してから切り抜きます。
+        region_profiles (dict, optional): 名前付きの領域プロファイル (config.json の "region_profiles")。
+                                          画像ごとにファイル名・サイズ・dHashで判定し、該当しない画像には regions_and_coords を使用します。
+        image_files (list, optional): 処理する画像の、画像フォルダからの相対パスのリスト (サブフォルダ内の画像も可)。
+                                      省略時は画像フォルダ直下の全ての画像 (アーカイブの場合はアーカイブ内の全ての画像) を処理します。
+        progress_callback (callable, optional): 画像を1枚処理するたびに progress_callback(処理済み枚数, 全枚数) の形式で呼ばれる。
+        compression (dict, optional): 出力ファイルの圧縮方法 (config.json の "output_compression")。
+                                      {"store_media": True, "compress_level": 6, "threads": 4} のように指定します。
+        checkpoint_enabled (bool, optional): Trueの場合、切り抜き画像と処理済みの画像の記録を出力ファイル名 + ".checkpoint" のフォルダに保存し、
+                                             途中で異常終了しても resume=True で続きから再開できるようにします。保存に成功すると削除されます。
+        resume (bool, optional): 既存のチェックポイントから再開します (完了済みの画像はデコード・切り抜きをやり直しません)。
+        isolation (dict, optional): 画像の読み込み・切り抜きを子プロセスで行う設定 (config.json の "image_isolation")。
+                                    {"enabled": True, "timeout_seconds": 120, "memory_limit_mb": 4096} のように指定すると、
+                                    画像ごとに時間とメモリの上限を設け、不正な画像で出力全体が止まらないようにします。
+                                    処理できなかった画像と理由は、出力ファイル名 + ".errors.json" / ".errors.csv" に保存します。
+        contact_sheet (dict, optional): 一覧表示の設定 (config.json の "contact_sheet")。有効な場合は画像ごとにシートを作らず、
+                                        複数の画像の切り抜き画像をファイル名付きのグリッドに並べたシートを、
+                                        rows_per_sheet 行 × columns 列ごとに作成します (excel_pos とテンプレートは使用しません)。
+
+    Returns:
+        bool: Excelファイルを保存できた場合は True。保存に失敗した場合は False (チェックポイントは残る)。
     """
-    # 既存のファイルがあっても上書きで新規作成
-    wb = Workbook()
-
-    # デフォルトで作成されるシートを削除（または名前を変更して利用）
-    if "Sheet" in wb.sheetnames:
-        del wb["Sheet"]
-
-    temp_files_to_delete = [] # 一時ファイルを格納するリスト
-
-    supported_extensions = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff')
-
-    # 画像フォルダ内の全ての画像ファイルを処理
-    for image_filename in sorted(os.listdir(image_folder_path)):
-        if image_filename.lower().endswith(supported_extensions):
-            image_path = os.path.join(image_folder_path, image_filename)
-
-            # 画像ごとに新しいシートを作成
-            sheet_name = os.path.splitext(image_filename)[0][:31] # シート名は31文字まで
-            ws = wb.create_sheet(title=sheet_name)
-            print(f"Processing image: {image_filename} on sheet: {sheet_name}")
-
-            try:
-                original_image = Image.open(image_path)
-
-                for item in regions_and_coords:
-                    img_region = item["img_region"]
-                    excel_pos = item["excel_pos"]
-
-                    # 画像領域を切り抜き
-                    cropped_image = original_image.crop(img_region)
-
-                    # 切り抜いた画像を一時ファイルとして保存
-                    with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as temp_file:
-                        temp_image_path = temp_file.name
-                        cropped_image.save(temp_image_path)
-                        temp_files_to_delete.append(temp_image_path) # リストに追加
-
-                    # ExcelImageオブジェクトを作成し、シートにアンカーして貼り付け
-                    img = ExcelImage(temp_image_path)
-                    ws.add_image(img, excel_pos)
-                    print(f"  - Cropped region {img_region} from {image_filename} and inserted at {excel_pos}")
-
-            except Exception as e:
-                print(f"Error processing {image_filename}: {e}")
-                continue
-
-    # ワークブックを保存
-    try:
-        wb.save(excel_filepath)
-        print(f"Excel file saved successfully to {excel_filepath}")
-    except Exception as e:
-        print(f"Error saving Excel file: {e}")
-    finally:
-        # Excelファイルの保存が完了した後、一時ファイルをクリーンアップ
-        for temp_file in temp_files_to_delete:
-            try:
-                os.remove(temp_file)
-            except Exception as e:
-                print(f"Error deleting temporary file {temp_file}: {e}")
+    output = ExcelOutput(excel_filepath, template_path, compression, contact_sheet)
+    # 画像の読み込み・切り抜き (チェックポイント、処理できなかった画像の一覧、進捗の通知を含む)
+    pipeline = CropPipeline(excel_filepath, image_folder_path, regions_and_coords, region_profiles, alignment, image_files,
+                            progress_callback, isolation, output.checkpoint_settings if checkpoint_enabled else None, resume)
+    # 保存に失敗した場合は、再開できるようにチェックポイントを残す
+    return pipeline.run([output])[0]
 
 if __name__ == '__main__':
     current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -89,9 +215,11 @@ if __name__ == '__main__':
             config = json.load(f)
 
         regions_and_coords = config.get("image_regions_and_excel_coords", [])
+        template_path = config.get("output_templates", {}).get("excel") or None
 
         # 関数を実行
-        insert_images_to_excel(output_excel_file, image_dir, regions_and_coords)
+        insert_images_to_excel(output_excel_file, image_dir, regions_and_coords, template_path, config.get("alignment"),
+                               config.get("region_profiles"))
 
     except FileNotFoundError:
         print(f"Error: config file not found at {config_path}")
@@ -0,0 +1,177 @@
+import os
+import html
+import json
+import shutil
+from urllib.parse import quote
+from crop_pipeline import CropPipeline
+
+# これより大きい切り抜き画像は、一覧表示用に縮小画像 (JPEG) を作成する
+THUMBNAIL_SIZE = (320, 320)
+THUMBNAIL_QUALITY = 85
+
+_HTML_HEADER = """<!DOCTYPE html>
+<html lang="ja">
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+body {{ font-family: sans-serif; margin: 16px; background: #f4f4f4; }}
+section {{ background: #fff; margin-bottom: 16px; padding: 8px 12px; border-radius: 4px; }}
+h2 {{ font-size: 14px; margin: 4px 0 8px; word-break: break-all; }}
+.crops {{ display: flex; flex-wrap: wrap; gap: 12px; align-items: flex-start; }}
+figure {{ margin: 0; }}
+figcaption {{ font-size: 11px; color: #666; }}
+img {{ max-width: {thumb_width}px; max-height: {thumb_height}px; border: 1px solid #ddd; background: #fff; }}
+.error {{ color: #b00020; font-size: 12px; }}
+</style>
+</head>
+<body>
+<h1>{title}</h1>
+"""
+
+def _url(*parts):
+    # ファイル名に日本語や空白が含まれていてもリンクが切れないように、パスの各部分をURLエンコードする
+    return "/".join(quote(part) for part in parts)
+
+def html_files_dir_name(html_filepath):
+    """HTMLレポートの切り抜き画像を保存するフォルダの名前 (HTMLファイル名 + "_files")。"""
+    return os.path.splitext(os.path.basename(html_filepath))[0] + "_files"
+
+def _write_thumbnail(crop_path, thumbnail_path):
+    from PIL import Image
+    with Image.open(crop_path) as img:
+        img.thumbnail(THUMBNAIL_SIZE)
+        img.convert("RGB").save(thumbnail_path, "JPEG", quality=THUMBNAIL_QUALITY)
+
+class HtmlOutput:
+    """
+    切り抜き画像を一覧できる静的なHTMLレポートを書き込む出力 (CropPipeline.run に渡す)。
+    切り抜き画像は HTMLファイル名 + "_files" のフォルダにコピーし、HTMLは追加した順にファイルへ書き出します。
+    """
+    def __init__(self, html_filepath, image_folder_path):
+        self.output_path = html_filepath
+        self.checkpoint_settings = {"format": "html"}
+        self.title = html.escape(os.path.basename(image_folder_path.rstrip("/\\")) or image_folder_path)
+        self.files_dir_name = html_files_dir_name(html_filepath)
+        self.files_dir = os.path.join(os.path.dirname(os.path.abspath(html_filepath)), self.files_dir_name)
+        # 書き込み中のファイルを完成したレポートと取り違えないよう、一時ファイルに書き込んでから置き換える
+        self.part_path = html_filepath + ".part"
+        self.file = None
+        self.images = 0
+        self.failed = 0
+
+    def open(self):
+        """切り抜き画像の保存先と書き込み用の一時ファイルを作成する (画像の切り抜きを始める前に CropPipeline.run から呼ばれる)。"""
+        # 前回の出力は削除して作り直す
+        if os.path.isdir(self.files_dir):
+            shutil.rmtree(self.files_dir)
+        os.makedirs(self.files_dir)
+        self.file = open(self.part_path, 'w', encoding='utf-8')
+        self.file.write(_HTML_HEADER.format(title=self.title, thumb_width=THUMBNAIL_SIZE[0], thumb_height=THUMBNAIL_SIZE[1]))
+
+    def add(self, image_filename, crops, reason=None):
+        print(f"Processing image: {image_filename}")
+        self.images += 1
+        f = self.file
+        f.write(f"<section>\n<h2>{html.escape(image_filename)}</h2>\n")
+        if crops is None:
+            self.failed += 1
+            f.write(f'<p class="error">処理できませんでした: {html.escape(reason or "")}</p>\n</section>\n')
+            return
+        try:
+            figures = []
+            for crop_path, excel_pos, img_region in crops:
+                crop_name = os.path.basename(crop_path)
+                shutil.copyfile(crop_path, os.path.join(self.files_dir, crop_name))
+                width, height = img_region[2] - img_region[0], img_region[3] - img_region[1]
+                thumbnail_name = crop_name
+                if width > THUMBNAIL_SIZE[0] or height > THUMBNAIL_SIZE[1]:
+                    thumbnail_name = os.path.splitext(crop_name)[0] + "_thumb.jpg"
+                    _write_thumbnail(crop_path, os.path.join(self.files_dir, thumbnail_name))
+                    scale = min(THUMBNAIL_SIZE[0] / width, THUMBNAIL_SIZE[1] / height)
+                    width, height = int(width * scale), int(height * scale)
+                # 幅・高さを指定して、画像の読み込み前からレイアウトを確定させる
+                figures.append(
+                    f'<figure><a href="{_url(self.files_dir_name, crop_name)}">'
+                    f'<img src="{_url(self.files_dir_name, thumbnail_name)}" width="{width}" height="{height}" '
+                    f'loading="lazy" decoding="async" alt="{html.escape(excel_pos)}"></a>'
+                    f'<figcaption>{html.escape(excel_pos)} {html.escape(str(list(img_region)))}</figcaption></figure>')
+                print(f"  - Cropped region {img_region} from {image_filename} for {excel_pos}")
+            f.write('<div class="crops">\n' + "\n".join(figures) + "\n</div>\n</section>\n")
+        except Exception as e:
+            # 失敗した画像も理由とともに表示する (記録は呼び出し元の CropPipeline が行う)
+            self.failed += 1
+            f.write(f'<p class="error">処理できませんでした: {html.escape(str(e))}</p>\n</section>\n')
+            raise
+
+    def save(self):
+        """レポートを完成させて出力ファイルに置き換える。保存できた場合は True。"""
+        try:
+            self.file.write(f"<p>画像 {self.images} 枚 (処理できなかった画像 {self.failed} 枚)</p>\n</body>\n</html>\n")
+            self.file.close()
+            os.replace(self.part_path, self.output_path)
+            print(f"HTML report saved successfully to {self.output_path}")
+            return True
+        except Exception as e:
+            print(f"Error saving HTML report: {e}")
+            self.discard()
+            return False
+
+    def discard(self):
+        """書き込み途中の一時ファイルを削除する。"""
+        if self.file is not None:
+            self.file.close()
+        if os.path.exists(self.part_path):
+            os.remove(self.part_path)
+
+
+def insert_images_to_html(html_filepath: str, image_folder_path: str, regions_and_coords: list, alignment: dict = None, region_profiles: dict = None, image_files: list = None, progress_callback=None, checkpoint_enabled: bool = False, resume: bool = False, isolation: dict = None):
+    """
+    指定された画像フォルダ内の画像を読み込み、その領域を一覧できる静的なHTMLレポートを出力します。
+
+    切り抜き画像は HTMLファイル名 + "_files" のフォルダに保存し、大きな切り抜き画像には縮小画像を作成します。
+    画像は loading="lazy" で表示範囲に近づいたときに読み込まれるため、画像が多くてもすぐに開けます。
+    縮小画像をクリックすると、元のサイズの切り抜き画像を表示します。
+    HTMLは処理した順にファイルへ書き出し、処理できなかった画像は理由とともに表示します。
+
+    Args:
+        html_filepath (str): 出力するHTMLファイルのパス。
+        image_folder_path (str): 画像が保存されているフォルダ、またはzip/tarファイルのパス。
+        regions_and_coords (list): 領域とセル座標のペアのリスト。
+        alignment (dict, optional): 画像ごとの位置合わせの設定 (config.json の "alignment")。
+        region_profiles (dict, optional): 名前付きの領域プロファイル (config.json の "region_profiles")。
+        image_files (list, optional): 処理する画像のリスト。省略時は全ての画像。
+        progress_callback (callable, optional): 画像を1枚処理するたびに progress_callback(処理済み枚数, 全枚数) の形式で呼ばれる。
+        checkpoint_enabled (bool, optional): Trueの場合、途中経過を保存し、resume=True で続きから再開できるようにします。
+        resume (bool, optional): 既存のチェックポイントから再開します。
+        isolation (dict, optional): 画像の読み込み・切り抜きを子プロセスで行う設定 (config.json の "image_isolation")。
+
+    Returns:
+        bool: HTMLレポートを保存できた場合は True。保存に失敗した場合は False (チェックポイントは残る)。
+    """
+    output = HtmlOutput(html_filepath, image_folder_path)
+    # 画像の読み込み・切り抜き (チェックポイント、処理できなかった画像の一覧、進捗の通知を含む)
+    pipeline = CropPipeline(html_filepath, image_folder_path, regions_and_coords, region_profiles, alignment, image_files,
+                            progress_callback, isolation, output.checkpoint_settings if checkpoint_enabled else None, resume)
+    # 保存に失敗した場合は、再開できるようにチェックポイントを残す
+    return pipeline.run([output])[0]
+
+if __name__ == '__main__':
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    config_path = os.path.join(current_dir, "config.json")
+    image_dir = os.path.join(current_dir, "img")
+    output_html_file = os.path.join(current_dir, "output_images.html")
+
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+
+        insert_images_to_html(output_html_file, image_dir, config.get("image_regions_and_excel_coords", []),
+                              config.get("alignment"), config.get("region_profiles"))
+
+    except FileNotFoundError:
+        print(f"Error: config file not found at {config_path}")
+    except json.JSONDecodeError:
+        print(f"Error: Could not decode JSON from {config_path}. Check file format.")
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
@@ -0,0 +1,276 @@
+import os
+import json
+import zlib
+import struct
+from crop_pipeline import CropPipeline, excel_pos_to_inches
+
+# ページの最小サイズ (インチ)。PowerPointの既定のスライドと同じ 10 × 7.5 インチ
+MIN_PAGE_SIZE = (10.0, 7.5)
+PAGE_MARGIN = 0.5 # 切り抜き画像の右端・下端からページの端までの余白 (インチ)
+POINTS_PER_INCH = 72
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# PNGの色の種類 -> (PDFの色空間, 色の数)。パレット・透過・16ビットのPNGはPillowで変換して格納する
+_PNG_COLOR_TYPES = {0: (b"/DeviceGray", 1), 2: (b"/DeviceRGB", 3)}
+
+def _read_png_for_pdf(png_path):
+    """
+    PNGファイルを、PDFの画像 (XObject) として格納できる形にします。
+
+    8ビットのグレースケール/RGBでインターレース無しのPNG (切り抜き画像の通常の形式) は、
+    IDATチャンクのzlibデータをそのまま /FlateDecode + PNG予測子 として格納できるため、デコード・再圧縮をしません。
+    それ以外の形式はPillowでRGBに変換して圧縮します。
+
+    Returns:
+        tuple: (幅, 高さ, 色空間, 色の数, 圧縮済みのデータ, PNG予測子を使うかどうか)
+    """
+    with open(png_path, 'rb') as f:
+        data = f.read()
+    if data[:8] == _PNG_SIGNATURE:
+        pos = 8
+        idat = []
+        header = None
+        while pos + 8 <= len(data):
+            length, chunk_type = struct.unpack(">I4s", data[pos:pos + 8])
+            chunk = data[pos + 8:pos + 8 + length]
+            if chunk_type == b"IHDR":
+                header = struct.unpack(">IIBBBBB", chunk)
+            elif chunk_type == b"IDAT":
+                idat.append(chunk)
+            elif chunk_type == b"IEND":
+                break
+            pos += 12 + length
+        if header is not None:
+            width, height, bit_depth, color_type, _, _, interlace = header
+            if bit_depth == 8 and interlace == 0 and color_type in _PNG_COLOR_TYPES:
+                color_space, colors = _PNG_COLOR_TYPES[color_type]
+                return width, height, color_space, colors, b"".join(idat), True
+
+    from PIL import Image
+    with Image.open(png_path) as img:
+        if img.mode in ("RGBA", "LA", "P"):
+            # 透過部分は白の背景に合成する
+            rgba = img.convert("RGBA")
+            img = Image.new("RGB", rgba.size, (255, 255, 255))
+            img.paste(rgba, mask=rgba.getchannel("A"))
+        else:
+            img = img.convert("RGB")
+        return img.width, img.height, b"/DeviceRGB", 3, zlib.compress(img.tobytes()), False
+
+def _pdf_text(text):
+    # 日本語のファイル名も扱えるよう、文字列はUTF-16BE (BOM付き) の16進数で書き込む
+    return b"<FEFF" + text.encode("utf-16-be").hex().upper().encode("ascii") + b">"
+
+def _num(value):
+    return f"{value:.2f}".rstrip("0").rstrip(".").encode("ascii")
+
+
+class StreamingPdfWriter:
+    """
+    ページを1枚ずつファイルに書き出すPDFライター (外部ライブラリ不要)。
+
+    ページ・画像のオブジェクトは追加した時点で書き込み、メモリにはオブジェクトの位置とページの一覧だけを保持します。
+    ページツリー・しおり (ページごとの画像ファイル名)・相互参照表は close() で最後に書き込みます。
+    """
+    _CATALOG_ID = 1
+    _PAGES_ID = 2
+    _OUTLINES_ID = 3
+
+    def __init__(self, path):
+        self._file = open(path, 'wb')
+        self._offsets = {}
+        self._next_id = 4
+        self._pages = [] # (ページのオブジェクト番号, しおりのタイトル)
+        self._file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _new_id(self):
+        obj_id = self._next_id
+        self._next_id += 1
+        return obj_id
+
+    def _write_object(self, obj_id, dictionary, stream=None):
+        self._offsets[obj_id] = self._file.tell()
+        self._file.write(b"%d 0 obj\n" % obj_id)
+        if stream is None:
+            self._file.write(dictionary + b"\nendobj\n")
+        else:
+            self._file.write(dictionary[:-2] + b" /Length %d >>\nstream\n" % len(stream))
+            self._file.write(stream + b"\nendstream\nendobj\n")
+
+    def add_page(self, width, height, images, title=None):
+        """
+        ページを追加します。
+
+        Args:
+            width (float): ページの幅 (ポイント)。
+            height (float): ページの高さ (ポイント)。
+            images (list): [(PNGファイルのパス, x, y, 幅, 高さ), ...]。位置はページ左上からのポイント単位。
+            title (str, optional): しおりに表示するタイトル。
+        """
+        xobject_names = []
+        content = []
+        for index, (png_path, x, y, image_width, image_height) in enumerate(images):
+            pixel_width, pixel_height, color_space, colors, data, predictor = _read_png_for_pdf(png_path)
+            image_id = self._new_id()
+            decode_parms = b""
+            if predictor:
+                decode_parms = b" /DecodeParms << /Predictor 15 /Colors %d /BitsPerComponent 8 /Columns %d >>" % (colors, pixel_width)
+            self._write_object(image_id, b"<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s "
+                                         b"/BitsPerComponent 8 /Filter /FlateDecode%s >>"
+                               % (pixel_width, pixel_height, color_space, decode_parms), data)
+            name = b"/Im%d" % index
+            xobject_names.append(b"%s %d 0 R" % (name, image_id))
+            # PDFの座標は左下が原点のため、上端からの位置を変換する
+            content.append(b"q %s 0 0 %s %s %s cm %s Do Q" % (
+                _num(image_width), _num(image_height), _num(x), _num(height - y - image_height), name))
+
+        content_id = self._new_id()
+        self._write_object(content_id, b"<< /Filter /FlateDecode >>", zlib.compress(b"\n".join(content)))
+        page_id = self._new_id()
+        self._write_object(page_id, b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %s %s] /Contents %d 0 R "
+                                    b"/Resources << /XObject << %s >> >> >>"
+                           % (self._PAGES_ID, _num(width), _num(height), content_id, b" ".join(xobject_names)))
+        self._pages.append((page_id, title))
+
+    def close(self):
+        kids = b" ".join(b"%d 0 R" % page_id for page_id, _ in self._pages)
+        self._write_object(self._PAGES_ID, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self._pages)))
+
+        # しおり (ページごとのタイトル) を、ページの順につないだリストとして書き込む
+        outline_ids = [self._new_id() for _ in self._pages]
+        for index, ((page_id, title), outline_id) in enumerate(zip(self._pages, outline_ids)):
+            links = b""
+            if index > 0:
+                links += b" /Prev %d 0 R" % outline_ids[index - 1]
+            if index < len(outline_ids) - 1:
+                links += b" /Next %d 0 R" % outline_ids[index + 1]
+            self._write_object(outline_id, b"<< /Title %s /Parent %d 0 R /Dest [%d 0 R /Fit]%s >>"
+                               % (_pdf_text(title or f"{index + 1}"), self._OUTLINES_ID, page_id, links))
+        if outline_ids:
+            self._write_object(self._OUTLINES_ID, b"<< /Type /Outlines /First %d 0 R /Last %d 0 R /Count %d >>"
+                               % (outline_ids[0], outline_ids[-1], len(outline_ids)))
+        else:
+            self._write_object(self._OUTLINES_ID, b"<< /Type /Outlines /Count 0 >>")
+        self._write_object(self._CATALOG_ID, b"<< /Type /Catalog /Pages %d 0 R /Outlines %d 0 R /PageMode /UseOutlines >>"
+                           % (self._PAGES_ID, self._OUTLINES_ID))
+
+        xref_offset = self._file.tell()
+        self._file.write(b"xref\n0 %d\n0000000000 65535 f \n" % self._next_id)
+        for obj_id in range(1, self._next_id):
+            self._file.write(b"%010d 00000 n \n" % self._offsets[obj_id])
+        self._file.write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+                         % (self._next_id, self._CATALOG_ID, xref_offset))
+        self._file.close()
+
+    def abort(self):
+        self._file.close()
+
+
+class PdfOutput:
+    """
+    切り抜き画像を、画像ごとに1ページのPDFファイルに書き込む出力 (CropPipeline.run に渡す)。
+    ページは追加した順にファイルへ書き出し、処理できなかった画像のページは作成しません。
+    """
+    def __init__(self, pdf_filepath, excel_conv_params):
+        self.output_path = pdf_filepath
+        self.excel_conv_params = excel_conv_params
+        self.checkpoint_settings = {"format": "pdf", "excel_conv_params": excel_conv_params}
+        self.dpi = excel_conv_params.get("dpi", 96)
+        # 書き込み中のファイルを完成したPDFと取り違えないよう、一時ファイルに書き込んでから置き換える
+        self.part_path = pdf_filepath + ".part"
+        self.writer = None
+
+    def open(self):
+        """書き込み用の一時ファイルを作成する (画像の切り抜きを始める前に CropPipeline.run から呼ばれる)。"""
+        self.writer = StreamingPdfWriter(self.part_path)
+
+    def add(self, image_filename, crops, reason=None):
+        print(f"Processing image: {image_filename}")
+        if crops is None:
+            return
+        images = []
+        page_width, page_height = MIN_PAGE_SIZE
+        for crop_path, excel_pos, img_region in crops:
+            x, y = excel_pos_to_inches(excel_pos, self.excel_conv_params)
+            width = (img_region[2] - img_region[0]) / self.dpi
+            height = (img_region[3] - img_region[1]) / self.dpi
+            images.append((crop_path, x * POINTS_PER_INCH, y * POINTS_PER_INCH,
+                           width * POINTS_PER_INCH, height * POINTS_PER_INCH))
+            # 全ての切り抜き画像が収まるようにページを広げる
+            page_width = max(page_width, x + width + PAGE_MARGIN)
+            page_height = max(page_height, y + height + PAGE_MARGIN)
+            print(f"  - Cropped region {img_region} from {image_filename} and placed at {excel_pos} ({x:.2f}in, {y:.2f}in)")
+        self.writer.add_page(page_width * POINTS_PER_INCH, page_height * POINTS_PER_INCH, images, image_filename)
+
+    def save(self):
+        """PDFを完成させて出力ファイルに置き換える。保存できた場合は True。"""
+        try:
+            self.writer.close()
+            os.replace(self.part_path, self.output_path)
+            print(f"PDF file saved successfully to {self.output_path}")
+            return True
+        except Exception as e:
+            print(f"Error saving PDF file: {e}")
+            self.discard()
+            return False
+
+    def discard(self):
+        """書き込み途中の一時ファイルを削除する。"""
+        if self.writer is not None:
+            self.writer.abort()
+        if os.path.exists(self.part_path):
+            os.remove(self.part_path)
+
+
+def insert_images_to_pdf(pdf_filepath: str, image_folder_path: str, regions_and_coords: list, excel_conv_params: dict, alignment: dict = None, region_profiles: dict = None, image_files: list = None, progress_callback=None, checkpoint_enabled: bool = False, resume: bool = False, isolation: dict = None):
+    """
+    指定された画像フォルダ内の画像を読み込み、その領域を画像ごとに1ページのPDFファイルに出力します。
+    切り抜き画像の位置は、PowerPoint出力と同じ Excelセル座標 -> インチ の変換 (excel_conv_params) で決めます。
+
+    ページは処理した順にファイルへ書き出すため、画像が多くてもメモリ使用量は増えません。
+    切り抜き画像のPNGは再エンコードせずにそのまま格納するため、出力の負担はほぼファイルの書き込みだけです。
+    各ページのしおりには画像ファイル名が表示されます。処理できなかった画像のページは作成しません。
+
+    Args:
+        pdf_filepath (str): 出力するPDFファイルのパス。
+        image_folder_path (str): 画像が保存されているフォルダ、またはzip/tarファイルのパス。
+        regions_and_coords (list): 領域とセル座標のペアのリスト。
+        excel_conv_params (dict): Excelセル座標からインチへの変換パラメータ (config.json の "excel_to_pptx_conversion_params")。
+        alignment (dict, optional): 画像ごとの位置合わせの設定 (config.json の "alignment")。
+        region_profiles (dict, optional): 名前付きの領域プロファイル (config.json の "region_profiles")。
+        image_files (list, optional): 処理する画像のリスト。省略時は全ての画像。
+        progress_callback (callable, optional): 画像を1枚処理するたびに progress_callback(処理済み枚数, 全枚数) の形式で呼ばれる。
+        checkpoint_enabled (bool, optional): Trueの場合、途中経過を保存し、resume=True で続きから再開できるようにします。
+        resume (bool, optional): 既存のチェックポイントから再開します。
+        isolation (dict, optional): 画像の読み込み・切り抜きを子プロセスで行う設定 (config.json の "image_isolation")。
+
+    Returns:
+        bool: PDFファイルを保存できた場合は True。保存に失敗した場合は False (チェックポイントは残る)。
+    """
+    output = PdfOutput(pdf_filepath, excel_conv_params)
+    # 画像の読み込み・切り抜き (チェックポイント、処理できなかった画像の一覧、進捗の通知を含む)
+    pipeline = CropPipeline(pdf_filepath, image_folder_path, regions_and_coords, region_profiles, alignment, image_files,
+                            progress_callback, isolation, output.checkpoint_settings if checkpoint_enabled else None, resume)
+    # 保存に失敗した場合は、再開できるようにチェックポイントを残す
+    return pipeline.run([output])[0]
+
+if __name__ == '__main__':
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    config_path = os.path.join(current_dir, "config.json")
+    image_dir = os.path.join(current_dir, "img")
+    output_pdf_file = os.path.join(current_dir, "output_images.pdf")
+
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+
+        insert_images_to_pdf(output_pdf_file, image_dir, config.get("image_regions_and_excel_coords", []),
+                             config.get("excel_to_pptx_conversion_params", {}), config.get("alignment"),
+                             config.get("region_profiles"))
+
+    except FileNotFoundError:
+        print(f"Error: config file not found at {config_path}")
+    except json.JSONDecodeError:
+        print(f"Error: Could not decode JSON from {config_path}. Check file format.")
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
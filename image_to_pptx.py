@@ -3,17 +3,143 @@
 
 import os
 import json
-import tempfile # 追加
-from PIL import Image
+import copy
+from crop_pipeline import CropPipeline, excel_pos_to_inches
+from office_package import save_presentation
+import contact_sheet as contact_layout
 from pptx import Presentation
 from pptx.util import Inches, Pt
 from pptx.enum.shapes import MSO_SHAPE_TYPE
+from pptx.opc.constants import RELATIONSHIP_TYPE as RT
+from pptx.oxml.ns import qn
+
+# テンプレート内でファイル名に置き換えられるプレースホルダー
+FILENAME_PLACEHOLDER = "{filename}"
+
+# 一覧スライドの余白とキャプションの文字サイズ
+CONTACT_SLIDE_MARGIN = Inches(0.3)
+CONTACT_CAPTION_FONT_SIZE = Pt(8)
+EMU_PER_PIXEL = 9525 # 96dpi
+
+# 複製したXML内で張り直す必要があるリレーションシップ属性
+_RELATIONSHIP_ATTRS = (qn("r:embed"), qn("r:link"), qn("r:id"))
+
+class _SlideTemplate:
+    """
+    テンプレートスライドのシェイプXMLとリレーションシップを一度だけ取り出し、
+    画像ごとのスライドへ複製するためのヘルパー。
+    """
+    def __init__(self, prs):
+        template_slide = prs.slides[0]
+        self.layout = template_slide.slide_layout
+        # spTree直下のシェイプ要素 (nvGrpSpPr / grpSpPr 以外) を複製元として保持
+        sp_tree = template_slide.shapes._spTree
+        self.shape_elements = [
+            copy.deepcopy(el) for el in sp_tree
+            if el.tag not in (qn("p:nvGrpSpPr"), qn("p:grpSpPr"))
+        ]
+        # 画像などの参照先 (レイアウト・ノートは除く)
+        self.rels = [
+            (rel.rId, rel.reltype, rel._target)
+            for rel in template_slide.part.rels.values()
+            if rel.reltype not in (RT.SLIDE_LAYOUT, RT.NOTES_SLIDE)
+        ]
+
+        # テンプレートスライド自体は出力に含めない
+        sld_id_lst = prs.slides._sldIdLst
+        template_sld_id = sld_id_lst[0]
+        prs.part.drop_rel(template_sld_id.rId)
+        sld_id_lst.remove(template_sld_id)
+
+    def add_slide(self, prs, image_filename):
+        slide = prs.slides.add_slide(self.layout)
+        sp_tree = slide.shapes._spTree
+        # レイアウトから自動生成されたプレースホルダーを削除 (テンプレート側の内容で置き換える)
+        for el in list(sp_tree):
+            if el.tag not in (qn("p:nvGrpSpPr"), qn("p:grpSpPr")):
+                sp_tree.remove(el)
+
+        # リレーションシップを張り直し、旧rId -> 新rIdの対応を作る
+        rid_map = {}
+        for old_rid, reltype, target in self.rels:
+            if isinstance(target, str):
+                rid_map[old_rid] = slide.part.relate_to(target, reltype, is_external=True)
+            else:
+                rid_map[old_rid] = slide.part.relate_to(target, reltype)
+
+        for template_el in self.shape_elements:
+            el = copy.deepcopy(template_el)
+            for node in el.iter():
+                for attr in _RELATIONSHIP_ATTRS:
+                    old_rid = node.get(attr)
+                    if old_rid in rid_map:
+                        node.set(attr, rid_map[old_rid])
+                # ファイル名プレースホルダーを置換 (a:t 要素)
+                if node.tag == qn("a:t") and node.text and FILENAME_PLACEHOLDER in node.text:
+                    node.text = node.text.replace(FILENAME_PLACEHOLDER, image_filename)
+            sp_tree.append(el)
+        return slide
+
+def _add_image_slide(prs, image_filename, slide_template=None, blank_slide_layout=None):
+    """画像1枚分のスライドを追加する (テンプレートがあればテンプレートスライドを複製する)。"""
+    if slide_template is not None:
+        # テンプレートスライドを複製 (ファイル名は差し込み済み)
+        slide = slide_template.add_slide(prs, image_filename)
+        print(f"Processing image: {image_filename} on new slide")
+        return slide
+
+    # 画像ごとに新しいスライドを作成
+    slide = prs.slides.add_slide(blank_slide_layout)
+    print(f"Processing image: {image_filename} on new slide")
+
+    # スライド右上に画像ファイル名を表記
+    # テキストボックスのサイズと位置を調整
+    left = Inches(prs.slide_width.inches - 2) # スライド右端から2インチ左
+    top = Inches(0.1) # スライド上端から0.1インチ下
+    width = Inches(1.9)
+    height = Inches(0.5)
+    textbox = slide.shapes.add_textbox(left, top, width, height)
+    text_frame = textbox.text_frame
+    text_frame.text = image_filename
+    text_frame.word_wrap = True
+
+    # フォントサイズを調整
+    p = text_frame.paragraphs[0]
+    p.font.size = Pt(10)
+    return slide
+
+def _add_contact_slide(prs, blank_slide_layout, items, columns, spacing):
+    """
+    複数の画像の切り抜き画像を、キャプション (ファイル名) 付きのグリッドに並べた一覧スライドを追加します。
+    グリッドの配置はピクセル単位で計算し、スライドの余白の内側に収まるように縮小します (拡大はしない)。
+    """
+    layout = contact_layout.GridLayout([(item.width, item.height) for item in items], columns, spacing)
+    slide = prs.slides.add_slide(blank_slide_layout)
+    available_width = prs.slide_width - CONTACT_SLIDE_MARGIN * 2
+    available_height = prs.slide_height - CONTACT_SLIDE_MARGIN * 2
+    emu_per_px = min(EMU_PER_PIXEL, available_width / max(layout.width, 1), available_height / max(layout.height, 1))
+
+    for index, item in enumerate(items):
+        column, row = layout.cell(index)
+        caption_x, caption_y = layout.caption_origin(index)
+        textbox = slide.shapes.add_textbox(CONTACT_SLIDE_MARGIN + int(caption_x * emu_per_px),
+                                           CONTACT_SLIDE_MARGIN + int(caption_y * emu_per_px),
+                                           int(layout.col_widths[column] * emu_per_px), int(layout.caption_height * emu_per_px))
+        text_frame = textbox.text_frame
+        text_frame.margin_left = text_frame.margin_right = text_frame.margin_top = text_frame.margin_bottom = 0
+        text_frame.text = contact_layout.caption_text(item.caption)
+        text_frame.paragraphs[0].font.size = CONTACT_CAPTION_FONT_SIZE
+
+        image_x, image_y = layout.image_origin(index)
+        width, height = layout.item_sizes[index]
+        slide.shapes.add_picture(item.crop_path, CONTACT_SLIDE_MARGIN + int(image_x * emu_per_px),
+                                 CONTACT_SLIDE_MARGIN + int(image_y * emu_per_px),
+                                 int(width * emu_per_px), int(height * emu_per_px))
+    print(f"  - Added contact slide with {len(items)} cropped region(s)")
 
 def excel_coord_to_inches(excel_pos: str, params: dict):
     """
-    Excelのセル座標をPowerPointのインチ座標に変換します。
-    この関数は仮の実装であり、実際のExcelの列幅や行高さに基づいて
-    より複雑な計算が必要になる場合があります。
+    Excelのセル座標をPowerPointのインチ座標に変換します (crop_pipeline.excel_pos_to_inches を参照)。
 
     Args:
         excel_pos (str): Excelのセル座標 (例: "B2")
@@ -22,117 +148,138 @@ def excel_coord_to_inches(excel_pos: str, params: dict):
     Returns:
         tuple: (x_inches, y_inches) - PowerPoint上でのx, y座標 (インチ単位)
     """
-    col_width_pix = params.get("col_width_pix", 64) # Excelのデフォルト列幅（ピクセル）
-    row_height_pix = params.get("row_height_pix", 20) # Excelのデフォルト行高さ（ピクセル）
-    dpi = params.get("dpi", 96) # スクリーンDPI
-
-    # Excel座標を列と行のインデックスに変換
-    col_str = "".join(filter(str.isalpha, excel_pos)).upper()
-    row_str = "".join(filter(str.isdigit, excel_pos))
-
-    col_idx = 0
-    for char in col_str:
-        col_idx = col_idx * 26 + (ord(char) - ord('A') + 1)
-    row_idx = int(row_str)
-
-    # ピクセル単位での概算位置 (左上セルA1を(0,0)とする)
-    # これは非常に単純な仮の計算であり、実際のExcelのセルサイズは複雑です
-    # 列幅や行高さはopenpyxlで取得可能ですが、ここでは簡略化
-    x_pix = (col_idx - 1) * col_width_pix
-    y_pix = (row_idx - 1) * row_height_pix
-
-    # ピクセルをインチに変換
-    x_inches = x_pix / dpi
-    y_inches = y_pix / dpi
-
+    x_inches, y_inches = excel_pos_to_inches(excel_pos, params)
     return Inches(x_inches), Inches(y_inches)
 
-def insert_images_to_pptx(pptx_filepath: str, image_folder_path: str, regions_and_coords: list, excel_conv_params: dict):
+class PptxOutput:
+    """
+    切り抜き画像をPowerPointのスライドに貼り付ける出力 (CropPipeline.run に渡す)。
+    画像ごとにスライドを作成し (template_path を指定した場合はテンプレートの先頭スライドを複製し)、
+    contact_sheet が有効な場合は複数の画像の切り抜き画像を一覧スライドに並べます。
+    """
+    def __init__(self, pptx_filepath, excel_conv_params, template_path=None, compression=None, contact_sheet=None):
+        self.output_path = pptx_filepath
+        self.excel_conv_params = excel_conv_params
+        self.compression = compression
+        # 出力結果に影響する設定が同じ場合のみ再開できる
+        self.checkpoint_settings = {"format": "pptx", "template": template_path, "excel_conv_params": excel_conv_params,
+                                    "contact_sheet": contact_sheet}
+        self.slide_template = None
+        self.blank_slide_layout = None
+        if template_path:
+            self.prs = Presentation(template_path)
+            self.slide_template = _SlideTemplate(self.prs)
+        else:
+            # 既存のファイルがあっても上書きで新規作成
+            self.prs = Presentation()
+
+            # レイアウトの選択 (ここでは空白のスライドレイアウトを使用)
+            self.blank_slide_layout = self.prs.slide_layouts[6] # 通常、6番目が空白レイアウト
+
+        self.contact_items = None # 一覧表示の場合の、まだスライドに並べていない項目
+        if contact_layout.is_enabled(contact_sheet):
+            self.contact_items = []
+            self.columns, self.spacing, _, self.rows_per_slide = contact_layout.contact_sheet_settings(contact_sheet)
+            # テンプレートを使う場合も、一覧スライドは白紙のレイアウトに作成する
+            layouts = self.prs.slide_layouts
+            self.blank_slide_layout = layouts[6] if len(layouts) > 6 else layouts[-1]
+
+    def open(self):
+        """画像の切り抜きを始める前に CropPipeline.run から呼ばれる (プレゼンテーションは保存するまでファイルに書き込まないため、何もしない)。"""
+
+    def add(self, image_filename, crops, reason=None):
+        if self.contact_items is None:
+            # 画像ごとに新しいスライドを作成 (処理できなかった画像も、ファイル名だけのスライドを作成する)
+            slide = _add_image_slide(self.prs, image_filename, self.slide_template, self.blank_slide_layout)
+        else:
+            print(f"Processing image: {image_filename}")
+        if crops is None:
+            return
+
+        if self.contact_items is not None:
+            # 一覧表示: 1スライド分の項目がそろったらスライドを作成する
+            self.contact_items.extend(contact_layout.contact_sheet_items(image_filename, crops))
+            self._add_contact_slides(flush=False)
+            return
+
+        for crop_path, excel_pos, img_region in crops:
+            # Excelセル座標をPowerPointのインチ座標に変換
+            x_inches, y_inches = excel_coord_to_inches(excel_pos, self.excel_conv_params)
+
+            # 画像をスライドに貼り付け
+            # widthとheightを元の切り抜き画像のサイズに基づいて自動調整させるために指定しない
+            slide.shapes.add_picture(crop_path, x_inches, y_inches)
+            print(f"  - Cropped region {img_region} from {image_filename} and inserted at {excel_pos} ({x_inches.inches:.2f}in, {y_inches.inches:.2f}in)")
+
+    def _add_contact_slides(self, flush):
+        for page in contact_layout.take_pages(self.contact_items, self.columns * self.rows_per_slide, flush=flush):
+            _add_contact_slide(self.prs, self.blank_slide_layout, page, self.columns, self.spacing)
+
+    def save(self):
+        """プレゼンテーションを保存する。保存できた場合は True。"""
+        if self.contact_items:
+            self._add_contact_slides(flush=True)
+        # (一時フォルダの切り抜き画像はスライドに読み込み済み。チェックポイントの切り抜き画像は保存完了まで残す)
+        try:
+            save_presentation(self.prs, self.output_path, self.compression)
+            print(f"PowerPoint file saved successfully to {self.output_path}")
+            return True
+        except Exception as e:
+            print(f"Error saving PowerPoint file: {e}")
+            return False
+
+    def discard(self):
+        """保存せずに中断した場合の後片付け (プレゼンテーションは保存するまでファイルに書き込まないため、何もしない)。"""
+
+
+def insert_images_to_pptx(pptx_filepath: str, image_folder_path: str, regions_and_coords: list, excel_conv_params: dict, template_path: str = None, alignment: dict = None, region_profiles: dict = None, image_files: list = None, progress_callback=None, compression: dict = None, checkpoint_enabled: bool = False, resume: bool = False, isolation: dict = None, contact_sheet: dict = None):
     """
     指定された画像フォルダ内の画像を読み込み、その領域をPowerPointスライドの指定座標に貼り付けます。
     画像ごとに新しいスライドを作成し、スライド右上に画像ファイル名を表記します。
 
+    template_pathを指定した場合は、テンプレートの先頭スライドのXMLを画像ごとに複製し、
+    切り抜き画像とファイル名（"{filename}" を含むテキスト）だけを差し込みます。
+    この場合、ファイル名のテキストボックスは自動追加されません。
+
     Args:
         pptx_filepath (str): 出力するPowerPointファイルのパス。
-        image_folder_path (str): 画像が保存されているフォルダのパス。
+        image_folder_path (str): 画像が保存されているフォルダ、またはzip/tarファイルのパス。
+                                 アーカイブの場合は展開せずに直接読み込みます。
         regions_and_coords (list): 領域とセル座標のペアのリスト。
                                    例: [{"img_region": [x1, y1, x2, y2], "excel_pos": "B2"}, ...]
                                    img_region: [left, upper, right, lower] (Pillowのcrop形式)
         excel_conv_params (dict): Excelのセル座標をインチに変換するためのパラメータ。
                                   例: {"col_width_pix": 64, "row_height_pix": 20, "dpi": 96}
+        template_path (str, optional): 書式設定済みのテンプレートpptxファイルのパス。
+        alignment (dict, optional): 画像ごとの位置合わせの設定 (config.json の "alignment")。
+                                    有効な場合、基準画像との位相相関で各領域のずれを補正してから切り抜きます。
+        region_profiles (dict, optional): 名前付きの領域プロファイル (config.json の "region_profiles")。
+                                          画像ごとにファイル名・サイズ・dHashで判定し、該当しない画像には regions_and_coords を使用します。
+        image_files (list, optional): 処理する画像の、画像フォルダからの相対パスのリスト (サブフォルダ内の画像も可)。
+                                      省略時は画像フォルダ直下の全ての画像 (アーカイブの場合はアーカイブ内の全ての画像) を処理します。
+        progress_callback (callable, optional): 画像を1枚処理するたびに progress_callback(処理済み枚数, 全枚数) の形式で呼ばれる。
+        compression (dict, optional): 出力ファイルの圧縮方法 (config.json の "output_compression")。
+                                      {"store_media": True, "compress_level": 6, "threads": 4} のように指定します。
+        checkpoint_enabled (bool, optional): Trueの場合、切り抜き画像と処理済みの画像の記録を出力ファイル名 + ".checkpoint" のフォルダに保存し、
+                                             途中で異常終了しても resume=True で続きから再開できるようにします。保存に成功すると削除されます。
+        resume (bool, optional): 既存のチェックポイントから再開します (完了済みの画像はデコード・切り抜きをやり直しません)。
+        isolation (dict, optional): 画像の読み込み・切り抜きを子プロセスで行う設定 (config.json の "image_isolation")。
+                                    {"enabled": True, "timeout_seconds": 120, "memory_limit_mb": 4096} のように指定すると、
+                                    画像ごとに時間とメモリの上限を設け、不正な画像で出力全体が止まらないようにします。
+                                    処理できなかった画像と理由は、出力ファイル名 + ".errors.json" / ".errors.csv" に保存します。
+        contact_sheet (dict, optional): 一覧表示の設定 (config.json の "contact_sheet")。有効な場合は画像ごとにスライドを作らず、
+                                        複数の画像の切り抜き画像をファイル名付きのグリッドに並べたスライドを、
+                                        rows_per_slide 行 × columns 列ごとに作成します (excel_pos とテンプレートのスライドは使用しません)。
+
+    Returns:
+        bool: PowerPointファイルを保存できた場合は True。保存に失敗した場合は False (チェックポイントは残る)。
     """
-    # 既存のファイルがあっても上書きで新規作成
-    prs = Presentation()
-
-    # レイアウトの選択 (ここでは空白のスライドレイアウトを使用)
-    blank_slide_layout = prs.slide_layouts[6] # 通常、6番目が空白レイアウト
-
-    supported_extensions = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff')
-
-    # 画像フォルダ内の全ての画像ファイルを処理
-    for image_filename in sorted(os.listdir(image_folder_path)):
-        if image_filename.lower().endswith(supported_extensions):
-            image_path = os.path.join(image_folder_path, image_filename)
-
-            # 画像ごとに新しいスライドを作成
-            slide = prs.slides.add_slide(blank_slide_layout)
-            print(f"Processing image: {image_filename} on new slide")
-
-            # スライド右上に画像ファイル名を表記
-            # テキストボックスのサイズと位置を調整
-            left = Inches(prs.slide_width.inches - 2) # スライド右端から2インチ左
-            top = Inches(0.1) # スライド上端から0.1インチ下
-            width = Inches(1.9)
-            height = Inches(0.5)
-            textbox = slide.shapes.add_textbox(left, top, width, height)
-            text_frame = textbox.text_frame
-            text_frame.text = image_filename
-            text_frame.word_wrap = True
-
-            # フォントサイズを調整
-            p = text_frame.paragraphs[0]
-            p.font.size = Pt(10)
-
-            try:
-                original_image = Image.open(image_path)
-
-                for item in regions_and_coords:
-                    img_region = item["img_region"]
-                    excel_pos = item["excel_pos"]
-
-                    # 画像領域を切り抜き
-                    cropped_image = original_image.crop(img_region)
-
-                    # 切り抜いた画像を一時ファイルとして保存
-                    # tempfileモジュールを使用して一時ファイルを安全に作成
-                    with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as temp_file:
-                        temp_image_path = temp_file.name
-                        cropped_image.save(temp_image_path)
-
-                    # Excelセル座標をPowerPointのインチ座標に変換
-                    x_inches, y_inches = excel_coord_to_inches(excel_pos, excel_conv_params)
-
-                    # 画像をスライドに貼り付け
-                    # widthとheightを元の切り抜き画像のサイズに基づいて自動調整させるために指定しない
-                    pic = slide.shapes.add_picture(temp_image_path, x_inches, y_inches)
-                    print(f"  - Cropped region {img_region} from {image_filename} and inserted at {excel_pos} ({x_inches.inches:.2f}in, {y_inches.inches:.2f}in)")
-
-                    # 一時ファイルを削除 (NamedTemporaryFileでdelete=Falseにしたので手動で削除)
-                    os.remove(temp_image_path)
-
-            except Exception as e:
-                print(f"Error processing {image_filename}: {e}")
-                continue
-
-    # プレゼンテーションを保存
-    try:
-        prs.save(pptx_filepath)
-        print(f"PowerPoint file saved successfully to {pptx_filepath}")
-    except Exception as e:
-        print(f"Error saving PowerPoint file: {e}")
-    finally:
-        # tempfileを使用しているので、個別にリスト管理して削除する必要がなくなりました
-        pass
+    output = PptxOutput(pptx_filepath, excel_conv_params, template_path, compression, contact_sheet)
+    # 画像の読み込み・切り抜き (チェックポイント、処理できなかった画像の一覧、進捗の通知を含む)
+    pipeline = CropPipeline(pptx_filepath, image_folder_path, regions_and_coords, region_profiles, alignment, image_files,
+                            progress_callback, isolation, output.checkpoint_settings if checkpoint_enabled else None, resume)
+    # 保存に失敗した場合は、再開できるようにチェックポイントを残す
+    return pipeline.run([output])[0]
 
 if __name__ == '__main__':
     current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -146,9 +293,11 @@ if __name__ == '__main__':
 
         regions_and_coords = config.get("image_regions_and_excel_coords", [])
         excel_conversion_parameters = config.get("excel_to_pptx_conversion_params", {})
+        template_path = config.get("output_templates", {}).get("pptx") or None
 
         # 関数を実行
-        insert_images_to_pptx(output_pptx_file, image_dir, regions_and_coords, excel_conversion_parameters)
+        insert_images_to_pptx(output_pptx_file, image_dir, regions_and_coords, excel_conversion_parameters, template_path, config.get("alignment"),
+                              config.get("region_profiles"))
 
     except FileNotFoundError:
         print(f"Error: config file not found at {config_path}")
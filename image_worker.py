@@ -0,0 +1,232 @@
+import os
+import multiprocessing
+from image_source import FolderImageSource
+from region_profiles import RegionProfileSet
+from region_decode import can_read_regions, decode_region_crops
+from image_normalize import oriented_size
+
+# 子プロセスで画像を処理する場合の既定値 (config.json の "image_isolation" で変更できる)
+DEFAULT_TIMEOUT_SECONDS = 120
+DEFAULT_MEMORY_LIMIT_MB = 4096
+# 子プロセスの起動 (ライブラリの読み込みと、位置合わせの基準画像の準備) を待つ時間の下限
+STARTUP_TIMEOUT_SECONDS = 60
+
+class ImageProcessingError(Exception):
+    """
+    画像の処理に失敗した場合の例外。kind は失敗の種類:
+    "error" (読み込み・切り抜きの例外) / "memory" (メモリ上限の超過) / "timeout" (時間切れ) / "crashed" (子プロセスの異常終了)
+    """
+    def __init__(self, kind, message):
+        super().__init__(message)
+        self.kind = kind
+
+
+def crop_regions(profile_set, image_filename, img, crop_dir, crop_prefix, profile=None):
+    """
+    画像に該当するプロファイルの領域を切り抜き、crop_dir に "<crop_prefix>_<領域番号>.png" として保存します。
+    切り抜き画像は、EXIFの向きを反映した 8bit の sRGB 画像です (領域の座標は回転後の画像に適用する)。
+    ストリップ・タイル形式のTIFFとPNGは、画像全体をデコードせずに領域だけを読み込みます (region_decode.read_regions)。
+    profile には、判定済みの場合に画像に該当するプロファイルを渡します (省略時はここで判定する)。
+
+    Returns:
+        tuple: (プロファイル名 (プロファイルが1つだけの場合は None), [(切り抜き画像のパス, excel_pos, img_region), ...])
+    """
+    # 画像に該当するプロファイルと、切り抜き範囲 (位置合わせが有効ならずれを補正したもの)
+    profile, img_regions, region_images = decode_region_crops(profile_set, image_filename, img, profile=profile)
+    crops = []
+    for region_index, (img_region, excel_pos, region_image) in enumerate(zip(img_regions, profile.region_table.excel_pos, region_images)):
+        crop_path = os.path.join(crop_dir, f"{crop_prefix}_{region_index:03d}.png")
+        region_image.save(crop_path)
+        crops.append((crop_path, excel_pos, list(img_region)))
+    return (profile.name if len(profile_set) > 1 else None), crops
+
+
+class InProcessImageWorker:
+    """画像の読み込みと切り抜きを、呼び出し元のプロセスで行う (image_isolation が無効の場合)。"""
+    def __init__(self, image_source, regions_and_coords, region_profiles=None, alignment=None):
+        self.profile_set = RegionProfileSet(image_source, regions_and_coords, region_profiles, alignment)
+
+    def iter_images(self, image_source, image_files):
+        # zipの場合は後続の画像を並列に先読みする
+        return image_source.iter_images(image_files)
+
+    def process(self, image_filename, open_image, crop_dir, crop_prefix):
+        return crop_regions(self.profile_set, image_filename, open_image(), crop_dir, crop_prefix)
+
+    def close(self):
+        pass
+
+
+def _apply_memory_limit(memory_limit_mb):
+    """
+    子プロセスのアドレス空間を、現在 (ライブラリの読み込み後) の使用量 + memory_limit_mb までに制限する。
+    制限できない環境 (Windowsなど) では、デコード前の画像サイズによる確認のみを行う。
+    """
+    try:
+        import resource
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (ImportError, OSError, ValueError):
+        return
+    limit = current + memory_limit_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, resource.getrlimit(resource.RLIMIT_AS)[1]))
+
+def _estimate_image_bytes(img):
+    # デコード後のピクセルデータのおおよそのサイズ (Image.openの直後、デコード前に確認できる)
+    bytes_per_band = 4 if img.mode in ("I", "F") else 1
+    return img.size[0] * img.size[1] * len(img.getbands()) * bytes_per_band
+
+def _worker_main(conn, image_folder_path, regions_and_coords, region_profiles, alignment, memory_limit_mb):
+    """子プロセスの処理: 画像名を受け取り、切り抜き画像を保存して結果を返すことを繰り返す。"""
+    from image_source import open_image_source, open_image_data
+    try:
+        image_source = open_image_source(image_folder_path)
+        profile_set = RegionProfileSet(image_source, regions_and_coords, region_profiles, alignment)
+    except Exception as e:
+        conn.send(("error", "error", f"Failed to prepare image worker: {e}"))
+        return
+    if memory_limit_mb:
+        _apply_memory_limit(memory_limit_mb)
+    conn.send(("ready",))
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break # 呼び出し元のプロセスが終了した、または接続を閉じた
+        if task is None:
+            break
+        image_filename, data, crop_dir, crop_prefix = task
+        try:
+            img = image_source.open_image(image_filename) if data is None else open_image_data(data)
+            profile = profile_set.classify(image_filename, oriented_size(img))
+            # 領域だけを読み込む画像は、画像全体のサイズでは判定しない (上限を超えた場合はデコード中の MemoryError になる)。
+            # 位置合わせが必要なプロファイルでは画像全体をデコードするため、領域だけを読み込める画像でも判定する
+            region_only = can_read_regions(img) and not profile_set.needs_alignment(profile)
+            if memory_limit_mb and not region_only and _estimate_image_bytes(img) > memory_limit_mb * 1024 * 1024:
+                conn.send(("error", "memory", f"Image too large to decode within {memory_limit_mb} MB ({img.size[0]}x{img.size[1]} {img.mode})"))
+                continue
+            conn.send(("ok",) + crop_regions(profile_set, image_filename, img, crop_dir, crop_prefix, profile))
+        except MemoryError:
+            conn.send(("error", "memory", f"Out of memory (limit {memory_limit_mb} MB)"))
+        except Exception as e:
+            conn.send(("error", "error", f"{type(e).__name__}: {e}"))
+    image_source.close()
+
+
+class IsolatedImageWorker:
+    """
+    画像の読み込みと切り抜きを子プロセスで1枚ずつ行う。
+
+    不正な画像によるデコーダーの停止・異常終了やメモリの使い過ぎが出力全体を止めないよう、
+    画像ごとに時間 (timeout_seconds) とメモリ (memory_limit_mb) の上限を設けます。
+    上限を超えた場合や子プロセスが異常終了した場合は、その画像を ImageProcessingError として失敗させ、
+    子プロセスを作り直して次の画像の処理を続けます。
+    子プロセスは出力の間使い回すため、起動の負担は出力ごと (と失敗した画像ごと) に1回です。
+
+    アーカイブ内の画像は、呼び出し元のプロセスで読み込んで (zipは後続の画像を並列に先読みして) 内容を子プロセスに渡します。
+    画像のデコードと切り抜きは1つの子プロセスで1枚ずつ行うため、並列には行いません。
+    """
+    def __init__(self, image_folder_path, regions_and_coords, region_profiles=None, alignment=None,
+                 timeout_seconds=DEFAULT_TIMEOUT_SECONDS, memory_limit_mb=DEFAULT_MEMORY_LIMIT_MB):
+        self._worker_args = (image_folder_path, regions_and_coords, region_profiles, alignment, memory_limit_mb)
+        self.timeout_seconds = timeout_seconds
+        # GUIのスレッドなどを引き継がないよう、どのOSでも spawn で起動する
+        self._context = multiprocessing.get_context("spawn")
+        self._process = None
+        self._conn = None
+        self._start_error = None # 子プロセスの準備に失敗した場合は、画像ごとに起動し直さない
+
+    def iter_images(self, image_source, image_files):
+        if isinstance(image_source, FolderImageSource):
+            # 画像フォルダの画像は、子プロセスがファイルから直接読み込む
+            return ((image_filename, None) for image_filename in image_files)
+        # アーカイブは呼び出し元で読み込み、内容を子プロセスに渡す (zipは ZipImageSource.iter_files が並列に先読みする)
+        return image_source.iter_files(image_files)
+
+    def _start(self):
+        parent_conn, child_conn = self._context.Pipe()
+        self._process = self._context.Process(target=_worker_main, args=(child_conn,) + self._worker_args, daemon=True)
+        self._process.start()
+        child_conn.close()
+        self._conn = parent_conn
+        message = self._receive(max(STARTUP_TIMEOUT_SECONDS, self.timeout_seconds), "starting the image worker")
+        if message[0] != "ready":
+            self._stop(kill=True)
+            self._start_error = RuntimeError(message[2])
+            raise self._start_error
+
+    def _receive(self, timeout, action):
+        try:
+            if self._conn.poll(timeout):
+                return self._conn.recv()
+        except (EOFError, OSError):
+            pass
+        else:
+            self._stop(kill=True)
+            raise ImageProcessingError("timeout", f"Timed out after {timeout} seconds while {action}")
+        exitcode = self._stop(kill=True)
+        raise ImageProcessingError("crashed", f"Image worker exited unexpectedly (exit code {exitcode}) while {action}")
+
+    def process(self, image_filename, open_image, crop_dir, crop_prefix):
+        """
+        子プロセスで画像を読み込み、切り抜き画像を crop_dir に保存します。
+
+        Returns:
+            tuple: (プロファイル名 または None, [(切り抜き画像のパス, excel_pos, img_region), ...])
+
+        Raises:
+            ImageProcessingError: 読み込み・切り抜きの失敗、時間切れ、メモリ上限の超過、子プロセスの異常終了。
+        """
+        if self._start_error is not None:
+            raise self._start_error
+        # アーカイブの画像は、ここで読み込んだ内容を渡す (読み込みの失敗はこの画像の失敗として扱う)
+        data = open_image() if open_image is not None else None
+        if self._process is None:
+            self._start()
+        self._conn.send((image_filename, data, crop_dir, crop_prefix))
+        message = self._receive(self.timeout_seconds, f"processing {image_filename}")
+        if message[0] == "error":
+            raise ImageProcessingError(message[1], message[2])
+        return message[1], message[2]
+
+    def _stop(self, kill=False):
+        process, self._process = self._process, None
+        if process is None:
+            return None
+        if kill:
+            process.kill()
+        else:
+            try:
+                self._conn.send(None)
+            except OSError:
+                pass
+        process.join(5)
+        if process.is_alive():
+            process.kill()
+            process.join()
+        self._conn.close()
+        self._conn = None
+        return process.exitcode
+
+    def close(self):
+        self._stop()
+
+
+def open_image_worker(image_source, regions_and_coords, region_profiles=None, alignment=None, isolation=None):
+    """
+    出力処理で使う画像の処理方法を作成します。
+
+    Args:
+        image_source (ImageSource): 画像の読み込み元。
+        isolation (dict, optional): config.json の "image_isolation"。
+                                    {"enabled": True, "timeout_seconds": 120, "memory_limit_mb": 4096} のように指定します。
+                                    None または enabled が False の場合は、呼び出し元のプロセスで処理します。
+
+    Returns:
+        InProcessImageWorker または IsolatedImageWorker
+    """
+    if isolation is None or not isolation.get("enabled", True):
+        return InProcessImageWorker(image_source, regions_and_coords, region_profiles, alignment)
+    return IsolatedImageWorker(image_source.path, regions_and_coords, region_profiles, alignment,
+                               isolation.get("timeout_seconds", DEFAULT_TIMEOUT_SECONDS),
+                               isolation.get("memory_limit_mb", DEFAULT_MEMORY_LIMIT_MB))
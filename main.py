@@ -1,16 +1,22 @@
 
 
 import tkinter as tk
-from tkinter import filedialog, messagebox, ttk
+from tkinter import filedialog, messagebox
 import os
 import json
 import functools
 import re
 import sys
+import multiprocessing
 
-# 既存の処理関数をインポート
-from image_to_excel import insert_images_to_excel
-from image_to_pptx import insert_images_to_pptx
+# 起動を速くするため、ここではTkと軽いモジュールだけを読み込む
+# (openpyxl / python-pptx / Pillow などは、出力時やエディタを開いたときに読み込まれる)
+from office_export import run_export
+from export_checkpoint import has_checkpoint
+from error_report import ERROR_REPORT_SUFFIX
+from virtual_tree import VirtualTreeview
+from config_store import ConfigStore, ConfigValidationError, DEFAULT_CONFIG, REGIONS_KEY
+from image_source import ARCHIVE_EXTENSIONS, is_archive
 
 class ImageToOfficeApp:
     def __init__(self, master):
@@ -26,9 +32,14 @@ class ImageToOfficeApp:
             self.resource_base_dir = self.app_exe_dir
 
         self.config_path = os.path.join(self.app_exe_dir, "config.json")
+        # 設定はメインウィンドウと各エディタで共有し、変更は通知で受け取る (ファイルの保存はまとめて遅延実行)
+        self.config_store = ConfigStore(self.config_path, tk_root=master, on_save_error=self._on_config_save_error)
+        self.config = self.config_store.data
+        self.config_store.subscribe(self._on_config_changed)
 
         self.create_widgets()
         self.load_config()
+        master.protocol("WM_DELETE_WINDOW", self.on_closing)
 
     def create_widgets(self):
         # フレームの作成
@@ -47,6 +58,8 @@ class ImageToOfficeApp:
         self.image_folder_var = tk.StringVar(value=os.path.join(self.app_exe_dir, "img"))
         tk.Entry(input_frame, textvariable=self.image_folder_var, width=60).grid(row=0, column=1, padx=5, pady=2)
         tk.Button(input_frame, text="選択", command=functools.partial(self.browse_folder, self.image_folder_var)).grid(row=0, column=2, pady=2)
+        # 画像フォルダの代わりにzip/tarファイルを指定することもできる (展開せずに直接読み込む)
+        tk.Button(input_frame, text="アーカイブ", command=functools.partial(self.browse_archive, self.image_folder_var)).grid(row=0, column=3, padx=(5, 0), pady=2)
 
         # Excel出力パス (exe/スクリプトパスを使用)
         tk.Label(input_frame, text="Excel出力パス:").grid(row=1, column=0, sticky="w", pady=2)
@@ -61,20 +74,15 @@ class ImageToOfficeApp:
         tk.Button(input_frame, text="選択", command=functools.partial(self.browse_file, self.pptx_output_path_var, [("PowerPoint files", "*.pptx")])).grid(row=2, column=2, pady=2)
 
         # --- 設定表示と変更ボタンのセクション ---
-        # Treeviewで領域とセル座標のペアを表示
-        self.tree = ttk.Treeview(settings_frame, columns=("img_region", "excel_pos"), show="headings")
+        # 領域とセル座標のペアを表示 (表示範囲の行だけを作成する仮想リスト。スクロールバーを含む)
+        self.region_list = VirtualTreeview(settings_frame, ("img_region", "excel_pos"),
+                                           self._region_count, self._region_row_values)
+        self.tree = self.region_list.tree
         self.tree.heading("img_region", text="画像領域 [x1, y1, x2, y2]")
         self.tree.heading("excel_pos", text="Excelセル座標")
         self.tree.column("img_region", width=200)
         self.tree.column("excel_pos", width=100)
-        self.tree.pack(fill="both", expand=True, padx=5, pady=5)
-
-        # スクロールバー
-        scrollbar = ttk.Scrollbar(settings_frame, orient="vertical", command=self.tree.yview)
-        self.tree.configure(yscrollcommand=scrollbar.set)
-        scrollbar.pack(side="right", fill="y")
-        self.tree.pack_forget()
-        self.tree.pack(fill="both", expand=True, padx=5, pady=5, side="left")
+        self.region_list.frame.pack(fill="both", expand=True, padx=5, pady=5, side="left")
 
         # 設定変更関連のボタン
         settings_buttons_frame = tk.Frame(settings_frame) # 新しいフレームにボタンをまとめる
@@ -95,6 +103,15 @@ class ImageToOfficeApp:
         if folder_selected:
             var.set(folder_selected)
 
+    def browse_archive(self, var):
+        initial_dir = os.path.dirname(var.get()) if os.path.exists(var.get()) else self.app_exe_dir
+        archive_selected = filedialog.askopenfilename(
+            initialdir=initial_dir,
+            filetypes=[("Archives", " ".join("*" + ext for ext in ARCHIVE_EXTENSIONS)), ("All files", "*.*")]
+        )
+        if archive_selected:
+            var.set(archive_selected)
+
     def browse_file(self, var, filetypes):
         current_path = var.get()
         initial_dir = os.path.dirname(current_path) if os.path.exists(os.path.dirname(current_path)) else self.app_exe_dir
@@ -111,85 +128,77 @@ class ImageToOfficeApp:
 
     def load_config(self):
         try:
-            with open(self.config_path, 'r', encoding='utf-8') as f:
-                self.config = json.load(f)
-            self.update_config_display()
+            self.config_store.load()
             messagebox.showinfo("設定読み込み", "設定ファイルを読み込みました。")
         except FileNotFoundError:
             messagebox.showwarning("設定読み込み", f"設定ファイルが見つかりません: {self.config_path}\nデフォルト値で作成します。")
-            self.config = {
-                "image_regions_and_excel_coords": [
-                    {"img_region": [100, 100, 200, 150], "excel_pos": "B2"}
-                ],
-                "excel_to_pptx_conversion_params": {
-                    "col_width_pix": 64, "row_height_pix": 20, "dpi": 96
-                }
-            }
-            self._save_config() # 初期設定をファイルに保存
+            self.config_store.reset(DEFAULT_CONFIG) # 初期設定をファイルに保存
         except json.JSONDecodeError:
             messagebox.showerror("設定読み込みエラー", f"設定ファイルのJSON形式が不正です: {self.config_path}")
-            self.config = {
-                "image_regions_and_excel_coords": [
-                    {"img_region": [100, 100, 200, 150], "excel_pos": "B2"}
-                ],
-                "excel_to_pptx_conversion_params": {
-                    "col_width_pix": 64, "row_height_pix": 20, "dpi": 96
-                }
-            }
-            self._save_config() # 不正な場合も初期設定をファイルに保存
-
-    def _save_config(self): # ヘルパー関数名を変更 (initial_configでなく汎用的に)
-        try:
-            with open(self.config_path, 'w', encoding='utf-8') as f:
-                json.dump(self.config, f, indent=4, ensure_ascii=False)
-            print(f"設定ファイルが保存されました: {self.config_path}")
-        except Exception as e:
-            print(f"設定ファイルの保存中にエラーが発生しました:\n{e}")
-            messagebox.showerror("保存エラー", f"設定ファイルの保存中にエラーが発生しました:\n{e}") # UIにも表示
+            self.config_store.reset(DEFAULT_CONFIG) # 不正な場合も初期設定をファイルに保存
+        except ConfigValidationError as e:
+            # 読み込んだ内容はそのまま使用し、問題点だけを知らせる (ファイルは上書きしない)
+            messagebox.showwarning("設定読み込み", f"設定ファイルの内容に問題があります: {self.config_path}\n{e}")
+
+    def _on_config_save_error(self, error):
+        messagebox.showerror("保存エラー", f"設定ファイルの保存中にエラーが発生しました:\n{error}")
+
+    def _on_config_changed(self, key, source):
+        # エディタでの保存や領域の削除など、共有設定の変更を一覧に反映する (ファイルは読み直さない)
+        if key is None or key == REGIONS_KEY:
+            self.update_config_display()
+
+    def _region_count(self):
+        return len(self.config.get(REGIONS_KEY, []))
+
+    def _region_row_values(self, index):
+        item = self.config[REGIONS_KEY][index]
+        return (str(item.get("img_region")), item.get("excel_pos"))
 
     def update_config_display(self):
-        # Treeviewの既存データをクリア
-        for i in self.tree.get_children():
-            self.tree.delete(i)
+        # 一覧は全行を作り直さず、表示中の行のうち内容が変わった行だけを更新する
+        self.region_list.refresh()
 
-        # 新しいデータを挿入
-        regions_and_coords = self.config.get("image_regions_and_excel_coords", [])
-        for item in regions_and_coords:
-            self.tree.insert("", "end", values=(str(item.get("img_region")), item.get("excel_pos")))
+    def on_closing(self):
+        self.config_store.flush() # 保存待ちの変更があれば書き込んでから終了する
+        self.master.destroy()
 
     def delete_selected_region(self): # 新規追加
-        selected_items = self.tree.selection()
-        if not selected_items:
+        selected_indices = self.region_list.selected_indices()
+        if not selected_indices:
             messagebox.showwarning("削除", "削除する領域を選択してください。")
             return
 
         if messagebox.askyesno("確認", "選択された領域を削除しますか？"):
-            # 選択されたアイテムのインデックスを特定し、configから削除
-            # Treeviewの表示順とconfigのリストの順序が一致している前提
-            # 逆順で削除することで、インデックスのずれを防ぐ
-            selected_indices = sorted([self.tree.index(item) for item in selected_items], reverse=True)
-            for idx in selected_indices:
-                if 0 <= idx < len(self.config["image_regions_and_excel_coords"]):
-                    del self.config["image_regions_and_excel_coords"][idx]
-            
-            self._save_config() # 変更を保存
-            self.update_config_display() # Treeviewを更新
+            # 選択はデータのインデックスで保持されているため、そのまま1回の走査で取り除く
+            selected = set(selected_indices)
+            regions = self.config[REGIONS_KEY]
+            regions[:] = [item for i, item in enumerate(regions) if i not in selected]
+            self.region_list.clear_selection()
+
+            # 保存の予約とTreeviewの更新 (連続して削除しても書き込みは1回にまとめられる)
+            self.config_store.mark_changed(REGIONS_KEY)
             messagebox.showinfo("削除", "選択された領域を削除しました。")
 
 
     def open_region_editor(self):
+        self._reload_config_if_changed()
         editor_window = tk.Toplevel(self.master)
         from region_editor import RegionEditor
-        RegionEditor(editor_window, self.config_path, self.image_folder_var.get(), self.update_main_config_display)
-
-    def update_main_config_display(self):
-        self.load_config()
-        messagebox.showinfo("設定更新", "画像領域設定が更新されました。")
+        RegionEditor(editor_window, self.config_store, self.image_folder_var.get())
 
     def open_excel_cell_editor(self):
+        self._reload_config_if_changed()
         editor_window = tk.Toplevel(self.master)
         from excel_cell_editor import ExcelCellEditor
-        ExcelCellEditor(editor_window, self.config_path, self.update_main_config_display)
+        ExcelCellEditor(editor_window, self.config_store)
+
+    def _reload_config_if_changed(self):
+        # 設定ファイルが外部で編集されていれば読み込み直す (変更が無ければファイルは開かない)
+        try:
+            self.config_store.reload_if_changed()
+        except (json.JSONDecodeError, ConfigValidationError) as e:
+            messagebox.showwarning("設定読み込み", f"設定ファイルの内容に問題があります: {self.config_path}\n{e}")
 
     def _handle_file_overwrite(self, original_filepath):
         if not os.path.exists(original_filepath):
@@ -224,26 +233,59 @@ class ImageToOfficeApp:
         else:
             return None
 
+    def _ask_resume(self, output_path):
+        """
+        前回中断された出力のチェックポイントがあれば、続きから再開するかを確認します。
+
+        Returns:
+            bool: 再開する場合はTrue。
+        """
+        if not has_checkpoint(output_path):
+            return False
+        return messagebox.askyesno("再開の確認", f"前回中断された出力の途中経過が見つかりました。続きから再開しますか？\n{output_path}\n"
+                                   "(「いいえ」を選ぶと最初から出力し直します)")
+
+    def _show_error_report(self, output_path):
+        """出力できなかった画像があれば、その一覧 (出力ファイル名 + ".errors.json" / ".errors.csv") の場所を表示します。"""
+        report_path = output_path + ERROR_REPORT_SUFFIX + ".json"
+        if not os.path.exists(report_path):
+            return
+        try:
+            with open(report_path, 'r', encoding='utf-8') as f:
+                failed = json.load(f)["failed"]
+        except (OSError, ValueError, KeyError):
+            return
+        lines = [f"{entry['image']}: {entry['kind']}" for entry in failed[:10]]
+        if len(failed) > 10:
+            lines.append(f"... 他 {len(failed) - 10} 件")
+        messagebox.showwarning("警告", f"{len(failed)} 枚の画像を出力できませんでした。\n" + "\n".join(lines)
+                               + f"\n\n理由の一覧: {report_path}\n{output_path + ERROR_REPORT_SUFFIX}.csv")
+
     def run_excel_export(self):
         image_folder = self.image_folder_var.get()
         original_excel_output_path = self.excel_output_path_var.get()
-        regions_and_coords = self.config.get("image_regions_and_excel_coords", [])
+        regions_and_coords = self.config.get(REGIONS_KEY, [])
 
-        if not os.path.isdir(image_folder):
-            messagebox.showerror("エラー", f"画像フォルダが見つかりません: {image_folder}")
+        if not os.path.isdir(image_folder) and not is_archive(image_folder):
+            messagebox.showerror("エラー", f"画像フォルダ (またはzip/tarファイル) が見つかりません: {image_folder}")
             return
-        if not regions_and_coords:
+        if not regions_and_coords and not self.config.get("region_profiles"):
             messagebox.showwarning("警告", "設定ファイルに画像領域とセル座標のペアが定義されていません。")
             return
 
-        excel_output_path = self._handle_file_overwrite(original_excel_output_path)
+        resume = self._ask_resume(original_excel_output_path)
+        excel_output_path = original_excel_output_path if resume else self._handle_file_overwrite(original_excel_output_path)
         if excel_output_path is None:
             messagebox.showinfo("処理中止", "Excelファイルの出力がキャンセルされました。")
             return
 
         try:
-            insert_images_to_excel(excel_output_path, image_folder, regions_and_coords)
+            if not run_export("excel", excel_output_path, image_folder, self.config, checkpoint=True, resume=resume):
+                messagebox.showerror("エラー", f"Excelファイルを保存できませんでした:\n{excel_output_path}\n"
+                                              "出力先のファイルが他のアプリケーションで開かれていないか確認してください。")
+                return
             messagebox.showinfo("成功", f"Excelファイルが正常に生成されました:\n{excel_output_path}")
+            self._show_error_report(excel_output_path)
             if excel_output_path != original_excel_output_path:
                 self.excel_output_path_var.set(excel_output_path)
         except Exception as e:
@@ -252,33 +294,39 @@ class ImageToOfficeApp:
     def run_pptx_export(self):
         image_folder = self.image_folder_var.get()
         original_pptx_output_path = self.pptx_output_path_var.get()
-        regions_and_coords = self.config.get("image_regions_and_excel_coords", [])
+        regions_and_coords = self.config.get(REGIONS_KEY, [])
         excel_conv_params = self.config.get("excel_to_pptx_conversion_params", {})
 
-        if not os.path.isdir(image_folder):
-            messagebox.showerror("エラー", f"画像フォルダが見つかりません: {image_folder}")
+        if not os.path.isdir(image_folder) and not is_archive(image_folder):
+            messagebox.showerror("エラー", f"画像フォルダ (またはzip/tarファイル) が見つかりません: {image_folder}")
             return
-        if not regions_and_coords:
+        if not regions_and_coords and not self.config.get("region_profiles"):
             messagebox.showwarning("警告", "設定ファイルに画像領域とセル座標のペアが定義されていません。")
             return
         if not excel_conv_params:
             messagebox.showwarning("警告", "設定ファイルにExcel-PowerPoint変換パラメータが定義されていません。")
             return
 
-        pptx_output_path = self._handle_file_overwrite(original_pptx_output_path)
+        resume = self._ask_resume(original_pptx_output_path)
+        pptx_output_path = original_pptx_output_path if resume else self._handle_file_overwrite(original_pptx_output_path)
         if pptx_output_path is None:
             messagebox.showinfo("処理中止", "PowerPointファイルの出力がキャンセルされました。")
             return
 
         try:
-            insert_images_to_pptx(pptx_output_path, image_folder, regions_and_coords, excel_conv_params)
+            if not run_export("pptx", pptx_output_path, image_folder, self.config, checkpoint=True, resume=resume):
+                messagebox.showerror("エラー", f"PowerPointファイルを保存できませんでした:\n{pptx_output_path}\n"
+                                              "出力先のファイルが他のアプリケーションで開かれていないか確認してください。")
+                return
             messagebox.showinfo("成功", f"PowerPointファイルが正常に生成されました:\n{pptx_output_path}")
+            self._show_error_report(pptx_output_path)
             if pptx_output_path != original_pptx_output_path:
                 self.pptx_output_path_var.set(pptx_output_path)
         except Exception as e:
             messagebox.showerror("エラー", f"PowerPointファイルの生成中にエラーが発生しました:\n{e}")
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support() # exe化した場合に画像処理の子プロセスがGUIを起動し直さないように
     root = tk.Tk()
     app = ImageToOfficeApp(root)
     root.mainloop()
@@ -0,0 +1,118 @@
+import os
+import sys
+import json
+import argparse
+import multiprocessing
+from config_store import REGIONS_KEY
+
+# GUIやツールから指定できる出力形式
+OUTPUT_FORMATS = ("excel", "pptx", "pdf", "html")
+# 出力形式 -> 出力ファイルの拡張子
+OUTPUT_EXTENSIONS = {"excel": ".xlsx", "pptx": ".pptx", "pdf": ".pdf", "html": ".html"}
+
+def run_export(output_format, output_path, image_folder_path, config, image_files=None, progress_callback=None,
+               checkpoint=False, resume=False):
+    """
+    設定 (config.json の内容) に従って、画像の切り抜きとExcel/PowerPoint/PDF/HTMLファイルへの出力を行います。
+    GUI (main.py) と各ツール (watch_export.py, export_service.py) に共通の出力処理の入口で、Tkには依存しません。
+
+    openpyxl / python-pptx / Pillow / numpy などの重いライブラリは、
+    起動を遅くしないよう、この関数で最初に出力するときに読み込みます。
+
+    Args:
+        output_format (str): "excel" / "pptx" / "pdf" / "html" のいずれか。
+        output_path (str): 出力するファイルのパス。
+        image_folder_path (str): 画像フォルダ、またはzip/tarファイルのパス。
+        config (dict): 設定 (領域、テンプレート、位置合わせ、領域プロファイルなど)。
+        image_files (list, optional): 処理する画像のリスト。省略時は全ての画像。
+        progress_callback (callable, optional): progress_callback(処理済み枚数, 全枚数) の形式で呼ばれる。
+        checkpoint (bool, optional): 途中経過を出力ファイル名 + ".checkpoint" のフォルダに保存し、中断しても再開できるようにする。
+        resume (bool, optional): 既存のチェックポイントがあれば、そこから再開する。
+
+    Returns:
+        bool: 出力ファイルを保存できた場合は True。保存に失敗した場合は False (チェックポイントは残り、resume で再開できる)。
+    """
+    return run_exports([(output_format, output_path)], image_folder_path, config, image_files, progress_callback,
+                       checkpoint, resume)[0]
+
+def run_exports(outputs, image_folder_path, config, image_files=None, progress_callback=None, checkpoint=False, resume=False):
+    """
+    同じ画像から複数の形式のファイルを出力します。画像のデコード・位置合わせ・切り抜きは全ての形式で1回だけ行い、
+    同じ切り抜き画像を各形式の書き込みに渡すため、出力形式を増やしても増えるのはその形式の書き込みの時間だけです。
+
+    Args:
+        outputs (list): (出力形式, 出力するファイルのパス) のリスト。出力形式は run_export と同じ。
+        image_folder_path, config, image_files, progress_callback, resume: run_export と同じ。
+        checkpoint (bool, optional): 途中経過を、先頭の出力ファイル名 + ".checkpoint" のフォルダに保存する。
+
+    Returns:
+        list: 出力ごとの、保存できたかどうか (bool)。1つでも保存に失敗した場合はチェックポイントが残り、resume で再開できる。
+    """
+    from crop_pipeline import CropPipeline
+    writers = [_create_output(output_format, output_path, image_folder_path, config) for output_format, output_path in outputs]
+    checkpoint_settings = None
+    if checkpoint:
+        # 出力が1つの場合は、各形式の insert_images_to_* と同じ設定にして、どちらからでも再開できるようにする
+        checkpoint_settings = (writers[0].checkpoint_settings if len(writers) == 1
+                               else {"outputs": [writer.checkpoint_settings for writer in writers]})
+    pipeline = CropPipeline(outputs[0][1], image_folder_path, config.get(REGIONS_KEY, []), config.get("region_profiles"),
+                            config.get("alignment"), image_files, progress_callback, config.get("image_isolation", {}),
+                            checkpoint_settings, resume)
+    return pipeline.run(writers)
+
+def _create_output(output_format, output_path, image_folder_path, config):
+    templates = config.get("output_templates", {})
+    if output_format == "excel":
+        from image_to_excel import ExcelOutput
+        return ExcelOutput(output_path, templates.get("excel") or None, config.get("output_compression"),
+                           config.get("contact_sheet"))
+    elif output_format == "pptx":
+        from image_to_pptx import PptxOutput
+        return PptxOutput(output_path, config.get("excel_to_pptx_conversion_params", {}), templates.get("pptx") or None,
+                          config.get("output_compression"), config.get("contact_sheet"))
+    elif output_format == "pdf":
+        from image_to_pdf import PdfOutput
+        return PdfOutput(output_path, config.get("excel_to_pptx_conversion_params", {}))
+    elif output_format == "html":
+        from image_to_html import HtmlOutput
+        return HtmlOutput(output_path, image_folder_path)
+    else:
+        raise ValueError(f"Unknown output format: {output_format}")
+
+def _format_from_path(output_path):
+    extension = os.path.splitext(output_path)[1].lower()
+    for output_format, format_extension in OUTPUT_EXTENSIONS.items():
+        if extension == format_extension:
+            return output_format
+    return "excel"
+
+def main(argv=None):
+    """
+    コマンドラインから出力を行う。途中経過は常にチェックポイントに保存し、
+    中断した場合は同じ引数に --resume を付けて実行すると続きから再開できる。
+    """
+    multiprocessing.freeze_support() # exe化した場合に画像処理の子プロセスが正しく起動するように
+    parser = argparse.ArgumentParser(description="画像の領域を切り抜いてExcel/PowerPoint/PDF/HTMLファイルに出力します。")
+    parser.add_argument("image_folder", help="画像フォルダ、またはzip/tarファイルのパス")
+    parser.add_argument("output_path", help="出力ファイルのパス (.xlsx / .pptx / .pdf / .html)")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, help="出力形式 (省略時は出力ファイルの拡張子から判定)")
+    parser.add_argument("--config", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json"),
+                        help="設定ファイルのパス")
+    parser.add_argument("--resume", action="store_true", help="前回中断した出力を、チェックポイントから再開する")
+    args = parser.parse_args(argv)
+
+    with open(args.config, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    try:
+        saved = run_export(args.format or _format_from_path(args.output_path), args.output_path, args.image_folder, config,
+                           checkpoint=True, resume=args.resume)
+    except ValueError as e:
+        # 異なる設定・画像で作成されたチェックポイントから再開しようとした場合など
+        print(f"Error: {e}")
+        if args.resume:
+            print("--resume を付けずに実行すると、最初から出力し直します。")
+        return 1
+    return 0 if saved else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
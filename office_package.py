@@ -0,0 +1,170 @@
+import os
+import time
+import zlib
+import zipfile
+import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# 既に圧縮済みの形式のため、Deflateしても小さくならないメディアの拡張子
+PRECOMPRESSED_EXTENSIONS = (".png", ".jpg", ".jpeg", ".jpe", ".gif", ".wdp", ".hdp", ".webp",
+                            ".mp3", ".mp4", ".m4a", ".m4v", ".wma", ".wmv")
+# これより小さいパーツは並列化の効果が無いため、書き込み時にその場で圧縮する
+PARALLEL_MIN_BYTES = 64 * 1024
+
+class _PrecompressedData:
+    """_ZipWriteFile の圧縮器の代わりに、別スレッドで圧縮済みのデータを返すオブジェクト。"""
+    def __init__(self, compressed):
+        self._compressed = compressed
+
+    def compress(self, data):
+        return b""
+
+    def flush(self):
+        return self._compressed
+
+def _raw_deflate(data, level):
+    # zipのDeflate形式 (ヘッダー無しのraw deflate)。zlibは圧縮中にGILを解放するため、スレッドで並列に実行できる
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush()
+
+
+class PackageZipFile(zipfile.ZipFile):
+    """
+    xlsx/pptx パッケージの書き込み用のZipFile。パーツごとに圧縮方法を選びます。
+    - PNG/JPEGなどの圧縮済みのメディアは無圧縮 (ZIP_STORED) で格納する (store_media)
+    - XMLなどのその他のパーツは、指定したレベル (0〜9) でDeflate圧縮する (compress_level)
+    - threads が2以上の場合、大きなパーツの圧縮を複数のスレッドで並列に行う
+      (パーツの格納順は書き込んだ順のまま。並列に圧縮中のパーツは threads * 4 個までに制限してメモリ使用量を抑える)
+    出力は通常のzipファイルのため、Officeでそのまま開けます。
+    """
+    def __init__(self, file, store_media=True, compress_level=6, threads=0):
+        super().__init__(file, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+        self.store_media = store_media
+        self.compress_level = compress_level
+        self._executor = ThreadPoolExecutor(max_workers=threads) if threads and threads > 1 else None
+        self._max_pending = (threads or 1) * 4
+        self._pending = deque() # 書き込み待ちのパーツ (ZipInfo, データ, 圧縮中のFuture または None)
+
+    def writestr(self, zinfo_or_arcname, data, compress_type=None, compresslevel=None):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        name = zinfo_or_arcname.filename if isinstance(zinfo_or_arcname, zipfile.ZipInfo) else zinfo_or_arcname
+        if self.store_media and name.lower().endswith(PRECOMPRESSED_EXTENSIONS):
+            compress_type, compresslevel = zipfile.ZIP_STORED, None
+        else:
+            compress_type, compresslevel = zipfile.ZIP_DEFLATED, self.compress_level
+
+        future = None
+        if self._executor is not None and compress_type == zipfile.ZIP_DEFLATED and len(data) >= PARALLEL_MIN_BYTES:
+            future = self._executor.submit(_raw_deflate, data, compresslevel)
+        elif not self._pending:
+            super().writestr(zinfo_or_arcname, data, compress_type, compresslevel)
+            return
+        self._pending.append((zinfo_or_arcname, data, compress_type, compresslevel, future))
+        self._write_pending(block=len(self._pending) > self._max_pending)
+
+    def write(self, filename, arcname=None, compress_type=None, compresslevel=None):
+        # openpyxlはワークシートを一時ファイルから書き込むため、内容を読み込んで同じ規則で格納する
+        with open(filename, 'rb') as f:
+            self.writestr(arcname or filename, f.read())
+
+    def close(self):
+        if self.fp is not None and self.mode == 'w':
+            self._write_pending(block=True, drain=True)
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        super().close()
+
+    def _write_pending(self, block, drain=False):
+        """先頭から順に、圧縮が完了したパーツを書き込む。block=True なら先頭のパーツの完了を待つ。"""
+        while self._pending:
+            zinfo_or_arcname, data, compress_type, compresslevel, future = self._pending[0]
+            if future is not None and not future.done() and not block:
+                return
+            self._pending.popleft()
+            if future is None:
+                super().writestr(zinfo_or_arcname, data, compress_type, compresslevel)
+            else:
+                self._write_precompressed(zinfo_or_arcname, data, future.result())
+            if not drain:
+                block = False
+
+    def _write_precompressed(self, zinfo_or_arcname, data, compressed):
+        if isinstance(zinfo_or_arcname, zipfile.ZipInfo):
+            zinfo = zinfo_or_arcname
+        else:
+            zinfo = zipfile.ZipInfo(zinfo_or_arcname, date_time=time.localtime(time.time())[:6])
+            zinfo.external_attr = 0o600 << 16
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+        zinfo.file_size = len(data)
+        with self.open(zinfo, 'w') as dest:
+            # CRCとサイズの計算・ヘッダーの書き込みはZipFileに任せ、圧縮だけを圧縮済みのデータに置き換える
+            # (標準ライブラリの実装が変わって置き換えが効かない場合も、通常どおり圧縮されるだけで出力は正しい)
+            dest._compressor = _PrecompressedData(compressed)
+            dest.write(data)
+
+
+def _save_with_fallback(save_with_compression, save_normally, filepath):
+    """
+    compression を指定した保存を行い、失敗した場合は通常の保存をやり直す。
+    PackageZipFile と python-pptx の書き込み処理は非公開の内部構造を使うため、
+    ライブラリの版によっては例外の種類を問わず失敗し得る (その場合も出力ファイルは通常どおり保存する)。
+    """
+    try:
+        save_with_compression()
+        return
+    except Exception as e:
+        print(f"Saving with compression options failed ({type(e).__name__}: {e}); saving normally.")
+    try:
+        os.remove(filepath) # 書き込み途中のファイルを残さない
+    except OSError:
+        pass
+    save_normally(filepath)
+
+def save_workbook(wb, excel_filepath, compression=None):
+    """
+    openpyxlのワークブックを保存します。compression (config.json の "output_compression") を指定した場合は
+    PackageZipFile でパーツごとに圧縮方法を選んで保存し、省略時は wb.save と同じです。
+    """
+    if not compression:
+        wb.save(excel_filepath)
+        return
+
+    def save_with_compression():
+        from openpyxl.writer.excel import ExcelWriter
+        # wb.save (openpyxl.writer.excel.save_workbook) と同じ処理を、zipファイルだけ差し替えて行う
+        wb.properties.modified = datetime.datetime.now(tz=datetime.timezone.utc).replace(tzinfo=None)
+        with PackageZipFile(excel_filepath, **compression) as archive:
+            ExcelWriter(wb, archive).save()
+    _save_with_fallback(save_with_compression, wb.save, excel_filepath)
+
+
+class _ZipPartWriter:
+    """python-pptx のパッケージ書き込み処理から、パーツを PackageZipFile に書き込むためのアダプター。"""
+    def __init__(self, archive):
+        self._archive = archive
+
+    def write(self, pack_uri, blob):
+        self._archive.writestr(pack_uri.membername, blob)
+
+def save_presentation(prs, pptx_filepath, compression=None):
+    """
+    python-pptxのプレゼンテーションを保存します。compression を指定した場合は PackageZipFile で保存し、
+    省略時は prs.save と同じです。
+    """
+    if not compression:
+        prs.save(pptx_filepath)
+        return
+
+    def save_with_compression():
+        # prs.save (OpcPackage.save) と同じ内容を、zipファイルだけ差し替えて書き込む
+        from pptx.opc.serialized import PackageWriter
+        package = prs.part.package
+        writer = PackageWriter(pptx_filepath, package._rels, tuple(package.iter_parts()))
+        with PackageZipFile(pptx_filepath, **compression) as archive:
+            part_writer = _ZipPartWriter(archive)
+            for write_step in (writer._write_content_types_stream, writer._write_pkg_rels, writer._write_parts):
+                write_step(part_writer)
+    _save_with_fallback(save_with_compression, prs.save, pptx_filepath)
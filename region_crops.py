@@ -0,0 +1,96 @@
+import os
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from config_store import REGIONS_KEY
+from image_source import open_image_source
+from region_decode import decode_region_crops
+from region_profiles import RegionProfileSet
+
+# iter_region_crops が返す切り抜き画像。(filename, region_index, crop) のタプルとしても使える
+RegionCrop = namedtuple("RegionCrop", ["filename", "region_index", "crop"])
+
+def _print_error(image_filename, error):
+    print(f"Error processing {image_filename}: {error}")
+
+def _array_crop(frame, img_region):
+    """
+    デコード済みの画像 (NumPy配列) から領域を切り抜く。画像内に収まる領域は、コピーせずに frame のビューを返す。
+    画像からはみ出す領域は、Pillowのcropと同様にはみ出した部分を0で埋めた配列 (コピー) を返す。
+    """
+    import numpy as np
+    left, upper, right, lower = (int(round(v)) for v in img_region)
+    height, width = frame.shape[:2]
+    if 0 <= left <= right <= width and 0 <= upper <= lower <= height:
+        return frame[upper:lower, left:right]
+    crop = np.zeros((max(lower - upper, 0), max(right - left, 0)) + frame.shape[2:], dtype=frame.dtype)
+    src_left, src_upper = max(left, 0), max(upper, 0)
+    src_right, src_lower = min(right, width), min(lower, height)
+    if src_left < src_right and src_upper < src_lower:
+        crop[src_upper - upper:src_lower - upper, src_left - left:src_right - left] = frame[src_upper:src_lower, src_left:src_right]
+    return crop
+
+def _array_crops(img, img_regions):
+    # 画像全体をデコードした場合は、NumPy配列に1回だけ変換して、各領域はそのビューにする
+    import numpy as np
+    frame = np.asarray(img)
+    return [_array_crop(frame, img_region) for img_region in img_regions]
+
+def iter_region_crops(image_folder_path, config, image_files=None, as_array=False, workers=None, on_error=None):
+    """
+    画像フォルダ (またはzip/tarファイル) 内の画像から、設定の領域を切り抜いて順番に返します。
+    Excel/PowerPointファイルを作らずに、OCRや検査などのスクリプトで同じ切り抜き画像を使うためのAPIです。
+
+    出力処理と同じ仕組み (ImageSource の読み込みとzipの先読み、RegionProfileSet のプロファイル判定と位置合わせ) を使い、
+    画像のデコードと切り抜きは workers 個のスレッドで並列に行います (Pillowのデコードは並列に実行できる)。
+    結果は image_files の順に返し、先読みする画像は workers * 2 枚までに制限します。
+
+    Args:
+        image_folder_path (str): 画像フォルダ、またはzip/tarファイルのパス。
+        config (dict): 設定 (config.json の内容)。領域、region_profiles、alignment を使用します。
+        image_files (list, optional): 処理する画像のリスト。省略時は全ての画像。
+        as_array (bool, optional): Trueの場合は切り抜き画像をNumPy配列 (高さ, 幅[, チャンネル]) で返します。
+                                   画像内に収まる領域は、画像ごとに1回だけ変換した配列のビュー (コピー無し) です。
+                                   Falseの場合はPillowの画像で返します。
+        workers (int, optional): デコードに使うスレッド数。省略時はCPUのコア数。
+        on_error (callable, optional): 画像の処理に失敗した場合に on_error(画像ファイル名, 例外) の形式で呼ばれる。
+                                       省略時はエラーを表示して、その画像を読み飛ばします。
+
+    Yields:
+        RegionCrop: (画像ファイル名, 領域番号, 切り抜き画像)。領域番号は画像に該当したプロファイルの領域の番号です。
+    """
+    on_error = on_error or _print_error
+    workers = max(workers or os.cpu_count() or 1, 1)
+    with open_image_source(image_folder_path) as image_source:
+        if image_files is None:
+            image_files = image_source.list_images()
+        profile_set = RegionProfileSet(image_source, config.get(REGIONS_KEY, []), config.get("region_profiles"),
+                                       config.get("alignment"))
+
+        def decode(image_filename, open_image):
+            # 出力処理と同じ切り抜き画像 (EXIFの向きの反映と8bitのsRGBへの変換、TIFF/PNGは領域だけを読み込む)
+            profile, img_regions, crops = decode_region_crops(profile_set, image_filename, open_image(),
+                                                              _array_crops if as_array else None)
+            if as_array:
+                import numpy as np
+                # 領域だけを読み込んだ場合はPillowの画像のため、配列に変換する (配列はそのまま)
+                return [np.asarray(crop) for crop in crops]
+            return crops
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque() # (画像ファイル名, デコード中のFuture)
+            images = iter(image_source.iter_images(image_files))
+            while True:
+                for image_filename, open_image in images:
+                    pending.append((image_filename, executor.submit(decode, image_filename, open_image)))
+                    if len(pending) >= workers * 2:
+                        break
+                if not pending:
+                    break
+                image_filename, future = pending.popleft()
+                try:
+                    crops = future.result()
+                except Exception as e:
+                    on_error(image_filename, e)
+                    continue
+                for region_index, crop in enumerate(crops):
+                    yield RegionCrop(image_filename, region_index, crop)
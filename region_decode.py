@@ -0,0 +1,194 @@
+import io
+import math
+from image_normalize import normalize_image, orientation_transpose, oriented_size
+
+# タイル・ストリップを単独のTIFFとしてデコードするときに、元の画像から引き継ぐタグ
+# (ピクセルの形式と圧縮に関するもの。サイズとストリップの位置は新しく設定する)
+_TIFF_DECODE_TAGS = (
+    258,  # BitsPerSample
+    259,  # Compression
+    262,  # PhotometricInterpretation
+    266,  # FillOrder
+    277,  # SamplesPerPixel
+    284,  # PlanarConfiguration
+    317,  # Predictor
+    320,  # ColorMap
+    338,  # ExtraSamples
+    339,  # SampleFormat
+    347,  # JPEGTables
+    530,  # YCbCrSubSampling
+    532,  # ReferenceBlackWhite
+)
+
+def _rounded_boxes(img_regions):
+    # Image.crop と同じく、座標は四捨五入した整数で扱う
+    return [tuple(int(round(v)) for v in img_region) for img_region in img_regions]
+
+def can_read_regions(img):
+    """
+    画像全体をデコードせずに、領域だけを読み込めるかどうか (ヘッダーのみで判定する)。
+    ストリップ・タイル形式のTIFF (1ページ目以外も可) と、インターレースでないPNGが対象です。
+    EXIFで回転・反転が指定された画像は、領域の座標が回転後の画像に対するものなので対象外です。
+    """
+    if not img.tile or orientation_transpose(img) is not None:
+        return False # デコード済み、または回転が必要な画像
+    if img.format == "TIFF":
+        tags = img.tag_v2
+        offsets = tags.get(324, tags.get(273))
+        return bool(offsets) and tags.get(284, 1) == 1 # 色ごとに分かれた (planar) 形式は対象外
+    if img.format == "PNG":
+        return not img.info.get("interlace") and len(img.tile) == 1 and getattr(img, "n_frames", 1) == 1
+    return False
+
+def _tiff_layout(img):
+    """TIFFの (タイルの幅, タイルの高さ, 横方向のタイル数, 位置のリスト, バイト数のリスト)。ストリップは幅が画像の幅のタイルとして扱う。"""
+    tags = img.tag_v2
+    width, height = img.size
+    if 322 in tags: # TileWidth
+        tile_width, tile_height = tags[322], tags[323]
+        offsets, byte_counts = tags[324], tags[325]
+    else:
+        tile_width, tile_height = width, min(tags.get(278, height), height) # RowsPerStrip
+        offsets, byte_counts = tags[273], tags[279]
+    return tile_width, tile_height, math.ceil(width / tile_width), offsets, byte_counts
+
+def region_block_height(img):
+    """
+    read_regions で一度にデコードされる行数 (TIFFのストリップ・タイルの高さ)。
+    画像を上から帯状に読み込む場合に、帯の境界でストリップ・タイルを2回デコードしないよう、帯の高さをこの倍数にする。
+    """
+    return _tiff_layout(img)[1]
+
+def _decode_tiff_tile(img, data, size):
+    """
+    タイル (ストリップ) 1つ分の圧縮データを、同じ形式の1ストリップだけのTIFFとしてPillowでデコードする。
+    圧縮 (LZW / Deflate / PackBits / JPEG など) と Predictor の扱いは、画像全体を読み込む場合と同じ (libtiff) です。
+    """
+    from PIL import Image, TiffImagePlugin, TiffTags
+    ifd = TiffImagePlugin.ImageFileDirectory_v2()
+    for tag in _TIFF_DECODE_TAGS:
+        if tag in img.tag_v2:
+            ifd[tag] = img.tag_v2[tag]
+            ifd.tagtype[tag] = img.tag_v2.tagtype[tag]
+    ifd[256], ifd[257], ifd[278] = size[0], size[1], size[1]
+    ifd[279] = len(data)
+    ifd[273] = 0 # tobytes がIFDの直後の位置に置き換える
+    ifd.tagtype[273] = ifd.tagtype[279] = TiffTags.LONG
+    header = b"II*\x00\x08\x00\x00\x00"
+    tile = Image.open(io.BytesIO(header + ifd.tobytes(len(header)) + data))
+    tile.load()
+    return tile
+
+def _read_tiff_regions(img, boxes):
+    from PIL import Image
+    tile_width, tile_height, tiles_across, offsets, byte_counts = _tiff_layout(img)
+    width, height = img.size
+    # タイルの番号 -> そのタイルと重なる領域の番号のリスト
+    needed = {}
+    for region_index, (left, upper, right, lower) in enumerate(boxes):
+        left, upper, right, lower = max(left, 0), max(upper, 0), min(right, width), min(lower, height)
+        if left >= right or upper >= lower:
+            continue
+        for tile_y in range(upper // tile_height, (lower - 1) // tile_height + 1):
+            for tile_x in range(left // tile_width, (right - 1) // tile_width + 1):
+                needed.setdefault(tile_y * tiles_across + tile_x, []).append(region_index)
+
+    # 画像からはみ出した部分は Image.crop と同じく0で埋める
+    crops = [Image.new(img.mode, (max(right - left, 0), max(lower - upper, 0))) for left, upper, right, lower in boxes]
+    for tile_index in sorted(needed): # ファイル内の順に読む
+        tile_y, tile_x = divmod(tile_index, tiles_across)
+        tile_left, tile_upper = tile_x * tile_width, tile_y * tile_height
+        # ストリップの最後の1つは行数が少ない (タイルは端でも同じサイズで、はみ出した部分は使わない)
+        rows = tile_height if 322 in img.tag_v2 else min(tile_height, height - tile_upper)
+        img.fp.seek(offsets[tile_index])
+        tile = _decode_tiff_tile(img, img.fp.read(byte_counts[tile_index]), (tile_width, rows))
+        for region_index in needed[tile_index]:
+            left, upper, right, lower = boxes[region_index]
+            # タイルと領域の重なり (タイル内の座標) を、切り抜き画像の対応する位置に貼り付ける
+            box = (max(left, tile_left) - tile_left, max(upper, tile_upper) - tile_upper,
+                   min(right, tile_left + tile_width, width) - tile_left, min(lower, tile_upper + rows, height) - tile_upper)
+            crops[region_index].paste(tile.crop(box), (box[0] + tile_left - left, box[1] + tile_upper - upper))
+    return crops
+
+def _read_png_regions(img, boxes):
+    # PNGは上の行から順に圧縮されているため、最後の領域の下端の行までデコードして止める
+    last_row = min(max(lower for _, _, _, lower in boxes), img.size[1])
+    if last_row >= img.size[1] or last_row <= 0:
+        return None # 画像全体を読み込む場合と変わらない
+    original_tile, original_size = img.tile, img.size
+    tile = original_tile[0]
+    # タイルは新しいPillowでは名前付きタプル、古いPillowでは通常のタプル
+    tile = (tile[0], (0, 0, img.size[0], last_row)) + tuple(tile[2:])
+    img.tile = [original_tile[0]._make(tile) if hasattr(original_tile[0], "_make") else tile]
+    img._size = (img.size[0], last_row) # draft() と同様に、デコードする画像のサイズを変更する
+    try:
+        img.load()
+    except Exception:
+        # 画像全体の読み込みにフォールバックできるよう、元の状態に戻す
+        img.tile, img._size = original_tile, original_size
+        img.im = None
+        raise
+    return [img.crop(box) for box in boxes]
+
+def read_regions(img, img_regions):
+    """
+    画像全体をデコードせずに、img_regions の範囲だけを読み込んだ切り抜き画像のリストを返します。
+
+    - ストリップ・タイル形式のTIFF: 領域と重なるストリップ・タイルだけを読み込んでデコードします。
+      メモリとファイルの読み込み量は、ページ全体ではなく領域の大きさ (に重なるタイル) に比例します。
+    - PNG: 最後の領域の下端の行までデコードして止めます。
+
+    対象外の画像 (can_read_regions が False)、画像全体を読み込むのと変わらない場合、
+    または領域だけの読み込みに失敗した場合 (使用中のPillowで内部の構造が異なる場合など) は None を返します。
+    切り抜き画像のモードは元の画像のままです (normalize_image は呼び出し元で行う)。
+    """
+    if not img_regions or not can_read_regions(img):
+        return None
+    boxes = _rounded_boxes(img_regions)
+    try:
+        if img.format == "TIFF":
+            crops = _read_tiff_regions(img, boxes)
+        else:
+            crops = _read_png_regions(img, boxes)
+    except MemoryError:
+        raise
+    except Exception as e:
+        # Pillowの内部の構造が異なるバージョンなどでは、画像全体を読み込む (呼び出し元は None で判定する)
+        print(f"Region-only decode failed, decoding the whole image: {type(e).__name__}: {e}")
+        return None
+    if crops is not None and img.info.get("icc_profile"):
+        for crop in crops: # sRGBへの変換に使う
+            crop.info["icc_profile"] = img.info["icc_profile"]
+    return crops
+
+def decode_region_crops(profile_set, image_filename, img, crop_image=None, profile=None):
+    """
+    画像に該当するプロファイルの領域を、8bitのsRGBの切り抜き画像にして返します。
+
+    位置合わせが不要なプロファイルでは、read_regions で領域だけを読み込みます (画像全体はデコードしない)。
+    それ以外の場合は、画像全体を normalize_image で変換してから切り抜きます。
+
+    Args:
+        profile_set (RegionProfileSet): 領域プロファイル。
+        image_filename (str): 画像ファイル名。
+        img (PIL.Image.Image): Image.open で開いた画像 (デコード前)。
+        crop_image (callable, optional): 画像全体をデコードした場合に crop_image(画像, 切り抜き範囲のリスト) の形式で呼ばれ、
+                                         切り抜き画像のリストを返す関数。省略時は Image.crop で切り抜きます。
+        profile (RegionProfile, optional): profile_set.classify で判定済みのプロファイル。省略時はここで判定します。
+
+    Returns:
+        tuple: (RegionProfile, 切り抜き範囲のリスト, 切り抜き画像のリスト)
+    """
+    # 領域の座標はEXIFの向きを反映した画像に対するもの
+    if profile is None:
+        profile = profile_set.classify(image_filename, oriented_size(img))
+    if not profile_set.needs_alignment(profile):
+        img_regions = profile.region_table.img_regions()
+        crops = read_regions(img, img_regions)
+        if crops is not None:
+            return profile, img_regions, [normalize_image(crop) for crop in crops]
+    img = normalize_image(img)
+    img_regions = profile_set.regions_for(profile, image_filename, img)
+    if crop_image is not None:
+        return profile, img_regions, crop_image(img, img_regions)
+    return profile, img_regions, [img.crop(img_region) for img_region in img_regions]
@@ -2,39 +2,81 @@
 
 import tkinter as tk
 from tkinter import messagebox, simpledialog, ttk # ttk追加
-from PIL import Image, ImageTk
 import os
-import json
-import copy # copyモジュールをインポート
+import time
+import functools
+import threading
+from tiled_image_view import TiledImageView
+from spatial_index import GridIndex
+from frame_browser import FrameLoader, ThumbnailStrip
+from variance_map import compute_variance_map
+from region_table import RegionTable
+from image_source import open_image_source
+from image_normalize import oriented_size
+from config_store import ConfigStore, REGIONS_KEY
+from edit_history import EditHistory, SetFieldCommand, AddRegionCommand, DeleteRegionCommand
+from PIL import Image, ImageTk
 
 class RegionEditor:
-    def __init__(self, master, config_path, image_folder_path, main_app_callback):
+    def __init__(self, master, config_store, image_folder_path):
         self.master = master
-        self.config_path = config_path
+        self.config_store = config_store # メインウィンドウと共有する設定 (保存するとメインウィンドウにも通知される)
         self.image_folder_path = image_folder_path
-        self.main_app_callback = main_app_callback # main.pyに設定更新を通知するコールバック
+        # 画像フォルダの代わりにzip/tarファイルが指定された場合は、展開せずにアーカイブから直接読み込む
+        self.image_source = open_image_source(image_folder_path)
 
-        self.current_config = self.load_config()
-        # original_regionsをdeepcopyで完全に独立させる
-        self.original_regions = copy.deepcopy(self.current_config.get("image_regions_and_excel_coords", []))
-        # regions_dataもdeepcopyで完全に独立させる
-        self.regions_data = copy.deepcopy(self.current_config.get("image_regions_and_excel_coords", []))
+        # regions_dataは共有設定から独立した編集用のリスト (RegionTableを経由して作り直すため、deepcopyは不要)
+        # 変更の有無は編集履歴で判定する
+        self.regions_data = RegionTable.from_records(self.config_store.get(REGIONS_KEY, [])).to_records()
 
-        # 複数画像のサポートを削除し、最初の画像のみを扱う
-        self.images = self.load_images()
-        if not self.images:
+        # 画像ファイルの一覧だけを取得し、画像自体は表示・先読みのたびにFrameLoaderが読み込む
+        self.image_files = self.load_images()
+        if not self.image_files:
             messagebox.showerror("エラー", f"画像フォルダ '{self.image_folder_path}' に画像が見つかりません。")
+            self.image_source.close()
+            master.destroy()
+            return
+        self.frame_loader = FrameLoader(self.image_source, self.image_files)
+        # 最初の画像を表示する
+        self.current_index = 0
+        self.current_image_filename = self.image_files[self.current_index]
+        try:
+            self.current_pil_img = self.frame_loader.open_frame(self.current_index)
+            # EXIFの向きを反映したサイズ (領域の座標はこの向きの座標。画像の回転はTiledImageViewがタイルごとに行う)
+            self.current_image_size = oriented_size(self.current_pil_img)
+        except Exception as e:
+            print(f"画像 '{self.current_image_filename}' の読み込み中にエラーが発生しました: {e}")
+            messagebox.showerror("エラー", f"画像 '{self.current_image_filename}' を開けませんでした:\n{e}")
+            self.frame_loader.close()
+            self.image_source.close()
             master.destroy()
             return
-        # 最初の画像のみを使用
-        self.current_pil_img, self.current_image_filename = self.images[0]
 
         # 画像のサイズに合わせて既存の領域をクリッピング
         self._clip_regions_to_image_bounds() # 新規追加
+        # 編集履歴 (クリッピング後の状態を編集開始時点とする)
+        self.history = EditHistory(self.regions_data)
 
-        # オフセットの初期化
+        # オフセットと表示倍率の初期化
         self.offset_x = 0
         self.offset_y = 0
+        self.img_x = self.offset_x
+        self.img_y = self.offset_y
+        self.scale = 1.0 # 表示倍率 (領域の座標は常に元画像のピクセル座標で保持する)
+        self.region_items = [] # 領域ごとのキャンバスアイテムID (draw_regionsで作成)
+        self.region_index = GridIndex() # 領域の矩形 (元画像のピクセル座標) の空間インデックス
+
+        # ばらつき解析 (toggle_heatmapで初回のみ計算し、結果はフォルダ内にキャッシュされる)
+        self.variance_map = None
+        self.heatmap_values = None
+        self.heatmap_overlay = None
+        self.heatmap_photo = None
+        self.heatmap_clip_threshold = 0.35 # 枠上のヒートの平均がこの値以上の領域を強調
+        self._heatmap_thread = None
+        self._heatmap_cancel = threading.Event()
+        self._heatmap_refresh_scheduled = False
+        self.region_font_size = 12
+        self.handle_size = 8
 
         # ウィンドウの初期サイズを設定
         self._set_initial_window_size()
@@ -43,7 +85,10 @@ class RegionEditor:
         # display_imageはsetup_uiの後に呼び出し、キャンバスサイズを取得できるようにする
         # キャンバスが実際に配置されるのを待つ & サイズ確定
         self.canvas.update_idletasks()
+        self._fit_to_window()
         self.display_image()
+        self._update_frame_label()
+        self.frame_loader.prefetch(self.current_index)
 
         self.master.protocol("WM_DELETE_WINDOW", self.on_closing)
 
@@ -52,99 +97,42 @@ class RegionEditor:
         self.drag_start_x = None
         self.drag_start_y = None
         self.drag_mode = None # "move", "resize_corner", "resize_line", "new_region"
-        self.resize_handle_id = None # リサイズ中のハンドルのID
+        self.resize_direction = None # リサイズ中のハンドルの方向 ("nw", "e" など)
 
         self.new_region_rect_id = None # 新規領域作成中の矩形ID
 
+        # ドラッグ描画の間引き用
+        self.drag_frame_interval = 1 / 60 # 描画更新の最小間隔 (秒)
+        self._latest_drag_event = None
+        self._drag_job = None
+        self._last_drag_update = 0.0
+
         # ツールチップ関連の初期化
         self.tooltip_window = None
         self.tooltip_label = None
 
-    def load_config(self):
-        try:
-            with open(self.config_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            messagebox.showwarning("設定読み込み", f"設定ファイル '{self.config_path}' が見つからないか、不正です。")
-            return {}
-
     def load_images(self):
-        supported_extensions = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff')
-        image_files = sorted([f for f in os.listdir(self.image_folder_path) if f.lower().endswith(supported_extensions)])
-
-        images = []
-        if image_files: # 少なくとも1枚の画像があればそれを返す
-            filename = image_files[0]
-            try:
-                path = os.path.join(self.image_folder_path, filename)
-                img = Image.open(path)
-                images.append((img, filename))
-            except Exception as e:
-                print(f"画像 '{filename}' の読み込み中にエラーが発生しました: {e}")
-        return images
+        # 画像ファイル名の一覧を返す (この時点では画像を開かない)
+        return self.image_source.list_images()
 
     def _clip_regions_to_image_bounds(self):
         """
         現在の画像のサイズに合わせて、regions_data内の領域座標をクリッピングする。
         画像からはみ出す領域を画像の境界内に収める。
         """
-        img_width, img_height = self.current_pil_img.size
-        
+        img_width, img_height = self.current_image_size
+
         # ハンドルのサイズや操作性を考慮したマージン
         # ハンドルサイズを8pxとしているので、その半分+α程度のマージン
-        clip_margin = 10 
-
-        updated_regions = []
-        for item in self.regions_data:
-            x1, y1, x2, y2 = item["img_region"]
-
-            # 画像の境界内にクリッピングし、かつクリップマージンを考慮
-            x1 = max(clip_margin, min(x1, img_width - clip_margin))
-            y1 = max(clip_margin, min(y1, img_height - clip_margin))
-            x2 = max(clip_margin, min(x2, img_width - clip_margin))
-            y2 = max(clip_margin, min(y2, img_height - clip_margin))
-
-            # 幅や高さが負にならないように正規化
-            clipped_region = [min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)]
-            
-            # 最小サイズを保証 (クリップマージンより小さくならないように)
-            min_dim = 2 * clip_margin + 1 # 最小幅/高さはマージン2つ分+1px
-            
-            # 領域が小さくなりすぎないように調整
-            if clipped_region[2] - clipped_region[0] < min_dim:
-                # x2 を調整
-                if clipped_region[0] + min_dim <= img_width - clip_margin:
-                    clipped_region[2] = clipped_region[0] + min_dim
-                # x1 を調整
-                elif clipped_region[2] - min_dim >= clip_margin:
-                    clipped_region[0] = clipped_region[2] - min_dim
-                # 両方調整する必要がある場合 (領域が非常に小さく、かつ端にある場合)
-                else:
-                    clipped_region[0] = clip_margin
-                    clipped_region[2] = clip_margin + min_dim
-
-            if clipped_region[3] - clipped_region[1] < min_dim:
-                # y2 を調整
-                if clipped_region[1] + min_dim <= img_height - clip_margin:
-                    clipped_region[3] = clipped_region[1] + min_dim
-                # y1 を調整
-                elif clipped_region[3] - min_dim >= clip_margin:
-                    clipped_region[1] = clipped_region[3] - min_dim
-                # 両方調整する必要がある場合
-                else:
-                    clipped_region[1] = clip_margin
-                    clipped_region[3] = clip_margin + min_dim
+        clip_margin = 10
 
-            updated_item = item.copy()
-            updated_item["img_region"] = clipped_region
-            updated_regions.append(updated_item)
-        
-        self.regions_data = updated_regions
-        self.original_regions = copy.deepcopy(updated_regions) # deepcopyで完全に独立させる
+        # 全領域の座標を配列にまとめて一括でクリッピングする (最小サイズの保証も含む)
+        region_table = RegionTable.from_records(self.regions_data)
+        self.regions_data = region_table.clip_to_bounds(img_width, img_height, clip_margin).to_records()
 
     def _set_initial_window_size(self):
         # 画像の元のサイズ
-        img_width, img_height = self.current_pil_img.size
+        img_width, img_height = self.current_image_size
 
         # 画面の最大サイズを取得
         screen_width = self.master.winfo_screenwidth()
@@ -185,7 +173,29 @@ class RegionEditor:
 
 
     def setup_ui(self):
-        self.master.title("領域確認・変更")
+        self._update_title()
+
+        # 画像切り替え用のナビゲーションとサムネイルストリップ (ウィンドウ下部)
+        browser_frame = tk.Frame(self.master)
+        browser_frame.pack(side="bottom", fill="x")
+        nav_frame = tk.Frame(browser_frame)
+        nav_frame.pack(side="top", fill="x")
+        tk.Button(nav_frame, text="◀ 前の画像", command=lambda: self.show_frame(self.current_index - 1)).pack(side="left", padx=5, pady=2)
+        tk.Button(nav_frame, text="次の画像 ▶", command=lambda: self.show_frame(self.current_index + 1)).pack(side="left", padx=5, pady=2)
+        self.frame_label = tk.Label(nav_frame, anchor="w")
+        self.frame_label.pack(side="left", fill="x", padx=10)
+        # 全画像のばらつき (内容が変化する位置) のヒートマップ表示
+        self.heatmap_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(nav_frame, text="ばらつき表示", variable=self.heatmap_var,
+                       command=self.toggle_heatmap).pack(side="right", padx=5)
+        self.thumbnail_strip = ThumbnailStrip(browser_frame, self.frame_loader, self.show_frame)
+        self.thumbnail_strip.frame.pack(side="top", fill="x")
+        self.master.bind("<Prior>", lambda event: self.show_frame(self.current_index - 1)) # Page Up
+        self.master.bind("<Next>", lambda event: self.show_frame(self.current_index + 1)) # Page Down
+        # 元に戻す・やり直し
+        self.master.bind("<Control-z>", lambda event: self.undo())
+        self.master.bind("<Control-y>", lambda event: self.redo())
+        self.master.bind("<Control-Z>", lambda event: self.redo()) # Ctrl + Shift + Z
         self.canvas = tk.Canvas(self.master, bg="lightgray", cursor="cross")
         self.canvas.pack(fill="both", expand=True, side="left") # キャンバスを左に配置
 
@@ -194,137 +204,397 @@ class RegionEditor:
         self.hbar.pack(side="bottom", fill="x")
         self.vbar = ttk.Scrollbar(self.master, orient="vertical", command=self.canvas.yview)
         self.vbar.pack(side="right", fill="y")
-        self.canvas.config(xscrollcommand=self.hbar.set, yscrollcommand=self.vbar.set)
+        # スクロールのたびに表示範囲のタイルを読み込むため、スクロールコマンドをフックする
+        self.canvas.config(xscrollcommand=self._on_canvas_xscroll, yscrollcommand=self._on_canvas_yscroll)
+
+        # 画像はタイル単位で遅延読み込みする (巨大な画像でもウィンドウをすぐに表示するため)
+        self.image_view = TiledImageView(self.canvas, self.current_pil_img,
+                                         reopen=functools.partial(self.frame_loader.open_lazy_frame, self.current_index),
+                                         levels=self.frame_loader.preview_levels(self.current_index))
+
+        # ズームは zoom_factor ** zoom_step の離散的な倍率で行う (縮小側は画像全体が約256pxになるまで)
+        self.zoom_factor = 1.2
+        self.zoom_step = 0
+        self.max_zoom_step = 12 # 約8.9倍
+        self.min_zoom_step = 0
+        while self.zoom_factor ** self.min_zoom_step * max(self.current_image_size) > 256:
+            self.min_zoom_step -= 1
 
         # イベントバインディング
+        self.canvas.bind("<Configure>", lambda event: self.image_view.schedule_refresh())
         self.canvas.bind("<ButtonPress-1>", self.on_button_press)
         self.canvas.bind("<B1-Motion>", self.on_mouse_drag)
         self.canvas.bind("<ButtonRelease-1>", self.on_button_release)
         self.canvas.bind("<ButtonPress-3>", self.on_right_click) # 右クリック
 
-        # ズーム機能 (Ctrl + マウスホイール)を無効化
-        # self.canvas.bind("<Control-MouseWheel>", self.on_zoom)
+        # ズーム機能 (Ctrl + マウスホイール)
+        self.canvas.bind("<Control-MouseWheel>", self.on_zoom) # Windows/macOS
+        self.canvas.bind("<Control-Button-4>", self.on_zoom) # Linux Scroll up
+        self.canvas.bind("<Control-Button-5>", self.on_zoom) # Linux Scroll down
         # Shift + マウスドラッグでパン (スクロールバーと共存可能だが、主にズーム時に使う想定)
         self.canvas.bind("<Shift-ButtonPress-1>", self.on_pan_start)
         self.canvas.bind("<Shift-B1-Motion>", self.on_pan_drag)
         self.canvas.bind("<Shift-ButtonRelease-1>", self.on_pan_release)
 
-    def display_image(self):
-        self.canvas.delete("all")
+    def _on_canvas_xscroll(self, first, last):
+        self.hbar.set(first, last)
+        self.image_view.schedule_refresh()
+        self._schedule_heatmap_refresh()
+
+    def _on_canvas_yscroll(self, first, last):
+        self.vbar.set(first, last)
+        self.image_view.schedule_refresh()
+        self._schedule_heatmap_refresh()
+
+    # --- ばらつきヒートマップ ---
+
+    def toggle_heatmap(self):
+        if not self.heatmap_var.get():
+            self._refresh_heatmap_overlay()
+            return
+        if self.variance_map is not None:
+            self._refresh_heatmap_overlay()
+            return
+        if self._heatmap_thread is not None:
+            return # 解析中
+
+        # 全画像の縮小デコードと集計はバックグラウンドで行い、進捗はポーリングで表示する
+        self._heatmap_progress = (0, len(self.image_files))
+        self._heatmap_result = None
+        self._heatmap_cancel = threading.Event()
+
+        def worker():
+            try:
+                self._heatmap_result = compute_variance_map(
+                    self.image_source, self.image_files,
+                    progress_callback=lambda done, total: setattr(self, "_heatmap_progress", (done, total)),
+                    cancel_event=self._heatmap_cancel,
+                )
+            except Exception as e:
+                print(f"ばらつき解析中にエラーが発生しました: {e}")
+            finally:
+                self._heatmap_done = True
 
-        if not self.images:
+        self._heatmap_done = False
+        self._heatmap_thread = threading.Thread(target=worker, daemon=True)
+        self._heatmap_thread.start()
+        self._poll_heatmap()
+
+    def _poll_heatmap(self):
+        if self._heatmap_cancel.is_set():
+            return
+        if not self._heatmap_done:
+            done, total = self._heatmap_progress
+            self.frame_label.config(text=f"ばらつき解析中... {done} / {total}")
+            self.master.after(100, self._poll_heatmap)
+            return
+
+        self._heatmap_thread = None
+        self._update_frame_label()
+        self.variance_map = self._heatmap_result
+        if self.variance_map is None:
+            self.heatmap_var.set(False)
+            messagebox.showerror("エラー", "ばらつき解析に失敗しました。")
+            return
+
+        # ヒートを赤色の半透明画像 (縮小グリッドの解像度) にしておき、表示時は見えている範囲だけを拡大する
+        self.heatmap_values = self.variance_map.heat()
+        alpha = (self.heatmap_values * 160).astype("uint8")
+        overlay = Image.new("RGBA", self.variance_map.grid_size, (255, 0, 0, 0))
+        overlay.putalpha(Image.fromarray(alpha))
+        self.heatmap_overlay = overlay
+        self._refresh_heatmap_overlay()
+
+        # 解析中にヒートマップの表示がオフにされた場合は、結果だけを保持して警告しない
+        flagged = self._flagged_regions() if self.heatmap_var.get() else []
+        if flagged:
+            numbers = ", ".join(str(i + 1) for i, _ in flagged)
+            messagebox.showwarning("ばらつき解析",
+                                   f"{self.variance_map.count} 枚の画像を解析しました。\n"
+                                   f"次の領域の枠上で内容が変化しており、はみ出している可能性があります: {numbers}")
+
+    def _flagged_regions(self):
+        if self.variance_map is None:
+            return []
+        scores = self.variance_map.region_clip_scores(
+            [item["img_region"] for item in self.regions_data], heat=self.heatmap_values)
+        return [(i, score) for i, score in enumerate(scores) if score >= self.heatmap_clip_threshold]
+
+    def _schedule_heatmap_refresh(self):
+        if self._heatmap_refresh_scheduled or not self.heatmap_var.get() or self.variance_map is None:
+            return
+        self._heatmap_refresh_scheduled = True
+        self.master.after_idle(self._refresh_heatmap_overlay)
+
+    def _refresh_heatmap_overlay(self):
+        self._heatmap_refresh_scheduled = False
+        self.canvas.delete("heatmap")
+        self.canvas.delete("heatmap_flag")
+        self.heatmap_photo = None
+        if not self.heatmap_var.get() or self.variance_map is None:
+            return
+
+        # 見えている範囲 (キャンバス座標) を基準画像の座標 -> 縮小グリッドの座標に変換して切り出す
+        ref_width, ref_height = self.variance_map.reference_size
+        grid_width, grid_height = self.variance_map.grid_size
+        view_x1 = max(self.canvas.canvasx(0), self.img_x)
+        view_y1 = max(self.canvas.canvasy(0), self.img_y)
+        view_x2 = min(self.canvas.canvasx(self.canvas.winfo_width()), self.img_x + ref_width * self.scale)
+        view_y2 = min(self.canvas.canvasy(self.canvas.winfo_height()), self.img_y + ref_height * self.scale)
+        if view_x2 - view_x1 >= 1 and view_y2 - view_y1 >= 1:
+            to_grid_x = grid_width / ref_width / self.scale
+            to_grid_y = grid_height / ref_height / self.scale
+            box = ((view_x1 - self.img_x) * to_grid_x, (view_y1 - self.img_y) * to_grid_y,
+                   (view_x2 - self.img_x) * to_grid_x, (view_y2 - self.img_y) * to_grid_y)
+            visible_overlay = self.heatmap_overlay.resize(
+                (int(view_x2 - view_x1), int(view_y2 - view_y1)), Image.BILINEAR, box=box)
+            self.heatmap_photo = ImageTk.PhotoImage(visible_overlay)
+            self.canvas.create_image(view_x1, view_y1, image=self.heatmap_photo, anchor="nw", tags="heatmap")
+            # 画像タイルより前面、領域より背面に配置
+            self.canvas.tag_lower("heatmap")
+            self.canvas.tag_lower("image_tile")
+
+        # 枠上で内容が変化している領域を点線で強調
+        for i, score in self._flagged_regions():
+            x1, y1, x2, y2 = self._img_to_canvas_rect(self.regions_data[i]["img_region"])
+            self.canvas.create_rectangle(x1 - 3, y1 - 3, x2 + 3, y2 + 3, outline="magenta", width=2,
+                                         dash=(6, 4), tags="heatmap_flag")
+            self.canvas.create_text(x2 + 4, y1 - 4, text=f"{score:.2f}", anchor="sw", fill="magenta",
+                                    font=("Arial", 9, "bold"), tags="heatmap_flag")
+
+    def _update_title(self):
+        title = f"領域確認・変更 - {self.current_image_filename}"
+        if self.scale != 1.0:
+            title += f" ({self.scale * 100:.0f}%)"
+        if self.history.dirty:
+            title = "* " + title # 未保存の変更あり
+        self.master.title(title)
+
+    def show_frame(self, index):
+        """表示する画像を切り替える。領域はそのまま、同じ表示倍率で重ねて表示する。"""
+        if index == self.current_index or not 0 <= index < len(self.image_files):
+            return
+        try:
+            new_img = self.frame_loader.open_frame(index)
+        except Exception as e:
+            messagebox.showerror("エラー", f"画像 '{self.image_files[index]}' を開けませんでした:\n{e}")
             return
 
-        # 画像を実寸で表示（縮小・拡大なし）
-        display_img_pil = self.current_pil_img # 原寸大のPIL Imageを使用
-        self.tk_img = ImageTk.PhotoImage(display_img_pil)
+        # 旧画像のタイルと読み込みスレッドを破棄し、新しい画像のビューを作成
+        self.image_view.clear()
+        self.image_view.close()
+        self.current_index = index
+        self.current_pil_img = new_img
+        self.current_image_size = oriented_size(new_img)
+        self.current_image_filename = self.image_files[index]
+        self.image_view = TiledImageView(self.canvas, self.current_pil_img, scale=self.scale,
+                                         reopen=functools.partial(self.frame_loader.open_lazy_frame, index),
+                                         levels=self.frame_loader.preview_levels(index))
+
+        self.display_image()
+        self.frame_loader.prefetch(index) # 前後の画像を先読み
+        self.thumbnail_strip.set_current(index)
+        self._update_frame_label()
+        self._update_title()
+
+    def _update_frame_label(self):
+        width, height = self.current_image_size
+        self.frame_label.config(text=f"{self.current_index + 1} / {len(self.image_files)}: "
+                                     f"{self.current_image_filename} ({width}x{height})")
+
+    def display_image(self):
+        if not self.image_files:
+            return
 
+        # 画像は現在の表示倍率で表示。ピクセルの読み込みはTiledImageViewが表示範囲のタイル単位で行う
         # 画像の表示位置を計算 (左上基準とし、オフセットは考慮)
         self.img_x = self.offset_x
         self.img_y = self.offset_y
 
-        self.canvas.create_image(self.img_x, self.img_y, image=self.tk_img, anchor="nw", tags="current_image")
+        self.image_view.refresh()
+        self.draw_regions()
+        self._schedule_heatmap_refresh()
+
+    def _img_to_canvas_rect(self, img_region):
+        # 元画像のピクセル座標 -> キャンバス座標
+        return [self.img_x + img_region[0] * self.scale, self.img_y + img_region[1] * self.scale,
+                self.img_x + img_region[2] * self.scale, self.img_y + img_region[3] * self.scale]
+
+    def _canvas_to_img_rect(self, x1_canvas, y1_canvas, x2_canvas, y2_canvas):
+        # キャンバス座標 -> 元画像のピクセル座標 (正規化して整数に丸める)
+        x1_img = round((x1_canvas - self.img_x) / self.scale)
+        y1_img = round((y1_canvas - self.img_y) / self.scale)
+        x2_img = round((x2_canvas - self.img_x) / self.scale)
+        y2_img = round((y2_canvas - self.img_y) / self.scale)
+        return [min(x1_img, x2_img), min(y1_img, y2_img), max(x1_img, x2_img), max(y1_img, y2_img)]
+
+    def _fit_to_window(self):
+        """
+        画像全体がキャンバスに収まる表示倍率で開く (元画像の方が小さい場合は等倍)。
+        JPEGは縮小した解像度でデコードした段から表示されるため、元画像の解像度でのデコードは拡大したときだけ行われる。
+        """
+        canvas_width = self.canvas.winfo_width()
+        canvas_height = self.canvas.winfo_height()
+        if canvas_width <= 1 or canvas_height <= 1:
+            # キャンバスがまだ配置されていない場合は画面のサイズを使う
+            canvas_width = self.master.winfo_screenwidth()
+            canvas_height = self.master.winfo_screenheight()
+        img_width, img_height = self.current_image_size
+        zoom_step = 0
+        while zoom_step > self.min_zoom_step and (self.zoom_factor ** zoom_step * img_width > canvas_width or
+                                                  self.zoom_factor ** zoom_step * img_height > canvas_height):
+            zoom_step -= 1
+        self.zoom_step = zoom_step
+        self.scale = self.zoom_factor ** zoom_step
+        self.image_view.set_scale(self.scale)
+        self._update_title()
+
+    def on_zoom(self, event):
+        # Linuxでは Button-4 が拡大、Button-5 が縮小
+        zoom_in = event.num == 4 or event.delta > 0
+        new_zoom_step = self.zoom_step + (1 if zoom_in else -1)
+        new_zoom_step = max(self.min_zoom_step, min(self.max_zoom_step, new_zoom_step))
+        if new_zoom_step == self.zoom_step:
+            return
 
-        # スクロール領域を画像の実寸サイズに合わせて設定
-        self.canvas.config(scrollregion=(0, 0, self.current_pil_img.width, self.current_pil_img.height))
+        # マウスカーソル下の画像座標を記録し、ズーム後も同じ位置がカーソル下に来るようにする
+        cursor_canvas_x = self.canvas.canvasx(event.x)
+        cursor_canvas_y = self.canvas.canvasy(event.y)
+        cursor_img_x = (cursor_canvas_x - self.img_x) / self.scale
+        cursor_img_y = (cursor_canvas_y - self.img_y) / self.scale
 
-        self.draw_regions()
+        self.zoom_step = new_zoom_step
+        self.scale = self.zoom_factor ** self.zoom_step
+        self.image_view.set_scale(self.scale)
+
+        display_width = self.image_view.display_width
+        display_height = self.image_view.display_height
+        self.canvas.xview_moveto(max(0, self.img_x + cursor_img_x * self.scale - event.x) / display_width)
+        self.canvas.yview_moveto(max(0, self.img_y + cursor_img_y * self.scale - event.y) / display_height)
+
+        self.display_image()
+        self._update_title()
 
     def draw_regions(self):
-        self.canvas.delete("region_rect") # 既存の領域を削除
+        self.canvas.delete("region_rect") # 既存の領域 (矩形・テキスト・テキスト背景) を削除
         self.canvas.delete("handle")      # 既存のハンドルを削除
-        self.canvas.delete("region_text_bg") # 既存のテキスト背景を削除
-        self.canvas.delete("region_text") # 既存のテキストを削除
-
-        # 領域の描画は画像ピクセル座標とCanvas座標を一致させる（オフセットのみ考慮）
-        for i, item in enumerate(self.regions_data):
-            img_region = item["img_region"]
-
-            # 画像座標をキャンバス座標に変換 (オフセットのみ考慮)
-            x1_canvas = self.img_x + img_region[0]
-            y1_canvas = self.img_y + img_region[1]
-            x2_canvas = self.img_x + img_region[2]
-            y2_canvas = self.img_y + img_region[3]
-
-            # 矩形を描画
-            self.canvas.create_rectangle(
-                x1_canvas, y1_canvas, x2_canvas, y2_canvas,
-                outline="blue", width=2, tags=("region_rect", f"region_{i}")
-            )
-            # ハンドルとテキストは別の関数で描画
-            self.draw_handles_and_text_for_region(i)
 
+        # 領域ごとのキャンバスアイテムIDを保持し、ドラッグ中は再生成せずに座標だけを更新する
+        self.region_items = [self._create_region_items(i) for i in range(len(self.regions_data))]
+        self.region_index.rebuild((i, item["img_region"]) for i, item in enumerate(self.regions_data))
 
-    def draw_handles_and_text_for_region(self, i):
-        item = self.regions_data[i]
-        img_region = item["img_region"]
+    def _hit_test(self, canvas_x, canvas_y, include_interior=False):
+        """
+        キャンバス座標の点にある領域とハンドルを、空間インデックスで求める。
+        後から描画された (前面にある) 領域を優先し、各領域ではハンドル -> 枠線・番号 の順に判定する。
+        include_interior=True の場合は矩形の内側も領域とみなす。
 
-        # 画像座標をキャンバス座標に変換 (オフセットのみ考慮)
-        x1_canvas = self.img_x + img_region[0]
-        y1_canvas = self.img_y + img_region[1]
-        x2_canvas = self.img_x + img_region[2]
-        y2_canvas = self.img_y + img_region[3]
+        Returns:
+            tuple: (領域インデックス, ハンドルの方向 "nw" など。枠線・内側の場合はNone)。該当なしは (None, None)。
+        """
+        img_x = (canvas_x - self.img_x) / self.scale
+        img_y = (canvas_y - self.img_y) / self.scale
+        # ハンドルと枠線の判定幅はキャンバス上のピクセル数で決め、画像座標に換算する
+        handle_tolerance = (self.handle_size / 2 + 1) / self.scale
+        edge_tolerance = 4 / self.scale
+
+        candidates = self.region_index.query_point(img_x, img_y, margin=max(handle_tolerance, edge_tolerance))
+        for i in sorted(candidates, reverse=True):
+            x1, y1, x2, y2 = self.regions_data[i]["img_region"]
+            center_x = (x1 + x2) / 2
+            center_y = (y1 + y2) / 2
+            handle_centers = {
+                "nw": (x1, y1), "ne": (x2, y1), "sw": (x1, y2), "se": (x2, y2),
+                "w": (x1, center_y), "e": (x2, center_y), "n": (center_x, y1), "s": (center_x, y2),
+            }
+            for direction, (hx, hy) in handle_centers.items():
+                if abs(img_x - hx) <= handle_tolerance and abs(img_y - hy) <= handle_tolerance:
+                    return i, None if include_interior else direction
+
+            inside = x1 <= img_x <= x2 and y1 <= img_y <= y2
+            near_edge = (min(abs(img_x - x1), abs(img_x - x2)) <= edge_tolerance or
+                         min(abs(img_y - y1), abs(img_y - y2)) <= edge_tolerance)
+            # 番号ラベルの上も領域の一部として扱う
+            label_half_width = (len(str(i + 1)) * 8 + 4) / 2 / self.scale
+            label_half_height = (self.region_font_size + 4) / 2 / self.scale
+            on_label = abs(img_x - center_x) <= label_half_width and abs(img_y - center_y) <= label_half_height
+            if near_edge or on_label or (include_interior and inside):
+                return i, None
+        return None, None
+
+    def _create_region_items(self, i):
+        """
+        領域 i の矩形・番号テキスト・リサイズハンドルを作成する。
+        全てのアイテムに共通のタグ group_{i} を付け、移動時は1回の canvas.move で済むようにする。
 
-        center_x = (x1_canvas + x2_canvas) / 2
-        center_y = (y1_canvas + y2_canvas) / 2
+        Returns:
+            dict: パーツ名 ("rect", "text_bg", "text", "nw", ..., "s") -> キャンバスアイテムID
+        """
+        group_tag = f"group_{i}"
+        items = {}
 
-        # 領域番号のテキストと背景のサイズを計算
-        text_content = str(i + 1)
-        font_size = 12
-        # フォントメトリクスを正確に取得するのはTkinterでは少し手間だが、ここでは固定値を仮定
-        # 大体の文字幅と高さを予測
-        # 例: 1文字あたり約10-12px幅、15-18px高さ
-        text_width_approx = len(text_content) * 8 + 4 # 文字数*平均文字幅 + 左右のパディング
-        text_height_approx = font_size + 4 # フォントサイズ + 上下のパディング
+        # 矩形を描画 (座標は _layout_region_items で設定)
+        items["rect"] = self.canvas.create_rectangle(
+            0, 0, 0, 0, outline="blue", width=2, tags=("region_rect", f"region_{i}", group_tag)
+        )
 
         # テキスト背景用の矩形を描画
-        self.canvas.create_rectangle(
-            center_x - text_width_approx / 2,
-            center_y - text_height_approx / 2,
-            center_x + text_width_approx / 2,
-            center_y + text_height_approx / 2,
+        items["text_bg"] = self.canvas.create_rectangle(
+            0, 0, 0, 0,
             fill="black",
             outline="black", # 枠線も黒で背景と一体化
-            tags=("region_rect", "region_text_bg", f"region_text_bg_{i}")
+            tags=("region_rect", "region_text_bg", f"region_text_bg_{i}", group_tag)
         )
 
         # 領域番号を表示
-        self.canvas.create_text(
-            center_x, center_y, text=text_content, fill="white",
-            font=("Arial", font_size, "bold"), tags=("region_rect", f"region_text_{i}")
+        items["text"] = self.canvas.create_text(
+            0, 0, text=str(i + 1), fill="white",
+            font=("Arial", self.region_font_size, "bold"), tags=("region_rect", f"region_text_{i}", group_tag)
         )
 
-        # リサイズハンドルを描画
-        handle_size = 8
-        # Corners
-        self.canvas.create_rectangle(x1_canvas - handle_size/2, y1_canvas - handle_size/2,
-                                    x1_canvas + handle_size/2, y1_canvas + handle_size/2,
-                                    fill="red", outline="white", tags=("handle", f"handle_corner_{i}_nw"))
-        self.canvas.create_rectangle(x2_canvas - handle_size/2, y1_canvas - handle_size/2,
-                                    x2_canvas + handle_size/2, y1_canvas + handle_size/2,
-                                    fill="red", outline="white", tags=("handle", f"handle_corner_{i}_ne"))
-        self.canvas.create_rectangle(x1_canvas - handle_size/2, y2_canvas - handle_size/2,
-                                    x1_canvas + handle_size/2, y2_canvas + handle_size/2,
-                                    fill="red", outline="white", tags=("handle", f"handle_corner_{i}_sw"))
-        self.canvas.create_rectangle(x2_canvas - handle_size/2, y2_canvas - handle_size/2,
-                                    x2_canvas + handle_size/2, y2_canvas + handle_size/2,
-                                    fill="red", outline="white", tags=("handle", f"handle_corner_{i}_se"))
-        # Midpoints for lines
-        self.canvas.create_rectangle(x1_canvas - handle_size/2, center_y - handle_size/2,
-                                    x1_canvas + handle_size/2, center_y + handle_size/2,
-                                    fill="green", outline="white", tags=("handle", f"handle_line_{i}_w"))
-        self.canvas.create_rectangle(x2_canvas - handle_size/2, center_y - handle_size/2,
-                                    x2_canvas + handle_size/2, center_y + handle_size/2,
-                                    fill="green", outline="white", tags=("handle", f"handle_line_{i}_e"))
-        self.canvas.create_rectangle(center_x - handle_size/2, y1_canvas - handle_size/2,
-                                    center_x + handle_size/2, y1_canvas + handle_size/2,
-                                    fill="green", outline="white", tags=("handle", f"handle_line_{i}_n"))
-        self.canvas.create_rectangle(center_x - handle_size/2, y2_canvas - handle_size/2,
-                                    center_x + handle_size/2, y2_canvas + handle_size/2,
-                                    fill="green", outline="white", tags=("handle", f"handle_line_{i}_s"))
-
-
-    # on_zoomメソッドは無効化 (削除済み)
+        # リサイズハンドルを描画 (Corners: 赤, Midpoints for lines: 緑)
+        for direction in ("nw", "ne", "sw", "se"):
+            items[direction] = self.canvas.create_rectangle(
+                0, 0, 0, 0, fill="red", outline="white", tags=("handle", f"handle_corner_{i}_{direction}", group_tag)
+            )
+        for direction in ("w", "e", "n", "s"):
+            items[direction] = self.canvas.create_rectangle(
+                0, 0, 0, 0, fill="green", outline="white", tags=("handle", f"handle_line_{i}_{direction}", group_tag)
+            )
+
+        self._layout_region_items(i, items, self._img_to_canvas_rect(self.regions_data[i]["img_region"]))
+        return items
+
+    def _layout_region_items(self, i, items, canvas_rect):
+        """領域 i のアイテムを、与えられたキャンバス座標の矩形に合わせてその場で再配置する。"""
+        x1_canvas, y1_canvas, x2_canvas, y2_canvas = canvas_rect
+        center_x = (x1_canvas + x2_canvas) / 2
+        center_y = (y1_canvas + y2_canvas) / 2
+
+        self.canvas.coords(items["rect"], x1_canvas, y1_canvas, x2_canvas, y2_canvas)
+
+        # 領域番号のテキストと背景のサイズを計算
+        # フォントメトリクスを正確に取得するのはTkinterでは少し手間だが、ここでは固定値を仮定
+        # 大体の文字幅と高さを予測
+        # 例: 1文字あたり約10-12px幅、15-18px高さ
+        text_width_approx = len(str(i + 1)) * 8 + 4 # 文字数*平均文字幅 + 左右のパディング
+        text_height_approx = self.region_font_size + 4 # フォントサイズ + 上下のパディング
+        self.canvas.coords(items["text_bg"],
+                           center_x - text_width_approx / 2, center_y - text_height_approx / 2,
+                           center_x + text_width_approx / 2, center_y + text_height_approx / 2)
+        self.canvas.coords(items["text"], center_x, center_y)
+
+        # リサイズハンドル
+        half = self.handle_size / 2
+        handle_centers = {
+            "nw": (x1_canvas, y1_canvas), "ne": (x2_canvas, y1_canvas),
+            "sw": (x1_canvas, y2_canvas), "se": (x2_canvas, y2_canvas),
+            "w": (x1_canvas, center_y), "e": (x2_canvas, center_y),
+            "n": (center_x, y1_canvas), "s": (center_x, y2_canvas),
+        }
+        for direction, (hx, hy) in handle_centers.items():
+            self.canvas.coords(items[direction], hx - half, hy - half, hx + half, hy + half)
+
 
     def on_pan_start(self, event):
         self.pan_start_x = self.canvas.canvasx(event.x) # キャンバス座標に変換
@@ -384,39 +654,31 @@ class RegionEditor:
         self.selected_region_id = None # クリック時に一旦選択を解除
         self.hide_tooltip() # 新しい操作開始時にツールチップを非表示にする
 
-        # クリックされたアイテムのタグを確認
-        item_id = self.canvas.find_closest(self.drag_start_x, self.drag_start_y)[0]
-        tags = self.canvas.gettags(item_id)
-
-        found_region_tag = None
-        for tag in tags:
-            # region_{i} の形式のタグを探す。ただし "region_rect" や "region_text_{i}" は除外する
-            if tag.startswith("region_") and tag != "region_rect" and not tag.startswith("region_text_"):
-                found_region_tag = tag
-                break
+        # クリック位置の領域・ハンドルを空間インデックスで判定
+        region_idx, handle_direction = self._hit_test(self.drag_start_x, self.drag_start_y)
 
-        if found_region_tag:
-            self.selected_region_id = int(found_region_tag.split('_')[1])
+        if region_idx is not None and handle_direction is None:
+            self.selected_region_id = region_idx
             self.drag_mode = "move"
             # 枠のクリックで緑色に
-            self.canvas.itemconfig(f"region_{self.selected_region_id}", outline="green")
-            # 移動開始時にツールチップを表示
+            self.canvas.itemconfig(self.region_items[self.selected_region_id]["rect"], outline="green")
+            # 移動量はドラッグ開始位置からの累積で計算し、倍率に関わらず画像座標を整数に保つ
             current_region_coords = self.regions_data[self.selected_region_id]["img_region"]
+            self.drag_origin_region = list(current_region_coords)
+            self.drag_press_x = self.drag_start_x
+            self.drag_press_y = self.drag_start_y
+            # 移動開始時にツールチップを表示
             self.show_tooltip(event.x, event.y, "移動中" + self._format_coords_for_tooltip(current_region_coords))
-        elif "handle" in tags:
-            # ハンドルがクリックされた場合 (リサイズまたは色変更)
-            for tag in tags:
-                if tag.startswith("handle_corner_") or tag.startswith("handle_line_"):
-                    parts = tag.split('_')
-                    self.selected_region_id = int(parts[2]) # region index
-                    self.resize_handle_id = tag # 例: handle_corner_0_nw
-                    self.drag_mode = "resize"
-                    # 角のクリックで赤色に
-                    self.canvas.itemconfig(f"region_{self.selected_region_id}", outline="red")
-                    # リサイズ開始時にツールチップを表示
-                    current_region_coords = self.regions_data[self.selected_region_id]["img_region"]
-                    self.show_tooltip(event.x, event.y, "リサイズ中" + self._format_coords_for_tooltip(current_region_coords))
-                    break
+        elif region_idx is not None:
+            # ハンドルがクリックされた場合 (リサイズ)
+            self.selected_region_id = region_idx
+            self.resize_direction = handle_direction # 例: "nw", "e"
+            self.drag_mode = "resize"
+            # 角のクリックで赤色に
+            self.canvas.itemconfig(self.region_items[self.selected_region_id]["rect"], outline="red")
+            # リサイズ開始時にツールチップを表示
+            current_region_coords = self.regions_data[self.selected_region_id]["img_region"]
+            self.show_tooltip(event.x, event.y, "リサイズ中" + self._format_coords_for_tooltip(current_region_coords))
         else:
             # 何もクリックされていない場合 (新規領域作成の可能性)
             self.drag_mode = "new_region_potential"
@@ -424,35 +686,55 @@ class RegionEditor:
             # ここではツールチップを表示しない。ドラッグが20px以上になったら表示
 
     def on_mouse_drag(self, event):
+        # モーションイベントを間引き、描画の更新は1フレーム (約16ms) に最大1回とする
+        self._latest_drag_event = event
+        if self._drag_job is not None:
+            return # 予約済みの更新で最新のイベントがまとめて処理される
+        elapsed = time.perf_counter() - self._last_drag_update
+        delay_ms = int((self.drag_frame_interval - elapsed) * 1000)
+        if delay_ms <= 0:
+            self._process_drag()
+        else:
+            self._drag_job = self.master.after(delay_ms, self._process_drag)
+
+    def _flush_drag(self):
+        # 予約中のドラッグ更新があれば即座に反映する (ボタンリリース時など)
+        if self._drag_job is not None:
+            self.master.after_cancel(self._drag_job)
+            self._drag_job = None
+        self._process_drag()
+
+    def _process_drag(self):
+        self._drag_job = None
+        event = self._latest_drag_event
+        if event is None:
+            return
+        self._latest_drag_event = None
+        self._last_drag_update = time.perf_counter()
+        self._apply_drag(event)
+
+    def _apply_drag(self, event):
         current_canvas_x = self.canvas.canvasx(event.x)
         current_canvas_y = self.canvas.canvasy(event.y)
         tooltip_text = ""
         current_region_coords = None
 
         if self.selected_region_id is not None and self.drag_mode == "move":
-            # 領域の移動
-            dx = current_canvas_x - self.drag_start_x
-            dy = current_canvas_y - self.drag_start_y
-
-            # Canvas上の矩形、テキスト、ハンドルを移動
-            self.canvas.move(f"region_{self.selected_region_id}", dx, dy)
-            self.canvas.move(f"region_text_bg_{self.selected_region_id}", dx, dy) # 背景も移動
-            self.canvas.move(f"region_text_{self.selected_region_id}", dx, dy)
-            self.canvas.move(f"handle_corner_{self.selected_region_id}_nw", dx, dy)
-            self.canvas.move(f"handle_corner_{self.selected_region_id}_ne", dx, dy)
-            self.canvas.move(f"handle_corner_{self.selected_region_id}_sw", dx, dy)
-            self.canvas.move(f"handle_corner_{self.selected_region_id}_se", dx, dy)
-            self.canvas.move(f"handle_line_{self.selected_region_id}_w", dx, dy)
-            self.canvas.move(f"handle_line_{self.selected_region_id}_e", dx, dy)
-            self.canvas.move(f"handle_line_{self.selected_region_id}_n", dx, dy)
-            self.canvas.move(f"handle_line_{self.selected_region_id}_s", dx, dy)
-
-            # 内部データを更新 (画像ピクセル座標はCanvas座標と一致するので、そのままdx, dyを加算)
+            # 領域の移動 (画像座標での移動量を整数に丸め、その分だけキャンバス上のアイテムを動かす)
             region_item = self.regions_data[self.selected_region_id]
-            region_item["img_region"][0] += dx
-            region_item["img_region"][1] += dy
-            region_item["img_region"][2] += dx
-            region_item["img_region"][3] += dy
+            img_dx = round((current_canvas_x - self.drag_press_x) / self.scale)
+            img_dy = round((current_canvas_y - self.drag_press_y) / self.scale)
+            new_region = [self.drag_origin_region[0] + img_dx, self.drag_origin_region[1] + img_dy,
+                          self.drag_origin_region[2] + img_dx, self.drag_origin_region[3] + img_dy]
+            dx = (new_region[0] - region_item["img_region"][0]) * self.scale
+            dy = (new_region[1] - region_item["img_region"][1]) * self.scale
+
+            # Canvas上の矩形、テキスト、ハンドルをグループタグでまとめて移動
+            if dx or dy:
+                self.canvas.move(f"group_{self.selected_region_id}", dx, dy)
+
+            # 内部データを更新 (元画像のピクセル座標)
+            region_item["img_region"] = new_region
 
             self.drag_start_x = current_canvas_x # drag_startを更新して次の移動量計算に備える
             self.drag_start_y = current_canvas_y
@@ -463,40 +745,24 @@ class RegionEditor:
 
         elif self.selected_region_id is not None and self.drag_mode == "resize":
             # 領域のリサイズ
-            current_rect_coords_canvas = list(self.canvas.coords(f"region_{self.selected_region_id}"))
-            handle_tag = self.resize_handle_id
-
-            if handle_tag.endswith("_nw"):
-                current_rect_coords_canvas[0], current_rect_coords_canvas[1] = current_canvas_x, current_canvas_y
-            elif handle_tag.endswith("_ne"):
-                current_rect_coords_canvas[2], current_rect_coords_canvas[1] = current_canvas_x, current_canvas_y
-            elif handle_tag.endswith("_sw"):
-                current_rect_coords_canvas[0], current_rect_coords_canvas[3] = current_canvas_x, current_canvas_y
-            elif handle_tag.endswith("_se"):
-                current_rect_coords_canvas[2], current_rect_coords_canvas[3] = current_canvas_x, current_canvas_y
-            elif handle_tag.endswith("_w"):
+            items = self.region_items[self.selected_region_id]
+            current_rect_coords_canvas = list(self.canvas.coords(items["rect"]))
+            direction = self.resize_direction
+
+            if "w" in direction:
                 current_rect_coords_canvas[0] = current_canvas_x
-            elif handle_tag.endswith("_e"):
+            if "e" in direction:
                 current_rect_coords_canvas[2] = current_canvas_x
-            elif handle_tag.endswith("_n"):
+            if "n" in direction:
                 current_rect_coords_canvas[1] = current_canvas_y
-            elif handle_tag.endswith("_s"):
+            if "s" in direction:
                 current_rect_coords_canvas[3] = current_canvas_y
 
-            self.canvas.coords(f"region_{self.selected_region_id}", *current_rect_coords_canvas)
-
-            # リサイズ中はテキストとハンドルを再描画
-            self.canvas.delete(f"region_text_bg_{self.selected_region_id}") # 背景も削除
-            self.canvas.delete(f"region_text_{self.selected_region_id}")
-            self.canvas.delete("handle")
-            self.draw_handles_and_text_for_region(self.selected_region_id)
+            # リサイズ中はテキストとハンドルを作り直さず、座標だけを更新する
+            self._layout_region_items(self.selected_region_id, items, current_rect_coords_canvas)
 
-            # 画像座標はCanvas座標と一致するので、そのまま取得
-            x1_img = (current_rect_coords_canvas[0] - self.img_x)
-            y1_img = (current_rect_coords_canvas[1] - self.img_y)
-            x2_img = (current_rect_coords_canvas[2] - self.img_x)
-            y2_img = (current_rect_coords_canvas[3] - self.img_y)
-            current_region_coords = [min(x1_img, x2_img), min(y1_img, y2_img), max(x1_img, x2_img), max(y1_img, y2_img)]
+            # キャンバス座標から元画像のピクセル座標に変換
+            current_region_coords = self._canvas_to_img_rect(*current_rect_coords_canvas)
 
             tooltip_text = "リサイズ中"
 
@@ -512,12 +778,8 @@ class RegionEditor:
                     outline="orange", width=2, tags="new_region_temp"
                 )
                 tooltip_text = "新規追加中"
-                # 新規領域の画像座標 (Canvas座標と一致)
-                x1_img = (self.drag_start_x - self.img_x)
-                y1_img = (self.drag_start_y - self.img_y)
-                x2_img = (current_canvas_x - self.img_x)
-                y2_img = (current_canvas_y - self.img_y)
-                current_region_coords = [min(x1_img, x2_img), min(y1_img, y2_img), max(x1_img, x2_img), max(y1_img, y2_img)]
+                # 新規領域の画像座標
+                current_region_coords = self._canvas_to_img_rect(self.drag_start_x, self.drag_start_y, current_canvas_x, current_canvas_y)
                 # 新規追加の初回ドラッグでツールチップを表示
                 self.show_tooltip(event.x, event.y, tooltip_text + self._format_coords_for_tooltip(current_region_coords))
             else:
@@ -528,12 +790,8 @@ class RegionEditor:
             # 仮の矩形を更新
             self.canvas.coords(self.new_region_rect_id, self.drag_start_x, self.drag_start_y, current_canvas_x, current_canvas_y)
             tooltip_text = "新規追加中"
-            # 新規領域の画像座標 (Canvas座標と一致)
-            x1_img = (self.drag_start_x - self.img_x)
-            y1_img = (self.drag_start_y - self.img_y)
-            x2_img = (current_canvas_x - self.img_x)
-            y2_img = (current_canvas_y - self.img_y)
-            current_region_coords = [min(x1_img, x2_img), min(y1_img, y2_img), max(x1_img, x2_img), max(y1_img, y2_img)]
+            # 新規領域の画像座標
+            current_region_coords = self._canvas_to_img_rect(self.drag_start_x, self.drag_start_y, current_canvas_x, current_canvas_y)
             # 新規追加の継続ドラッグでツールチップを更新
             self.update_tooltip(event.x, event.y, tooltip_text + self._format_coords_for_tooltip(current_region_coords))
             return # このパスでは下部のif文は実行しない
@@ -543,23 +801,27 @@ class RegionEditor:
 
 
     def on_button_release(self, event):
+        self._flush_drag() # 間引かれて未反映のドラッグ位置を反映
         self.hide_tooltip() # リリース時にツールチップを非表示にする
 
-        if self.drag_mode == "resize" and self.selected_region_id is not None:
+        if self.drag_mode == "move" and self.selected_region_id is not None:
+            # 移動後の矩形を空間インデックスに反映
+            moved_region = self.regions_data[self.selected_region_id]["img_region"]
+            self.region_index.update(self.selected_region_id, moved_region)
+            # ドラッグ中に書き換え済みの移動を、移動前後の座標だけで履歴に記録
+            self.history.record(SetFieldCommand(self.selected_region_id, "img_region", self.drag_origin_region, moved_region))
+
+        elif self.drag_mode == "resize" and self.selected_region_id is not None:
             # リサイズ後の内部データを更新
-            current_coords_canvas = self.canvas.coords(f"region_{self.selected_region_id}")
-            # キャンバス座標から画像ピクセルに逆変換（ここではそのまま）
-            x1_img = (current_coords_canvas[0] - self.img_x)
-            y1_img = (current_coords_canvas[1] - self.img_y)
-            x2_img = (current_coords_canvas[2] - self.img_x)
-            y2_img = (current_coords_canvas[3] - self.img_y)
-
-            # 負のサイズにならないように正規化し、整数に変換
-            self.regions_data[self.selected_region_id]["img_region"] = [
-                int(min(x1_img, x2_img)), int(min(y1_img, y2_img)),
-                int(max(x1_img, x2_img)), int(max(y1_img, y2_img))
-            ]
-            self.draw_regions() # ハンドルとテキストの位置を更新するために再描画
+            items = self.region_items[self.selected_region_id]
+            current_coords_canvas = self.canvas.coords(items["rect"])
+            # キャンバス座標から画像ピクセルに逆変換し、負のサイズにならないように正規化して整数に変換
+            img_region = self._canvas_to_img_rect(*current_coords_canvas)
+            self.history.execute(SetFieldCommand(self.selected_region_id, "img_region",
+                                                 self.regions_data[self.selected_region_id]["img_region"], img_region))
+            self.region_index.update(self.selected_region_id, img_region)
+            # 正規化後の座標にハンドルとテキストの位置を合わせる
+            self._layout_region_items(self.selected_region_id, items, self._img_to_canvas_rect(img_region))
 
         elif self.drag_mode == "new_region":
             # 新規領域の確定
@@ -567,60 +829,41 @@ class RegionEditor:
                 coords = self.canvas.coords(self.new_region_rect_id)
                 self.canvas.delete(self.new_region_rect_id) # 仮の矩形を削除
 
-                # キャンバス座標から画像ピクセルに逆変換（ここではそのまま）
-                x1_img = (coords[0] - self.img_x)
-                y1_img = (coords[1] - self.img_y)
-                x2_img = (coords[2] - self.img_x)
-                y2_img = (coords[3] - self.img_y)
+                # キャンバス座標から画像ピクセルに逆変換し、整数に変換
+                img_region = self._canvas_to_img_rect(*coords)
 
-                # サイズが0でないことを確認し、整数に変換
-                if abs(x2_img - x1_img) > 1 and abs(y2_img - y1_img) > 1:
+                # サイズが0でないことを確認
+                if img_region[2] - img_region[0] > 1 and img_region[3] - img_region[1] > 1:
                     new_region = {
-                        "img_region": [int(min(x1_img, x2_img)), int(min(y1_img, y2_img)),
-                                       int(max(x1_img, x2_img)), int(max(y1_img, y2_img))], # ここを修正
+                        "img_region": img_region,
                         "excel_pos": "A1" # デフォルト値を設定、後で変更可能にする
                     }
-                    self.regions_data.append(new_region)
-                    self.draw_regions() # 新しい領域を描画
+                    self.history.execute(AddRegionCommand(len(self.regions_data), new_region))
+                    self.region_index.insert(len(self.regions_data) - 1, img_region)
+                    self.region_items.append(self._create_region_items(len(self.regions_data) - 1)) # 新しい領域だけを描画
                 else:
                     messagebox.showwarning("新規領域作成", "領域のサイズが小さすぎます。20ピクセル以上のドラッグが必要です。")
 
 
+        # 選択中だった矩形の色を青に戻す (リリース時に選択状態を解除)
+        if self.selected_region_id is not None and self.selected_region_id < len(self.region_items):
+            self.canvas.itemconfig(self.region_items[self.selected_region_id]["rect"], outline="blue")
+
         self.drag_mode = None
-        self.resize_handle_id = None
+        self.resize_direction = None
         self.new_region_rect_id = None
-        self.selected_region_id = None # ドラッグ終了時に選択を解除し、色をリセット
-
-        # 全ての矩形の色を青に戻す (リリース時に選択状態を解除)
-        for i in range(len(self.regions_data)):
-            self.canvas.itemconfig(f"region_{i}", outline="blue")
+        self.selected_region_id = None # ドラッグ終了時に選択を解除
+        self._schedule_heatmap_refresh() # 編集後の領域で枠上のばらつきを判定し直す
+        self._update_title()
 
 
     def on_right_click(self, event):
-        item_id = self.canvas.find_closest(event.x, event.y)[0]
-        tags = self.canvas.gettags(item_id)
-
-        region_idx = None
-        # クリックされたのが領域自体またはハンドルの場合、その領域のインデックスを取得
-        for tag in tags:
-            if tag.startswith("region_") and tag != "region_rect" and not tag.startswith("region_text_bg_") and not tag.startswith("region_text_"):
-                # region_X のX部分を取得
-                try:
-                    region_idx = int(tag.split('_')[1])
-                except ValueError:
-                    continue
-                break
-            elif tag.startswith("handle_corner_") or tag.startswith("handle_line_"):
-                # handle_type_X_direction のX部分を取得
-                try:
-                    region_idx = int(tag.split('_')[2])
-                except ValueError:
-                    continue
-                break
+        # クリックされたのが領域の枠・内側またはハンドルの場合、その領域のインデックスを取得
+        region_idx, _ = self._hit_test(self.canvas.canvasx(event.x), self.canvas.canvasy(event.y), include_interior=True)
 
         if region_idx is not None:
             self.selected_region_id = region_idx # 右クリックされた領域を選択状態にする
-            self.show_context_menu(event.x, event.y, region_idx)
+            self.show_context_menu(event.x_root, event.y_root, region_idx) # メニューはスクリーン座標で表示
         else:
             # どこでもない場所で右クリックした場合は、メニューを表示しない
             pass
@@ -633,8 +876,10 @@ class RegionEditor:
 
     def delete_region(self, region_idx):
         if messagebox.askyesno("確認", f"領域 {region_idx + 1} を削除しますか？"):
-            del self.regions_data[region_idx]
-            self.draw_regions() # 領域を再描画して更新を反映
+            self.history.execute(DeleteRegionCommand(region_idx, self.regions_data[region_idx]))
+            self.draw_regions() # 領域を再描画して更新を反映 (インデックスがずれるため空間インデックスも作り直す)
+            self._schedule_heatmap_refresh()
+            self._update_title()
 
     def change_excel_pos(self, region_idx):
         current_pos = self.regions_data[region_idx]["excel_pos"]
@@ -642,32 +887,54 @@ class RegionEditor:
                                          f"領域 {region_idx + 1} のExcelセル座標を入力してください:",
                                          initialvalue=current_pos)
         if new_pos:
-            self.regions_data[region_idx]["excel_pos"] = new_pos
+            self.history.execute(SetFieldCommand(region_idx, "excel_pos", current_pos, new_pos))
             messagebox.showinfo("更新", f"領域 {region_idx + 1} のExcelセル座標を '{new_pos}' に変更しました。")
             # 画面には直接影響しないが、内部データが更新されたことを確認
+            self._update_title()
+
+    def undo(self):
+        if self.drag_mode is not None:
+            return # ドラッグ中は履歴を操作しない
+        self._refresh_after_history_change(self.history.undo())
+
+    def redo(self):
+        if self.drag_mode is not None:
+            return
+        self._refresh_after_history_change(self.history.redo())
+
+    def _refresh_after_history_change(self, command):
+        """元に戻す・やり直しで変更された領域だけを再描画する。"""
+        if command is None:
+            return
+        if command.structural:
+            # 追加・削除はインデックスがずれるため全体を描画し直す
+            self.draw_regions()
+        elif command.key == "img_region":
+            img_region = self.regions_data[command.index]["img_region"]
+            self._layout_region_items(command.index, self.region_items[command.index], self._img_to_canvas_rect(img_region))
+            self.region_index.update(command.index, img_region)
+        self._schedule_heatmap_refresh()
+        self._update_title()
 
     def on_closing(self):
         print("--- on_closing called ---")
-        print(f"regions_data (current): {self.regions_data}")
-        print(f"original_regions (initial): {self.original_regions}")
-        print(f"Are they different? {self.regions_data != self.original_regions}")
+        print(f"Has unsaved changes? {self.history.dirty}")
 
-        if self.regions_data != self.original_regions: # 変更があるか確認
+        if self.history.dirty: # 変更があるか確認 (編集履歴の状態で判定し、領域リスト全体は比較しない)
             if messagebox.askyesno("確認", "変更を保存して閉じますか？"):
                 self.save_config()
-                self.main_app_callback() # main.pyに設定更新を通知
+        self.image_view.close() # タイル読み込みスレッドを停止
+        self.thumbnail_strip.close()
+        self.frame_loader.close()
+        self._heatmap_cancel.set() # 解析中であれば中断
+        self.image_source.close()
         self.master.destroy()
 
     def save_config(self):
-        self.current_config["image_regions_and_excel_coords"] = self.regions_data
-        try:
-            with open(self.config_path, 'w', encoding='utf-8') as f:
-                json.dump(self.current_config, f, indent=4, ensure_ascii=False)
-            messagebox.showinfo("保存", "設定ファイルに保存しました。")
-        except Exception as e:
-            error_message = f"設定ファイルの保存中にエラーが発生しました:\n{e}"
-            print(error_message) # コンソールにも出力
-            messagebox.showerror("保存エラー", error_message)
+        # 閉じる直前に呼ばれるため、編集中のリストをそのまま共有設定に渡す (コピーしない)
+        # ファイルへの書き込みはConfigStoreがまとめて行い、メインウィンドウには変更が通知される
+        self.config_store.set(REGIONS_KEY, self.regions_data, source=self)
+        self.history.mark_saved()
 
 if __name__ == '__main__':
     # 動作確認用のダミー設定と画像フォルダ
@@ -679,10 +946,11 @@ if __name__ == '__main__':
     dummy_config_path = os.path.join(current_dir, "config.json")
     dummy_image_folder = os.path.join(current_dir, "img")
 
-    # ダミーのコールバック関数
-    def dummy_callback():
-        print("Main app callback triggered (config reloaded).")
+    # 単体で起動した場合は遅延させずに保存する
+    config_store = ConfigStore(dummy_config_path)
+    config_store.load()
+    config_store.subscribe(lambda key, source: print(f"Config changed: {key}"))
 
-    app = RegionEditor(root, dummy_config_path, dummy_image_folder, dummy_callback)
+    app = RegionEditor(root, config_store, dummy_image_folder)
     root.mainloop()
 
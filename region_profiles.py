@@ -0,0 +1,191 @@
+import os
+import fnmatch
+import functools
+import threading
+import numpy as np
+from PIL import Image
+from alignment import RegionAligner, DEFAULT_SEARCH_RADIUS, DEFAULT_MIN_CONFIDENCE
+from image_normalize import normalize_image, orientation_transpose
+from region_table import RegionTable
+
+# 既定のプロファイル (config.json 直下の image_regions_and_excel_coords) の名前
+DEFAULT_PROFILE = "default"
+
+def dhash(image_file, hash_size=8, dead_zone=8):
+    """
+    画像の差分ハッシュ (dHash) を返す。縮小した輝度画像の隣り合う画素の大小関係をビット列にした整数。
+    帳票のように余白の多い画像では、ほぼ同じ明るさの画素同士の大小がノイズで入れ替わるため、
+    差が dead_zone 以下の組は「大きい」「小さい」のどちらのビットも立てない (上位 hash_size**2 ビットが
+    「右が明るい」、下位 hash_size**2 ビットが「右が暗い」)。
+    JPEGはdraftモードで縮小デコードするため、画像全体をデコードするより大幅に軽量です。
+    EXIFの向きは縮小後の画像に反映します (切り抜きと同じ向きの画像で比較するため)。
+    image_file には画像のパスまたはバイナリのファイルオブジェクトを指定します。
+    """
+    with Image.open(image_file) as img:
+        img.draft("L", (hash_size * 4, hash_size * 4))
+        gray = img.convert("L")
+        method = orientation_transpose(img)
+        if method is not None:
+            gray = gray.transpose(method)
+        small = gray.resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = np.asarray(small, dtype=np.int16)
+    diff = (pixels[:, 1:] - pixels[:, :-1]).flatten()
+    bits = np.concatenate([diff > dead_zone, diff < -dead_zone])
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+class RegionProfile:
+    """
+    名前付きの領域プロファイル。match の条件で、どの画像にこのプロファイルの領域を適用するかを判定します。
+    - filename_pattern: ファイル名のワイルドカード (例: "A_*.jpg")
+    - image_size: 画像サイズ [幅, 高さ]
+    - reference_image: 代表画像のパス (画像フォルダ・アーカイブ内の相対パスも可)。dHashが最も近いプロファイルを選ぶ
+    指定した条件は全て満たす必要があります。条件が1つも無いプロファイルは自動では選ばれません。
+    """
+    def __init__(self, name, regions_and_coords, match=None, image_source=None, hash_size=8):
+        self.name = name
+        self.region_table = RegionTable.from_records(regions_and_coords)
+        match = match or {}
+        self.filename_pattern = match.get("filename_pattern")
+        self.image_size = tuple(match["image_size"]) if match.get("image_size") else None
+        self.reference_image = match.get("reference_image")
+        self.reference_hash = None
+        self._image_source = image_source
+        if self.reference_image:
+            try:
+                with self.open_reference_file() as f:
+                    self.reference_hash = dhash(f, hash_size)
+            except Exception as e:
+                print(f"Error loading reference image for profile '{name}': {e}")
+
+    def open_reference_file(self):
+        """代表画像のファイルオブジェクトを返す。相対パスは画像フォルダ (またはアーカイブ) 内のパスとして扱う。"""
+        if os.path.isabs(self.reference_image) or self._image_source is None:
+            return open(self.reference_image, 'rb')
+        return self._image_source.open_file(self.reference_image)
+
+    @property
+    def has_conditions(self):
+        return bool(self.filename_pattern or self.image_size or self.reference_hash is not None)
+
+    def matches(self, filename, image_size):
+        """ファイル名とサイズの条件 (画素のデコードが不要な条件) を満たすかどうか。"""
+        if self.filename_pattern and not fnmatch.fnmatch(filename.lower(), self.filename_pattern.lower()):
+            return False
+        if self.image_size and tuple(image_size) != self.image_size:
+            return False
+        return True
+
+
+class RegionProfileSet:
+    """
+    画像ごとに適用する領域プロファイルを選び、その領域 (位置合わせを含む) を返すクラス。
+
+    判定は軽い順に行います: ファイル名 -> 画像サイズ (ヘッダーのみ) -> dHash (縮小デコード)。
+    dHashは、ファイル名・サイズの条件を満たし、かつ代表画像を持つプロファイルが候補にある場合だけ計算します。
+    どのプロファイルにも該当しない画像には、既定の領域 (image_regions_and_excel_coords) を使用します。
+
+    判定結果はプロファイルの情報のみを参照し、位置合わせ用のRegionAlignerの作成はロックで保護しているため、
+    複数のスレッドから同時に呼び出すことができます。
+    """
+    def __init__(self, image_source, regions_and_coords, region_profiles=None, alignment=None,
+                 max_hash_distance=12, hash_size=8):
+        self.image_source = image_source # image_source.ImageSource
+        self.alignment = alignment or {}
+        self.max_hash_distance = max_hash_distance
+        self.hash_size = hash_size
+        self.default_profile = RegionProfile(DEFAULT_PROFILE, regions_and_coords)
+        self.profiles = [
+            RegionProfile(name, profile.get("image_regions_and_excel_coords", []), profile.get("match"),
+                          image_source, hash_size)
+            for name, profile in (region_profiles or {}).items()
+        ]
+        self.profiles = [profile for profile in self.profiles if profile.has_conditions]
+        self._aligners = {} # RegionProfile -> RegionAligner (または None)。名前が既定と同じプロファイルもあるため、オブジェクトで引く
+        self._aligner_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.profiles) + 1
+
+    def classify(self, image_filename, image_size):
+        """
+        画像に適用するプロファイルを返します。
+
+        Args:
+            image_filename (str): 画像ファイル名 (画像フォルダからの相対パス、またはアーカイブのメンバー名)。
+            image_size (tuple): EXIFの向きを反映した画像の (幅, 高さ)。
+                                image_normalize.oriented_size で、Image.openの直後 (デコード前) に求められます。
+
+        Returns:
+            RegionProfile: 該当するプロファイル。該当なしの場合は既定のプロファイル。
+        """
+        candidates = [p for p in self.profiles if p.matches(os.path.basename(image_filename), image_size)]
+        hashed = [p for p in candidates if p.reference_hash is not None]
+        if hashed:
+            try:
+                with self.image_source.open_file(image_filename) as f:
+                    image_hash = dhash(f, self.hash_size)
+                distance, best = min(((hamming_distance(image_hash, p.reference_hash), p) for p in hashed),
+                                     key=lambda pair: pair[0])
+                if distance <= self.max_hash_distance:
+                    return best
+            except Exception as e:
+                print(f"Error computing image hash for {image_filename}: {e}")
+        for profile in candidates:
+            if profile.reference_hash is None:
+                return profile
+        return self.default_profile
+
+    def resolve(self, image_filename, img):
+        """
+        画像に適用するプロファイルと、切り抜き範囲のリスト (位置合わせが有効ならずれを補正したもの) を返します。
+
+        Args:
+            img (PIL.Image.Image): image_normalize.normalize_image で向きを反映した画像。
+
+        Returns:
+            tuple: (RegionProfile, [[left, upper, right, lower], ...])
+        """
+        profile = self.classify(image_filename, img.size)
+        return profile, self.regions_for(profile, image_filename, img)
+
+    def needs_alignment(self, profile):
+        """プロファイルの切り抜き範囲を、画像ごとに位置合わせするかどうか (する場合は画像全体のデコードが必要)。"""
+        return bool(self.alignment.get("enabled")) and len(profile.region_table) > 0
+
+    def regions_for(self, profile, image_filename, img):
+        """classify で判定したプロファイルの、画像 img に対する切り抜き範囲のリスト (位置合わせが有効ならずれを補正したもの)。"""
+        aligner = self._aligner_for(profile, image_filename)
+        if aligner is not None:
+            return aligner.align_regions(img)
+        return profile.region_table.img_regions()
+
+    def _aligner_for(self, profile, image_filename):
+        if not self.needs_alignment(profile):
+            return None
+        with self._aligner_lock:
+            if profile not in self._aligners:
+                # 基準画像: プロファイルの代表画像 -> (既定のプロファイルのみ) alignment.reference_image -> 最初に該当した画像
+                if profile.reference_image:
+                    reference_name = profile.reference_image
+                    open_reference = profile.open_reference_file
+                else:
+                    if profile is self.default_profile and self.alignment.get("reference_image"):
+                        reference_name = self.alignment["reference_image"]
+                    else:
+                        reference_name = image_filename
+                    open_reference = functools.partial(self.image_source.open_file, reference_name)
+                try:
+                    with open_reference() as f, Image.open(f) as reference_img:
+                        self._aligners[profile] = RegionAligner(
+                            normalize_image(reference_img), profile.region_table.boxes,
+                            search_radius=self.alignment.get("search_radius", DEFAULT_SEARCH_RADIUS),
+                            min_confidence=self.alignment.get("min_confidence", DEFAULT_MIN_CONFIDENCE),
+                        )
+                except Exception as e:
+                    print(f"Error loading alignment reference image {reference_name}: {e}")
+                    self._aligners[profile] = None
+            return self._aligners[profile]
@@ -0,0 +1,87 @@
+import numpy as np
+
+class RegionTable:
+    """
+    領域の一覧を列ごとの配列で保持するテーブル。
+    config.json の "image_regions_and_excel_coords" (辞書のリスト) と相互に変換でき、
+    数千件の領域でも座標のクリッピングなどの一括処理を、領域ごとのループなしで行えます。
+
+    - boxes: 領域の座標 [x1, y1, x2, y2] の配列 (領域数, 4)
+    - excel_pos: Excelセル座標の文字列のリスト
+    - extras: img_region / excel_pos 以外のキーを持つ領域の {インデックス: 追加項目} (書き出し時にそのまま戻す)
+    """
+    __slots__ = ("boxes", "excel_pos", "extras")
+
+    def __init__(self, boxes, excel_pos, extras=None):
+        self.boxes = boxes
+        self.excel_pos = excel_pos
+        self.extras = extras or {}
+
+    @classmethod
+    def from_records(cls, records):
+        """
+        config.json 形式の辞書のリストからテーブルを作成します。
+
+        Args:
+            records (list): 例: [{"img_region": [x1, y1, x2, y2], "excel_pos": "B2"}, ...]
+        """
+        boxes = np.array([item["img_region"] for item in records], dtype=np.float64).reshape(-1, 4)
+        if np.array_equal(boxes, np.round(boxes)):
+            boxes = boxes.astype(np.int64) # 通常は整数座標のみ
+        excel_pos = [item.get("excel_pos", "A1") for item in records]
+        extras = {}
+        for i, item in enumerate(records):
+            if len(item) > 2 or "excel_pos" not in item:
+                extra = {key: value for key, value in item.items() if key not in ("img_region", "excel_pos")}
+                if extra:
+                    extras[i] = extra
+        return cls(boxes, excel_pos, extras)
+
+    def to_records(self):
+        """config.json 形式の辞書のリストに変換します (座標は新しいリストとして作成されます)。"""
+        records = [{"img_region": box, "excel_pos": pos} for box, pos in zip(self.boxes.tolist(), self.excel_pos)]
+        for i, extra in self.extras.items():
+            records[i].update(extra)
+        return records
+
+    def __len__(self):
+        return len(self.excel_pos)
+
+    def img_regions(self):
+        """座標を [[x1, y1, x2, y2], ...] のリストで返します (Pillowのcropにそのまま渡せる形式)。"""
+        return self.boxes.tolist()
+
+    def with_boxes(self, boxes):
+        """座標だけを置き換えた新しいテーブルを返します (セル座標などは共有)。"""
+        return RegionTable(boxes, self.excel_pos, self.extras)
+
+    def clip_to_bounds(self, img_width, img_height, clip_margin=10):
+        """
+        画像の境界から clip_margin 内側に収まるよう全領域の座標をクリッピングした新しいテーブルを返します。
+        幅・高さが 2 * clip_margin + 1 未満になった領域は、画像内に収まる方向に広げます。
+        """
+        x1, x2 = _clip_axis(self.boxes[:, 0], self.boxes[:, 2], img_width, clip_margin)
+        y1, y2 = _clip_axis(self.boxes[:, 1], self.boxes[:, 3], img_height, clip_margin)
+        return self.with_boxes(np.stack([x1, y1, x2, y2], axis=1))
+
+
+def _clip_axis(start, end, size, clip_margin):
+    """1軸分の座標 (開始・終了の配列) をクリッピングし、最小サイズを保証して返す。"""
+    upper = size - clip_margin
+    # max(clip_margin, min(v, upper)) と同じ (upper < clip_margin の場合も clip_margin になる)
+    start = np.maximum(clip_margin, np.minimum(start, upper))
+    end = np.maximum(clip_margin, np.minimum(end, upper))
+    # 幅や高さが負にならないように正規化
+    start, end = np.minimum(start, end), np.maximum(start, end)
+
+    min_dim = 2 * clip_margin + 1 # 最小幅/高さはマージン2つ分+1px
+    too_small = end - start < min_dim
+    grow_end = too_small & (start + min_dim <= upper) # 終了側を広げられる
+    grow_start = too_small & ~grow_end & (end - min_dim >= clip_margin) # 開始側を広げられる
+    reset = too_small & ~grow_end & ~grow_start # どちらにも広げられない (非常に小さい画像の端など)
+
+    end = np.where(grow_end, start + min_dim, end)
+    start = np.where(grow_start, end - min_dim, start)
+    start = np.where(reset, clip_margin, start)
+    end = np.where(reset, clip_margin + min_dim, end)
+    return start, end
@@ -0,0 +1,78 @@
+from collections import defaultdict
+
+class GridIndex:
+    """
+    矩形を固定サイズのグリッドセルに登録する空間インデックス。
+    「ある点の下にある矩形はどれか」を、全矩形を走査せずに近傍セルの矩形だけで判定します。
+    キーには領域のインデックスなど任意のハッシュ可能な値を使用できます。
+    """
+    def __init__(self, cell_size=128):
+        self.cell_size = cell_size
+        self._rects = {} # key -> (x1, y1, x2, y2)
+        self._cells = defaultdict(set) # (col, row) -> set(key)
+
+    def __len__(self):
+        return len(self._rects)
+
+    def _cell_range(self, x1, y1, x2, y2):
+        col_start, col_end = int(x1 // self.cell_size), int(x2 // self.cell_size)
+        row_start, row_end = int(y1 // self.cell_size), int(y2 // self.cell_size)
+        for row in range(row_start, row_end + 1):
+            for col in range(col_start, col_end + 1):
+                yield col, row
+
+    def insert(self, key, rect):
+        if key in self._rects:
+            self.remove(key)
+        x1, y1, x2, y2 = rect
+        rect = (min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))
+        self._rects[key] = rect
+        for cell in self._cell_range(*rect):
+            self._cells[cell].add(key)
+
+    def remove(self, key):
+        rect = self._rects.pop(key, None)
+        if rect is None:
+            return
+        for cell in self._cell_range(*rect):
+            bucket = self._cells.get(cell)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._cells[cell]
+
+    def update(self, key, rect):
+        self.insert(key, rect)
+
+    def rebuild(self, rects):
+        """
+        インデックスを作り直す (領域の削除でインデックスがずれた場合など)。
+
+        Args:
+            rects (iterable): (key, rect) のペア。
+        """
+        self.clear()
+        for key, rect in rects:
+            self.insert(key, rect)
+
+    def clear(self):
+        self._rects.clear()
+        self._cells.clear()
+
+    def query_point(self, x, y, margin=0):
+        """
+        点 (x, y) を含む矩形のキーを返す。marginを指定すると矩形をその分だけ広げて判定する。
+
+        Returns:
+            list: 該当するキーのリスト (順不同)。
+        """
+        candidates = set()
+        for cell in self._cell_range(x - margin, y - margin, x + margin, y + margin):
+            candidates.update(self._cells.get(cell, ()))
+
+        hits = []
+        for key in candidates:
+            x1, y1, x2, y2 = self._rects[key]
+            if x1 - margin <= x <= x2 + margin and y1 - margin <= y <= y2 + margin:
+                hits.append(key)
+        return hits
@@ -0,0 +1,354 @@
+import math
+import queue
+import threading
+from collections import OrderedDict
+from PIL import Image, ImageTk
+from region_decode import can_read_regions, read_regions, region_block_height
+from image_normalize import orientation_transpose, oriented_size
+
+class ImagePyramid:
+    """
+    元画像を1/2ずつ縮小した多段解像度の画像列。
+    縮小表示のタイルは、表示倍率に最も近い (かつそれ以上の解像度を持つ) 段から切り出すため、
+    ホイール操作のたびに元画像全体を縮小する必要がありません。
+    一度作成した段はキャッシュされます。スレッドセーフではないため、1つのスレッドからのみ使用してください。
+
+    元画像全体をデコードしないよう、段は次のように作成します。
+    - JPEG: reopen で画像を開き直し、draft() で 1/2, 1/4, 1/8 の解像度で直接デコードする
+      (必要な段だけを作成するため、画面に合わせた縮小表示では元画像の解像度でデコードしない)。
+    - ストリップ・タイル形式のTIFF: 元画像の段 (0段目) の範囲は region_decode.read_regions で領域だけを読み込み、
+      1段目は元画像を帯状に読み込んで縮小しながら作成する。
+    - それ以外 (PNGなど、およびJPEGの0段目): 元画像全体をデコードする。
+    """
+    def __init__(self, pil_img, min_size=512, reopen=None, levels=None):
+        self.levels = {0: pil_img} # 段番号k -> 元画像の 1/2**k の画像 (作成済みの段のみ)
+        if levels:
+            self.levels.update(levels) # 先読み済みの縮小画像 (FrameLoader.preview_levels)
+        self.reopen = reopen # 元画像を遅延読み込みの状態で開き直す関数 (JPEGの縮小デコードに使う)
+        self.region_readable = pil_img.format == "TIFF" and can_read_regions(pil_img)
+        # 長辺が min_size 以下になる段までを作成する
+        self.level_count = 1
+        while max(pil_img.size) / 2 ** (self.level_count - 1) > min_size:
+            self.level_count += 1
+
+    @property
+    def complete(self):
+        return all(k in self.levels for k in range(self.level_count))
+
+    def build_next_level(self):
+        """未作成の段のうち、最も解像度の高い段を作成する (ワーカースレッドの空き時間に呼ばれる)。"""
+        for k in range(self.level_count):
+            if k not in self.levels:
+                self.level(k)
+                return
+
+    def stop_building(self):
+        """段の作成に失敗した場合に、作成できなかった段以降を使わないようにする。"""
+        self.level_count = next(k for k in range(self.level_count) if k not in self.levels)
+
+    def level(self, k):
+        """段kの画像を返す。未作成であればその場で作成する (JPEGは他の段を作成せずに直接デコードする)。"""
+        img = self.levels.get(k)
+        if img is None:
+            img = self._draft_level(k)
+            if img is None and k == 1 and self.region_readable:
+                img = self._reduce_by_bands()
+            if img is None:
+                img = _display_mode(self.level(k - 1)).reduce(2)
+            self.levels[k] = img
+        return img
+
+    def _draft_level(self, k):
+        # JPEGはDCTの段階で 1/2, 1/4, 1/8 に縮小してデコードできる (元画像全体のデコードより速く、メモリも1/4**k)
+        base = self.levels[0]
+        if self.reopen is None or k > 3 or base.format != "JPEG" or not base.tile:
+            return None
+        img = self.reopen()
+        if img.format != "JPEG" or not img.tile:
+            return None
+        img.draft(None, (base.width // 2 ** k, base.height // 2 ** k))
+        if img.size != (math.ceil(base.width / 2 ** k), math.ceil(base.height / 2 ** k)):
+            return None
+        img = _display_mode(img)
+        img.load()
+        return img
+
+    def _reduce_by_bands(self):
+        # 元画像を帯状に読み込んで縮小する (メモリは1段目の画像と帯1つ分だけで済む)
+        base = self.levels[0]
+        width, height = base.size
+        block = region_block_height(base)
+        band_height = max(block, 512 // block * block)
+        if band_height % 2:
+            band_height *= 2 # 帯の境界が縮小後の画素の境界と一致するように
+        level = None
+        for upper in range(0, height, band_height):
+            crops = read_regions(base, [(0, upper, width, min(upper + band_height, height))])
+            if crops is None:
+                return None
+            reduced = _display_mode(crops[0]).reduce(2)
+            if level is None:
+                level = Image.new(reduced.mode, (math.ceil(width / 2), math.ceil(height / 2)))
+            level.paste(reduced, (0, upper // 2))
+        return level
+
+    def level_for_scale(self, scale):
+        """
+        表示倍率に対して使用する段を返す。必要な段が未作成であればその場で作成する。
+
+        Returns:
+            tuple: (段番号k, 段の画像)
+        """
+        k = 0
+        while 2 ** (k + 1) <= 1 / scale and k + 1 < self.level_count:
+            k += 1
+        return k, self.level(k)
+
+    def resize_region(self, k, box, size, resample):
+        """
+        段kの画像の box (段の画像座標) の範囲を size に拡大縮小した画像を返す。
+        領域だけを読み込めるTIFFの0段目は、box と重なるストリップ・タイルだけをデコードする。
+        """
+        img = self.levels[k]
+        if k == 0 and self.region_readable:
+            left, upper = int(box[0]), int(box[1])
+            right, lower = math.ceil(box[2]), math.ceil(box[3])
+            crops = read_regions(img, [(left, upper, right, lower)])
+            if crops is not None: # 他の処理で画像全体が読み込まれた場合は None になる
+                img = crops[0]
+                box = (box[0] - left, box[1] - upper, box[2] - left, box[3] - upper)
+        img = _display_mode(img)
+        if (box[2] - box[0], box[3] - box[1]) == size and all(float(v).is_integer() for v in box):
+            return img.crop(tuple(int(v) for v in box))
+        return img.resize(size, resample, box=box)
+
+
+def _display_mode(img):
+    return img if img.mode in ("RGB", "RGBA", "L") else img.convert("RGB")
+
+def _swaps_axes(method):
+    return method in (Image.Transpose.TRANSPOSE, Image.Transpose.TRANSVERSE,
+                      Image.Transpose.ROTATE_90, Image.Transpose.ROTATE_270)
+
+def _unoriented_box(box, size, method):
+    """
+    向きを反映した画像の box を、元の向きの画像 (サイズ size) の範囲に変換する。
+    その範囲を切り出して method で transpose すると、向きを反映した画像の box の範囲と一致する。
+    """
+    width, height = size
+    x0, y0, x1, y1 = box
+    return {
+        Image.Transpose.FLIP_LEFT_RIGHT: (width - x1, y0, width - x0, y1),
+        Image.Transpose.FLIP_TOP_BOTTOM: (x0, height - y1, x1, height - y0),
+        Image.Transpose.ROTATE_180: (width - x1, height - y1, width - x0, height - y0),
+        Image.Transpose.TRANSPOSE: (y0, x0, y1, x1),
+        Image.Transpose.ROTATE_90: (width - y1, x0, width - y0, x1),
+        Image.Transpose.ROTATE_270: (y0, height - x1, y1, height - x0),
+        Image.Transpose.TRANSVERSE: (width - y1, height - x1, width - y0, height - x0),
+    }.get(method, box)
+
+
+class TiledImageView:
+    """
+    大きな画像をタイルに分割してCanvasに表示するビュー。
+    表示範囲に入ったタイルだけをバックグラウンドスレッドで切り出し、
+    メインスレッドでPhotoImageに変換して配置します。変換済みのタイルはLRUキャッシュで保持します。
+    表示倍率 (scale) を変更すると、ImagePyramidの最も近い段からタイルを作成します。
+    ワーカースレッドは要求が無い間にピラミッドの残りの段を作成しておきます。
+    元画像全体をデコードせずに済むのは、ストリップ・タイル形式のTIFF (表示範囲のタイルだけを読み込む) と、
+    JPEGの縮小表示 (reopen を指定した場合) です。その他の画像は、最初のタイルの作成時に画像全体をデコードします。
+    EXIFの向きは、元の向きのままの段の画像から切り出したタイルに対して反映します (座標は向きを反映した画像の座標)。
+
+    Tkinterはスレッドセーフではないため、ワーカースレッドはPILのタイル画像の生成のみを行い、
+    Canvasへの配置は after() によるポーリングでメインスレッドから行います。
+    """
+    def __init__(self, canvas, pil_img, tile_size=512, cache_size=96, prefetch_margin=1, scale=1.0, reopen=None,
+                 levels=None):
+        self.canvas = canvas
+        self.pil_img = pil_img # ワーカースレッドからのみピクセルを読み出す
+        # EXIFで回転・反転が指定された画像は、画像全体を回転せずに、タイルごとに回転・反転して表示する
+        self.transpose = orientation_transpose(pil_img)
+        self.width, self.height = oriented_size(pil_img)
+        self.tile_size = tile_size
+        self.cache_size = cache_size
+        self.prefetch_margin = prefetch_margin # 表示範囲の外側に先読みするタイル数
+        self.scale = scale
+
+        self._pyramid = ImagePyramid(pil_img, reopen=reopen, levels=levels) # ワーカースレッドからのみ使用
+        self._tiles = OrderedDict() # (scale, col, row) -> (PhotoImage, canvas item id)
+        self._pending = set() # ワーカーに要求済みのタイル (メインスレッドのみで更新)
+        self._wanted = frozenset() # 現在必要なタイル (ワーカーは参照のみ)
+        self._requests = queue.Queue()
+        self._results = queue.Queue()
+        self._refresh_scheduled = False
+        self._closed = False
+
+        self._update_scrollregion()
+
+        self._worker = threading.Thread(target=self._worker_loop, daemon=True)
+        self._worker.start()
+        self._poll_results()
+
+    @property
+    def display_width(self):
+        return max(1, round(self.width * self.scale))
+
+    @property
+    def display_height(self):
+        return max(1, round(self.height * self.scale))
+
+    # --- メインスレッド側 ---
+
+    def set_scale(self, scale):
+        """表示倍率を変更する。古い倍率のタイルは破棄され、新しい倍率で読み込み直される。"""
+        if scale == self.scale:
+            return
+        self.scale = scale
+        self.clear()
+        self._update_scrollregion()
+        self.schedule_refresh()
+
+    def schedule_refresh(self):
+        """スクロールやリサイズのたびに呼ばれても、アイドル時に1回だけ更新する。"""
+        if self._closed or self._refresh_scheduled:
+            return
+        self._refresh_scheduled = True
+        self.canvas.after_idle(self.refresh)
+
+    def refresh(self):
+        self._refresh_scheduled = False
+        if self._closed:
+            return
+
+        visible = self._visible_tile_keys(self.prefetch_margin)
+        self._wanted = frozenset(visible)
+        for key in visible:
+            if key in self._tiles:
+                self._tiles.move_to_end(key) # LRUの使用順を更新
+            elif key not in self._pending:
+                self._pending.add(key)
+                self._requests.put(key)
+
+    def clear(self):
+        """配置済みのタイルとキャッシュを破棄する (canvas.delete("all")の前後で呼ぶ)。"""
+        for _, item_id in self._tiles.values():
+            self.canvas.delete(item_id)
+        self._tiles.clear()
+
+    def close(self):
+        self._closed = True
+        self._wanted = frozenset()
+        self._requests.put(None) # ワーカースレッドを終了させる
+        self._tiles.clear()
+
+    def _update_scrollregion(self):
+        self.canvas.config(scrollregion=(0, 0, self.display_width, self.display_height))
+
+    def _visible_tile_keys(self, margin=0):
+        x0 = self.canvas.canvasx(0)
+        y0 = self.canvas.canvasy(0)
+        x1 = x0 + self.canvas.winfo_width()
+        y1 = y0 + self.canvas.winfo_height()
+
+        max_col = (self.display_width - 1) // self.tile_size
+        max_row = (self.display_height - 1) // self.tile_size
+        col_start = max(0, int(x0 // self.tile_size) - margin)
+        col_end = min(max_col, int(x1 // self.tile_size) + margin)
+        row_start = max(0, int(y0 // self.tile_size) - margin)
+        row_end = min(max_row, int(y1 // self.tile_size) + margin)
+
+        # 表示中心に近いタイルから要求する
+        center_col = (x0 + x1) / 2 / self.tile_size
+        center_row = (y0 + y1) / 2 / self.tile_size
+        keys = [(self.scale, col, row) for row in range(row_start, row_end + 1) for col in range(col_start, col_end + 1)]
+        keys.sort(key=lambda k: (k[1] + 0.5 - center_col) ** 2 + (k[2] + 0.5 - center_row) ** 2)
+        return keys
+
+    def _poll_results(self):
+        if self._closed:
+            return
+        try:
+            # 1回のポーリングで配置するタイル数を制限し、UIの応答性を保つ
+            for _ in range(8):
+                key, tile_img, skipped = self._results.get_nowait()
+                self._pending.discard(key)
+                if tile_img is not None and key in self._wanted and key not in self._tiles:
+                    self._place_tile(key, tile_img)
+                elif skipped and key in self._wanted:
+                    # スキップ後に再び表示範囲に入ったタイルは要求し直す
+                    self._pending.add(key)
+                    self._requests.put(key)
+        except queue.Empty:
+            pass
+        self.canvas.after(15, self._poll_results)
+
+    def _place_tile(self, key, tile_img):
+        _, col, row = key
+        photo = ImageTk.PhotoImage(tile_img)
+        item_id = self.canvas.create_image(col * self.tile_size, row * self.tile_size,
+                                           image=photo, anchor="nw", tags="image_tile")
+        self.canvas.tag_lower(item_id) # 領域の矩形より背面に表示
+        self._tiles[key] = (photo, item_id)
+
+        # キャッシュの上限を超えたら、最も長く使われていないタイルを破棄
+        while len(self._tiles) > self.cache_size:
+            _, (_, old_item_id) = self._tiles.popitem(last=False)
+            self.canvas.delete(old_item_id)
+
+    # --- ワーカースレッド側 ---
+
+    def _worker_loop(self):
+        while True:
+            try:
+                key = self._requests.get_nowait()
+            except queue.Empty:
+                if not self._pyramid.complete:
+                    # 要求が無い間にピラミッドの次の段を作成しておく
+                    try:
+                        self._pyramid.build_next_level()
+                    except Exception as e:
+                        print(f"縮小画像の作成中にエラーが発生しました: {e}")
+                        self._pyramid.stop_building()
+                    continue
+                key = self._requests.get()
+            if key is None:
+                break
+            if key not in self._wanted:
+                # 要求後にスクロールで表示範囲外になったタイルは切り出さない
+                self._results.put((key, None, True))
+                continue
+            try:
+                self._results.put((key, self._render_tile(key), False))
+            except Exception as e:
+                print(f"タイル {key} の読み込み中にエラーが発生しました: {e}")
+                self._results.put((key, None, False))
+
+    def _render_tile(self, key):
+        scale, col, row = key
+        display_width = max(1, round(self.width * scale))
+        display_height = max(1, round(self.height * scale))
+        left = col * self.tile_size
+        upper = row * self.tile_size
+        right = min(left + self.tile_size, display_width)
+        lower = min(upper + self.tile_size, display_height)
+
+        # 表示座標 -> 段の画像座標 (元画像座標 / 2**k) に変換して、その範囲だけを拡大縮小する
+        k, level_img = self._pyramid.level_for_scale(scale)
+        level_scale = scale * (2 ** k) # 段の画像から表示への倍率
+        level_width, level_height = level_img.size[::-1] if _swaps_axes(self.transpose) else level_img.size
+        box = (left / level_scale, upper / level_scale,
+               min(right / level_scale, level_width), min(lower / level_scale, level_height))
+        # 拡大時は画素の境界が分かるよう最近傍補間を使う
+        resample = Image.NEAREST if level_scale > 1 else Image.BILINEAR
+        size = (right - left, lower - upper)
+        if self.transpose is None:
+            tile_img = self._pyramid.resize_region(k, box, size, resample)
+        else:
+            # 段の画像は元の向きのまま保持し、タイルの範囲だけを切り出してから回転・反転する
+            # (段の画像のサイズは切り上げた値のため、反転の基準には元画像のサイズ / 2**k を使う)
+            level_size = (self.pil_img.width / 2 ** k, self.pil_img.height / 2 ** k)
+            tile_img = self._pyramid.resize_region(k, _unoriented_box(box, level_size, self.transpose),
+                                                   size[::-1] if _swaps_axes(self.transpose) else size, resample)
+            tile_img = tile_img.transpose(self.transpose)
+        tile_img.load()
+        return tile_img
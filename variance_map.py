@@ -0,0 +1,176 @@
+import os
+import json
+import numpy as np
+from PIL import Image
+from image_normalize import orientation_transpose, oriented_size
+
+# フォルダごとの解析結果のキャッシュ (画像フォルダ内の隠しフォルダに保存)
+CACHE_DIR_NAME = ".image_to_office_cache"
+CACHE_FILE_NAME = "variance_map.npz"
+
+class VarianceMap:
+    """
+    フォルダ内の全画像を縮小した輝度画像について、画素ごとの平均・分散 (Welford法) を逐次的に集計したもの。
+    分散が大きい画素は画像ごとに内容が変わる (= 文字などが入る) 位置を示します。
+    座標は基準画像 (最初の画像) のピクセル座標と、縮小グリッドの比率で対応付けます。
+    """
+    def __init__(self, grid_size, reference_size):
+        self.grid_size = tuple(grid_size) # (幅, 高さ)
+        self.reference_size = tuple(reference_size) # 基準画像の (幅, 高さ)
+        width, height = self.grid_size
+        self.count = 0
+        self.mean = np.zeros((height, width), dtype=np.float64)
+        self.m2 = np.zeros((height, width), dtype=np.float64)
+        self.signatures = [] # 集計済みの画像の [ファイル名, サイズ, 更新時刻]
+
+    @classmethod
+    def for_image_size(cls, reference_size, max_grid_side=512):
+        ratio = min(1.0, max_grid_side / max(reference_size))
+        grid_size = (max(1, round(reference_size[0] * ratio)), max(1, round(reference_size[1] * ratio)))
+        return cls(grid_size, reference_size)
+
+    def add_image(self, img):
+        """画像を縮小デコードして集計に加える。"""
+        # JPEGはグリッドに近い解像度で直接デコードする
+        img.draft("L", self.grid_size)
+        gray = img.convert("L")
+        method = orientation_transpose(img) # 領域の座標と同じ、EXIFの向きを反映した画像で集計する
+        if method is not None:
+            gray = gray.transpose(method)
+        gray = gray.resize(self.grid_size, Image.BILINEAR)
+        x = np.asarray(gray, dtype=np.float64)
+
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+    @property
+    def variance(self):
+        if self.count < 2:
+            return np.zeros_like(self.mean)
+        return self.m2 / (self.count - 1)
+
+    def heat(self):
+        """
+        0〜1に正規化したヒートマップ。画像間の輝度の標準偏差を、外れ値に引きずられないよう99パーセンタイルで正規化する。
+        """
+        std = np.sqrt(self.variance)
+        scale = np.percentile(std, 99) if std.size else 0
+        if scale <= 0:
+            return np.zeros_like(std)
+        return np.clip(std / scale, 0.0, 1.0)
+
+    def region_clip_scores(self, img_regions, heat=None):
+        """
+        各領域の枠線上のヒートの平均を返す。値が大きいほど、画像ごとに変化する内容が枠をまたいでいる
+        (= 後続の画像で内容が領域からはみ出している) 可能性が高い。
+
+        Args:
+            img_regions (list): [x1, y1, x2, y2] (基準画像のピクセル座標) のリスト。
+        Returns:
+            list: 領域ごとのスコア (0〜1)。
+        """
+        if heat is None:
+            heat = self.heat()
+        grid_height, grid_width = heat.shape
+        sx = grid_width / self.reference_size[0]
+        sy = grid_height / self.reference_size[1]
+
+        scores = []
+        for x1, y1, x2, y2 in img_regions:
+            gx1 = int(np.clip(round(x1 * sx), 0, grid_width - 1))
+            gx2 = int(np.clip(round(x2 * sx), 0, grid_width - 1))
+            gy1 = int(np.clip(round(y1 * sy), 0, grid_height - 1))
+            gy2 = int(np.clip(round(y2 * sy), 0, grid_height - 1))
+            border = np.concatenate([
+                heat[gy1, gx1:gx2 + 1], heat[gy2, gx1:gx2 + 1],
+                heat[gy1:gy2 + 1, gx1], heat[gy1:gy2 + 1, gx2],
+            ])
+            scores.append(float(border.mean()) if border.size else 0.0)
+        return scores
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp.npz"
+        np.savez_compressed(
+            tmp_path, mean=self.mean, m2=self.m2,
+            count=np.array(self.count), grid_size=np.array(self.grid_size),
+            reference_size=np.array(self.reference_size),
+            signatures=np.array(json.dumps(self.signatures)),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            variance_map = cls(tuple(int(v) for v in data["grid_size"]), tuple(int(v) for v in data["reference_size"]))
+            variance_map.mean = data["mean"]
+            variance_map.m2 = data["m2"]
+            variance_map.count = int(data["count"])
+            variance_map.signatures = json.loads(str(data["signatures"]))
+        return variance_map
+
+
+def compute_variance_map(image_source, image_files, use_cache=True, progress_callback=None, cancel_event=None):
+    """
+    フォルダ内の画像を1枚ずつ縮小デコードしてVarianceMapを集計します。
+    キャッシュがある場合は、集計済みの画像を読み飛ばし、追加された画像だけを集計します
+    (既存の画像が変更・削除された場合は最初から集計し直します)。
+
+    Args:
+        image_source (image_source.ImageSource): 画像の読み込み元 (画像フォルダまたはアーカイブ)。
+        image_files (list): 集計する画像ファイル名のリスト (先頭の画像を基準画像とする)。
+        use_cache (bool): フォルダ内 (アーカイブの場合はアーカイブと同じフォルダ) のキャッシュを使用・更新するかどうか。
+        progress_callback (callable, optional): progress_callback(処理済み枚数, 全枚数) の形式で呼ばれる。
+        cancel_event (threading.Event, optional): セットされると集計を中断して None を返す。
+
+    Returns:
+        VarianceMap: 集計結果。画像がない場合や中断された場合は None。
+    """
+    if not image_files:
+        return None
+    cache_path = os.path.join(image_source.cache_dir(CACHE_DIR_NAME), CACHE_FILE_NAME)
+    signatures = {}
+    for filename in image_files:
+        try:
+            signatures[filename] = image_source.signature(filename)
+        except (OSError, KeyError):
+            continue
+
+    variance_map = None
+    if use_cache and os.path.exists(cache_path):
+        try:
+            cached = VarianceMap.load(cache_path)
+            # 集計済みの画像が全て変わらず存在する場合のみ、キャッシュを引き継ぐ
+            if all(signatures.get(sig[0]) == sig for sig in cached.signatures):
+                variance_map = cached
+        except Exception as e:
+            print(f"ばらつき解析のキャッシュを読み込めませんでした: {e}")
+
+    done = {sig[0] for sig in variance_map.signatures} if variance_map else set()
+    remaining = [f for f in image_files if f in signatures and f not in done]
+
+    if variance_map is None:
+        with image_source.open_image(image_files[0]) as first_img:
+            variance_map = VarianceMap.for_image_size(oriented_size(first_img))
+
+    total = len(done) + len(remaining)
+    for processed, filename in enumerate(remaining, start=len(done) + 1):
+        if cancel_event is not None and cancel_event.is_set():
+            return None
+        try:
+            with image_source.open_image(filename) as img:
+                variance_map.add_image(img)
+            variance_map.signatures.append(signatures[filename])
+        except Exception as e:
+            print(f"画像 '{filename}' の解析中にエラーが発生しました: {e}")
+        if progress_callback is not None:
+            progress_callback(processed, total)
+
+    if use_cache and remaining:
+        try:
+            variance_map.save(cache_path)
+        except Exception as e:
+            print(f"ばらつき解析のキャッシュを保存できませんでした: {e}")
+    return variance_map
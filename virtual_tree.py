@@ -0,0 +1,164 @@
+import tkinter as tk
+from tkinter import ttk
+
+class VirtualTreeview:
+    """
+    行数の多い一覧を表示するための仮想リスト。
+    ttk.Treeviewには表示範囲に収まる行 (スロット) だけを作成し、スクロールのたびに
+    スロットの表示内容を差し替えます。データの変更時も、表示中の行のうち値が変わった行だけを更新するため、
+    数千行の一覧でも再表示のコストは表示行数分で済みます。
+
+    行のデータは row_count() と row_values(index) で必要な分だけ取得します。
+    選択状態はデータのインデックスの集合 (selected) として保持し、スクロールしても維持されます。
+    """
+    def __init__(self, master, columns, row_count, row_values, wheel_rows=3):
+        self.row_count = row_count # 行数を返す関数
+        self.row_values = row_values # row_values(index) -> 表示する値のタプル
+        self.wheel_rows = wheel_rows
+        self.offset = 0 # 先頭のスロットに表示しているデータのインデックス
+        self.visible_rows = 20 # 表示できる行数 (ウィジェットのサイズから計算し直す)
+        self.selected = set()
+        self._slots = [] # スロットのTreeview item id (上から順)
+        self._slot_numbers = {} # item id -> スロット番号 (item id からデータのインデックスへの変換用)
+        self._shown_values = {} # item id -> 表示中の値
+        self._focus_index = None
+        self._replace_selection = False
+        self._refresh_scheduled = False
+
+        self.frame = tk.Frame(master)
+        self.tree = ttk.Treeview(self.frame, columns=columns, show="headings", selectmode="extended")
+        self.scrollbar = ttk.Scrollbar(self.frame, orient="vertical", command=self._on_scrollbar)
+        self.scrollbar.pack(side="right", fill="y")
+        self.tree.pack(side="left", fill="both", expand=True)
+
+        self.tree.bind("<Configure>", self._on_configure)
+        self.tree.bind("<MouseWheel>", self._on_mouse_wheel) # Windows/macOS
+        self.tree.bind("<Button-4>", lambda event: self.scroll_by(-self.wheel_rows)) # Linux Scroll up
+        self.tree.bind("<Button-5>", lambda event: self.scroll_by(self.wheel_rows)) # Linux Scroll down
+        self.tree.bind("<ButtonPress-1>", self._on_button_press)
+        self.tree.bind("<<TreeviewSelect>>", self._on_select)
+        self.tree.bind("<Up>", lambda event: self._move_focus(-1))
+        self.tree.bind("<Down>", lambda event: self._move_focus(1))
+        self.tree.bind("<Prior>", lambda event: self._move_focus(-self.visible_rows)) # Page Up
+        self.tree.bind("<Next>", lambda event: self._move_focus(self.visible_rows)) # Page Down
+
+    def index_of(self, item_id):
+        """スロットの item id に表示しているデータのインデックスを返す。"""
+        return self.offset + self._slot_numbers[item_id]
+
+    def selected_indices(self):
+        return sorted(self.selected)
+
+    def clear_selection(self):
+        self.selected = set()
+        self._focus_index = None
+        self.refresh()
+
+    def scroll_by(self, rows):
+        self.offset += rows
+        self.refresh()
+
+    def see(self, index):
+        """データのインデックス index の行が表示されるようにスクロールする。"""
+        if index < self.offset:
+            self.offset = index
+        elif index >= self.offset + self.visible_rows:
+            self.offset = index - self.visible_rows + 1
+        self.refresh()
+
+    def schedule_refresh(self):
+        if self._refresh_scheduled:
+            return
+        self._refresh_scheduled = True
+        self.tree.after_idle(self.refresh)
+
+    def refresh(self):
+        """表示範囲の行だけを、値が変わったものに限って更新する。"""
+        self._refresh_scheduled = False
+        count = self.row_count()
+        self.offset = max(0, min(self.offset, count - self.visible_rows))
+        needed = min(self.visible_rows, count - self.offset)
+
+        # スロット数を表示行数に合わせる
+        while len(self._slots) < needed:
+            item_id = self.tree.insert("", "end")
+            self._slot_numbers[item_id] = len(self._slots)
+            self._slots.append(item_id)
+            self._shown_values[item_id] = None
+        while len(self._slots) > needed:
+            item_id = self._slots.pop()
+            self.tree.delete(item_id)
+            del self._slot_numbers[item_id]
+            del self._shown_values[item_id]
+
+        for slot, item_id in enumerate(self._slots):
+            values = tuple(self.row_values(self.offset + slot))
+            if self._shown_values[item_id] != values:
+                self.tree.item(item_id, values=values)
+                self._shown_values[item_id] = values
+
+        # 選択状態をスロットに反映
+        wanted = [item_id for slot, item_id in enumerate(self._slots) if self.offset + slot in self.selected]
+        if set(wanted) != set(self.tree.selection()):
+            self.tree.selection_set(wanted)
+        if self._focus_index is not None and self.offset <= self._focus_index < self.offset + needed:
+            self.tree.focus(self._slots[self._focus_index - self.offset])
+
+        if count:
+            self.scrollbar.set(self.offset / count, (self.offset + needed) / count)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def _on_configure(self, event):
+        # 1行目の位置と高さから、ウィジェットに収まる行数を求める
+        bbox = self.tree.bbox(self._slots[0]) if self._slots else None
+        if bbox:
+            heading_height, row_height = bbox[1], bbox[3]
+        else:
+            heading_height, row_height = 24, 20
+        visible_rows = max(1, (event.height - heading_height) // max(1, row_height))
+        if visible_rows != self.visible_rows:
+            self.visible_rows = visible_rows
+            self.schedule_refresh()
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        count = self.row_count()
+        if action == "moveto":
+            self.offset = int(float(amount) * count)
+        elif unit == "pages":
+            self.offset += int(amount) * self.visible_rows
+        else:
+            self.offset += int(amount)
+        self.refresh()
+
+    def _on_mouse_wheel(self, event):
+        self.scroll_by(-self.wheel_rows if event.delta > 0 else self.wheel_rows)
+        return "break"
+
+    def _on_button_press(self, event):
+        # 修飾キー (Shift: 0x1, Control: 0x4) なしのクリックは、表示範囲外の選択も解除する
+        self._replace_selection = not (event.state & 0x0005)
+        item_id = self.tree.identify_row(event.y)
+        if item_id in self._slot_numbers:
+            self._focus_index = self.index_of(item_id)
+
+    def _on_select(self, event):
+        visible_selection = {self.index_of(item_id) for item_id in self.tree.selection() if item_id in self._slot_numbers}
+        if self._replace_selection:
+            self._replace_selection = False
+            self.selected = visible_selection
+        else:
+            # 表示範囲内の選択だけをTreeviewの状態で置き換え、範囲外の選択は維持する
+            shown = range(self.offset, self.offset + len(self._slots))
+            self.selected = {i for i in self.selected if i not in shown} | visible_selection
+
+    def _move_focus(self, delta):
+        count = self.row_count()
+        if not count:
+            return "break"
+        current = self._focus_index if self._focus_index is not None else self.offset
+        new_index = max(0, min(count - 1, current + delta))
+        self._focus_index = new_index
+        self.selected = {new_index}
+        self.see(new_index)
+        return "break"
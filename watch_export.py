@@ -0,0 +1,195 @@
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+from config_store import ConfigStore
+from image_source import FolderScanner, list_image_files
+from office_export import OUTPUT_FORMATS, OUTPUT_EXTENSIONS, run_exports
+
+JOURNAL_FILE_NAME = ".watch_journal.jsonl"
+
+def _load_journal(journal_path):
+    """
+    出力済みのバッチの記録を読み込む。
+
+    Returns:
+        tuple: (出力済みの画像の相対パスのセット, 次のバッチ番号)
+    """
+    exported = set()
+    next_batch = 1
+    if not os.path.exists(journal_path):
+        return exported, next_batch
+    with open(journal_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue # 書き込み途中で中断された行は無視する
+            exported.update(entry["files"])
+            next_batch = max(next_batch, entry["batch"] + 1)
+    return exported, next_batch
+
+def _append_journal(journal_path, entry):
+    with open(journal_path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class WatchExporter:
+    """
+    画像フォルダ (サブフォルダを含む) を監視し、書き込みが完了した新しい画像を一定数または一定時間ごとにまとめて、
+    既存のExcel/PowerPoint出力処理でバッチごとの出力ファイル (<name>_00001.xlsx など) に書き出します。
+
+    出力済みの画像は出力フォルダのジャーナルに記録し、再起動しても同じ画像を出力し直しません。
+    画像が置かれてから出力されるまでの時間は、おおよそ
+    settle_seconds + poll_interval + max_wait_seconds + 1バッチの出力時間 以内に収まります。
+    出力に失敗したバッチ (設定ファイルの誤りや保存の失敗など) は監視を止めずに待たせておき、
+    retry_seconds ごとに同じバッチ番号で出力し直します。
+    """
+    def __init__(self, image_folder_path, output_dir, config_store, formats=("excel",), name="output_images",
+                 batch_size=200, max_wait_seconds=60.0, poll_interval=5.0, settle_seconds=2.0, retry_seconds=60.0):
+        self.image_folder_path = image_folder_path
+        self.output_dir = output_dir
+        self.config_store = config_store
+        self.formats = formats
+        self.name = name
+        self.batch_size = batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self.poll_interval = poll_interval
+        self.retry_seconds = retry_seconds
+        self.journal_path = os.path.join(output_dir, JOURNAL_FILE_NAME)
+        self.scanner = FolderScanner(image_folder_path, recursive=True, settle_seconds=settle_seconds)
+        self._config_error = None # 設定ファイルの内容に問題がある間は、その例外を保持して出力しない
+
+        os.makedirs(output_dir, exist_ok=True)
+        exported, self.next_batch = _load_journal(self.journal_path)
+        self.scanner.mark_known(exported)
+        self.exported = exported
+
+    def run_once(self):
+        """
+        監視せずに、未出力の画像を全てバッチに分けて出力する。
+
+        Returns:
+            bool: 全てのバッチを出力できた場合は True (失敗したバッチは次回の実行で出力し直す)。
+        """
+        pending = [f for f in list_image_files(self.image_folder_path, recursive=True) if f not in self.exported]
+        self.scanner.mark_known(pending)
+        failed = 0
+        for start in range(0, len(pending), self.batch_size):
+            if not self.export_batch(pending[start:start + self.batch_size]):
+                failed += 1
+        print(f"Exported {len(pending)} new image(s)." if not failed else
+              f"Exported {len(pending)} new image(s); {failed} batch(es) failed and will be retried on the next run.")
+        return failed == 0
+
+    def watch(self):
+        """新しい画像を監視し続ける (Ctrl+Cで終了)。終了時に溜まっている画像も出力する。"""
+        batch = []
+        oldest_arrival = None
+        retry_at = None # 出力に失敗したバッチを出力し直す時刻
+        print(f"Watching {self.image_folder_path} (Ctrl+C to stop)")
+        try:
+            while True:
+                ready = self.scanner.scan()
+                if ready:
+                    batch.extend(ready)
+                    if oldest_arrival is None:
+                        oldest_arrival = time.monotonic()
+                if retry_at is None or time.monotonic() >= retry_at:
+                    retry_at = None
+                    # 失敗したバッチは先頭に残したまま、retry_seconds 後に出力し直す
+                    while batch and (len(batch) >= self.batch_size or time.monotonic() - oldest_arrival >= self.max_wait_seconds):
+                        if not self.export_batch(batch[:self.batch_size]):
+                            retry_at = time.monotonic() + self.retry_seconds
+                            print(f"Retrying in {self.retry_seconds:g} seconds.")
+                            break
+                        batch = batch[self.batch_size:]
+                        oldest_arrival = time.monotonic() if batch else None
+                time.sleep(self.poll_interval)
+        except KeyboardInterrupt:
+            while batch and self.export_batch(batch[:self.batch_size]):
+                batch = batch[self.batch_size:]
+            if batch:
+                print(f"{len(batch)} image(s) were not exported; they will be exported on the next run.")
+
+    def _reload_config(self):
+        # 監視中に設定ファイルが編集されていれば反映する (変更が無ければファイルは開かない)。
+        # 内容に問題がある場合は、修正されるまで (次に書き換えられるまで) 出力しない
+        try:
+            if self.config_store.reload_if_changed():
+                self._config_error = None
+        except Exception as e:
+            self._config_error = e
+        if self._config_error is not None:
+            raise self._config_error
+
+    def export_batch(self, image_files):
+        """
+        画像を1つのバッチとして出力する。例外は送出せず、失敗した場合は理由を表示して False を返す。
+
+        Returns:
+            bool: 全ての出力ファイルを保存できた場合は True (出力済みとしてジャーナルに記録する)。
+        """
+        batch_number = self.next_batch
+        print(f"Exporting batch {batch_number}: {len(image_files)} image(s)")
+        try:
+            self._reload_config()
+            formats = [output_format for output_format in OUTPUT_FORMATS if output_format in self.formats]
+            outputs = [os.path.join(self.output_dir, f"{self.name}_{batch_number:05d}{OUTPUT_EXTENSIONS[output_format]}")
+                       for output_format in formats]
+            # 画像のデコードと切り抜きは、全ての出力形式で1回だけ行う
+            results = run_exports(list(zip(formats, outputs)), self.image_folder_path, self.config_store.data, image_files)
+            for output_path, saved in zip(outputs, results):
+                if not saved:
+                    raise RuntimeError(f"{os.path.basename(output_path)} could not be saved")
+        except Exception as e:
+            print(f"Error: batch {batch_number} failed: {e}")
+            return False
+
+        # 出力ファイルが全て保存できた場合のみ、出力済みとして記録する
+        _append_journal(self.journal_path, {"batch": batch_number, "files": image_files,
+                                            "outputs": [os.path.basename(path) for path in outputs],
+                                            "time": time.strftime("%Y-%m-%d %H:%M:%S")})
+        self.exported.update(image_files)
+        self.next_batch += 1
+        return True
+
+
+def main(argv=None):
+    multiprocessing.freeze_support() # exe化した場合に画像処理の子プロセスが正しく起動するように
+    parser = argparse.ArgumentParser(description="画像フォルダを監視し、新しい画像をバッチごとにExcel/PowerPoint/PDF/HTMLへ出力します。")
+    parser.add_argument("image_folder", help="監視する画像フォルダ (サブフォルダも対象)")
+    parser.add_argument("output_dir", help="出力ファイルとジャーナルを保存するフォルダ")
+    parser.add_argument("--config", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json"),
+                        help="設定ファイルのパス (既定: スクリプトと同じフォルダの config.json)")
+    parser.add_argument("--format", nargs="+", choices=OUTPUT_FORMATS, default=["excel"], help="出力形式")
+    parser.add_argument("--name", default="output_images", help="出力ファイル名の先頭部分")
+    parser.add_argument("--batch-size", type=int, default=200, help="1つの出力ファイルにまとめる画像の最大数")
+    parser.add_argument("--max-wait", type=float, default=60.0, help="画像が揃うのを待つ最大秒数 (これを過ぎると少数でも出力)")
+    parser.add_argument("--interval", type=float, default=5.0, help="フォルダを走査する間隔 (秒)")
+    parser.add_argument("--settle", type=float, default=2.0, help="書き込み完了とみなすまでにファイルが変化しない秒数")
+    parser.add_argument("--retry", type=float, default=60.0, help="出力に失敗したバッチを出力し直すまでの秒数")
+    parser.add_argument("--once", action="store_true", help="監視せず、未出力の画像を出力して終了する")
+    args = parser.parse_args(argv)
+
+    config_store = ConfigStore(args.config)
+    try:
+        config_store.load()
+    except Exception as e:
+        print(f"Error loading config file {args.config}: {e}")
+        return 1
+
+    exporter = WatchExporter(args.image_folder, args.output_dir, config_store, formats=args.format, name=args.name,
+                             batch_size=args.batch_size, max_wait_seconds=args.max_wait,
+                             poll_interval=args.interval, settle_seconds=args.settle, retry_seconds=args.retry)
+    if args.once:
+        return 0 if exporter.run_once() else 1
+    exporter.watch()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())